@@ -0,0 +1,298 @@
+"""Admission control in front of the database.
+
+Every request first passes two token buckets, one for its client and one for
+its route, and then a concurrency limiter sized to the connection pool.
+Requests over a rate limit get 429, requests that find the limiter and its
+short wait queue full get 503; both carry Retry-After. Bursts are shed at the
+edge instead of piling onto Postgres until it refuses connections.
+"""
+import asyncio
+import math
+import os
+import threading
+import time
+from collections import deque
+
+from starlette.routing import Match
+
+import metrics
+
+# Requests per second and burst size for each client, on any route
+RATE_LIMIT = os.getenv("RATE_LIMIT", "20/40")
+# Per-route overrides: "METHOD /path=client_rate/client_burst[,route_rate/route_burst];..."
+# The optional second bucket is shared by all clients of that route.
+RATE_LIMIT_ROUTES = os.getenv(
+    "RATE_LIMIT_ROUTES",
+    "POST /api/login=1/10,50/100;POST /api/signup=0.2/5,20/40;POST /api/applications=2/10,100/200",
+)
+# Requests handled at once per process; defaults to the pool size so every
+# admitted request can get a connection without queueing inside the pool
+MAX_CONCURRENCY = int(os.getenv("ADMISSION_MAX_CONCURRENCY", os.getenv("DB_POOL_MAX_SIZE", "10")))
+QUEUE_SIZE = int(os.getenv("ADMISSION_QUEUE_SIZE", str(MAX_CONCURRENCY * 2)))
+# Seconds a request may wait in the queue before it is shed
+QUEUE_TIMEOUT = float(os.getenv("ADMISSION_QUEUE_TIMEOUT", "1"))
+# Honour X-Forwarded-For; only enable behind a proxy that sets it
+TRUST_PROXY = os.getenv("TRUST_PROXY_HEADERS", "false").lower() == "true"
+
+# Paths that never count against the limits: probes, metrics and the
+# long-lived change stream, which would otherwise hold a slot for hours
+EXEMPT_PATHS = ("/", "/metrics", "/api/health", "/api/health/live", "/api/health/ready", "/api/applications/changes")
+
+shed_total = metrics.registry.counter(
+    "http_requests_shed_total", "Requests rejected by admission control", ("route", "reason"))
+
+
+class Overloaded(Exception):
+    """Raised when the concurrency limiter and its queue are full."""
+
+
+class Rule:
+    __slots__ = ("rate", "burst")
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+
+    @classmethod
+    def parse(cls, text):
+        rate, _, burst = text.strip().partition("/")
+        rate = float(rate)
+        return cls(rate, float(burst) if burst else max(1.0, rate))
+
+    def __repr__(self):
+        return f"{self.rate:g}/{self.burst:g}"
+
+
+def parse_route_rules(spec):
+    """Parse RATE_LIMIT_ROUTES into {"METHOD /path": (client_rule, route_rule or None)}."""
+    rules = {}
+    for item in filter(None, (part.strip() for part in spec.split(";"))):
+        route, sep, limits = item.partition("=")
+        if not sep or " " not in route.strip():
+            raise ValueError(f"RATE_LIMIT_ROUTES entries must look like 'POST /path=rate/burst', got {item!r}")
+        client, _, shared = limits.partition(",")
+        rules[" ".join(route.split())] = (Rule.parse(client), Rule.parse(shared) if shared else None)
+    return rules
+
+
+class MemoryBackend:
+    """Token buckets kept in this process; each worker enforces its own share."""
+
+    def __init__(self, max_keys=100_000):
+        self.max_keys = max_keys
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def take(self, key, rule, now=None):
+        """Take one token; return 0 if allowed, else seconds until one is available."""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (rule.burst, now))
+            tokens = min(rule.burst, tokens + (now - updated) * rule.rate)
+            if tokens >= 1:
+                self._buckets[key] = (tokens - 1, now)
+                return 0.0
+            self._buckets[key] = (tokens, now)
+            if len(self._buckets) > self.max_keys:
+                self._prune(now)
+            return (1 - tokens) / rule.rate if rule.rate > 0 else 60.0
+
+    def _prune(self, now):
+        # Buckets idle long enough to be full again carry no state worth keeping
+        self._buckets = {k: v for k, v in self._buckets.items() if now - v[1] < 60}
+
+
+class RedisBackend:
+    """Token buckets shared by all workers, stored in Redis. Requires the ``redis`` package."""
+
+    # Refill and take in one atomic step; returns the wait in milliseconds (0 = allowed)
+    SCRIPT = """
+        local rate, burst, now = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+        local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+        local tokens = tonumber(state[1]) or burst
+        local updated = tonumber(state[2]) or now
+        tokens = math.min(burst, tokens + math.max(0, now - updated) * rate)
+        local wait = 0
+        if tokens >= 1 then tokens = tokens - 1
+        elseif rate > 0 then wait = math.ceil((1 - tokens) / rate * 1000)
+        else wait = 60000 end
+        redis.call('HSET', KEYS[1], 'tokens', tokens, 'updated', now)
+        redis.call('PEXPIRE', KEYS[1], math.ceil(burst / math.max(rate, 0.001) * 1000) + 1000)
+        return wait
+    """
+
+    def __init__(self, url, prefix="passport:ratelimit:"):
+        try:
+            import redis
+        except ImportError as e:
+            raise RuntimeError("RATE_LIMIT_BACKEND=redis requires the redis package (pip install redis)") from e
+        self._client = redis.Redis.from_url(url)
+        self._script = self._client.register_script(self.SCRIPT)
+        self.prefix = prefix
+
+    def take(self, key, rule, now=None):
+        # Wall-clock time, since the buckets are shared between hosts
+        now = time.time() if now is None else now
+        return self._script(keys=[self.prefix + key], args=[rule.rate, rule.burst, now]) / 1000
+
+
+class RateLimiter:
+    """Applies the per-client bucket and, where configured, the shared per-route bucket."""
+
+    def __init__(self, backend, default, routes=None):
+        self.backend = backend
+        self.default = default
+        self.routes = routes or {}
+
+    @classmethod
+    def from_env(cls):
+        kind = os.getenv("RATE_LIMIT_BACKEND", "memory").lower()
+        if kind == "none":
+            return None
+        if kind == "redis":
+            backend = RedisBackend(os.getenv("RATE_LIMIT_REDIS_URL", "redis://localhost:6379/1"))
+        else:
+            backend = MemoryBackend()
+        return cls(backend, Rule.parse(RATE_LIMIT), parse_route_rules(RATE_LIMIT_ROUTES))
+
+    def check(self, client, route):
+        """Return 0 if the request may proceed, else the seconds to wait before retrying."""
+        client_rule, route_rule = self.routes.get(route, (self.default, None))
+        # The per-client bucket is per route when the route has its own rule,
+        # so a login burst does not use up the client's allowance elsewhere
+        scope = route if route in self.routes else "*"
+        wait = self.backend.take(f"client:{client}:{scope}", client_rule)
+        if wait or route_rule is None:
+            return wait
+        return self.backend.take(f"route:{route}", route_rule)
+
+
+class ConcurrencyLimiter:
+    """At most ``limit`` requests in flight, ``queue_size`` more waiting up to ``timeout`` seconds.
+
+    A released slot is handed straight to the oldest waiter, so queued
+    requests are served in arrival order and newcomers cannot overtake them.
+    """
+
+    def __init__(self, limit=MAX_CONCURRENCY, queue_size=QUEUE_SIZE, timeout=QUEUE_TIMEOUT):
+        self.limit = limit
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self._active = 0
+        self._waiters = deque()
+        self._lock = threading.Lock()
+
+    def stats(self):
+        with self._lock:
+            return {"active": self._active, "waiting": len(self._waiters), "limit": self.limit,
+                    "queue_size": self.queue_size}
+
+    async def acquire(self):
+        with self._lock:
+            if self._active < self.limit and not self._waiters:
+                self._active += 1
+                return
+            if len(self._waiters) >= self.queue_size:
+                raise Overloaded("Server is at capacity")
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+        try:
+            await asyncio.wait_for(waiter, self.timeout)
+        except asyncio.TimeoutError:
+            with self._lock:
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+            raise Overloaded("Timed out waiting for capacity")
+
+    def release(self):
+        with self._lock:
+            while self._waiters:
+                waiter = self._waiters.popleft()
+                if not waiter.done():
+                    waiter.get_loop().call_soon_threadsafe(self._hand_over, waiter)
+                    return
+            self._active -= 1
+
+    def _hand_over(self, waiter):
+        # The waiter may have timed out after it was picked; pass the slot on
+        if waiter.done():
+            self.release()
+        else:
+            waiter.set_result(None)
+
+
+rate_limiter = RateLimiter.from_env()
+concurrency = ConcurrencyLimiter()
+
+
+def client_id(scope):
+    if TRUST_PROXY:
+        for name, value in scope["headers"]:
+            if name == b"x-forwarded-for":
+                # The last hop is the one our proxy appended
+                return value.decode("latin-1").rsplit(",", 1)[-1].strip()
+    client = scope.get("client")
+    return client[0] if client else "unknown"
+
+
+async def _reject(send, status, retry_after, detail):
+    body = ('{"detail":"%s"}' % detail).encode()
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode()),
+            (b"retry-after", str(max(1, math.ceil(retry_after))).encode()),
+        ],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+class AdmissionMiddleware:
+    """ASGI middleware applying the module's ``rate_limiter`` and ``concurrency``.
+
+    ``routes`` is the application's route list, used to find the route
+    template (``/api/applications/{app_id}``) before routing happens so that
+    limits apply per route rather than per URL.
+    """
+
+    def __init__(self, app, routes):
+        self.app = app
+        self.routes = routes
+
+    def _route(self, scope):
+        for route in self.routes:
+            match, _ = route.matches(scope)
+            if match == Match.FULL:
+                return route
+        return None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] == "OPTIONS" or scope["path"] in EXEMPT_PATHS:
+            await self.app(scope, receive, send)
+            return
+
+        route = self._route(scope)
+        template = route.path if route is not None else "unmatched"
+        if route is not None:
+            # Lets the metrics middleware label shed requests with their route
+            scope["route"] = route
+
+        if rate_limiter is not None:
+            wait = rate_limiter.check(client_id(scope), f"{scope['method']} {template}")
+            if wait:
+                shed_total.inc(template, "rate_limited")
+                await _reject(send, 429, wait, "Too many requests, slow down")
+                return
+
+        try:
+            await concurrency.acquire()
+        except Overloaded as e:
+            shed_total.inc(template, "overloaded")
+            await _reject(send, 503, 1, f"{e}, try again shortly")
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            concurrency.release()
@@ -0,0 +1,124 @@
+"""Move old decided applications from applications to applications_archive.
+
+    python archive.py                 # one run
+    python archive.py --every 3600    # keep running, once an hour
+
+Accepted and rejected applications submitted more than ARCHIVE_AFTER_DAYS
+ago are moved in batches of ARCHIVE_BATCH_SIZE, one short transaction per
+batch, so live traffic only ever waits on a few locked rows. Rows already
+locked by an admin update are skipped and picked up by a later run. Totals
+on the dashboard are unchanged; archived applications are read with
+``include_archived=true`` on the list, item and export endpoints.
+"""
+import argparse
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+
+import psycopg2
+from dotenv import load_dotenv
+
+from cache import notify_invalidation
+from queries import APPLICATION_COLUMNS
+
+load_dotenv()
+
+ARCHIVE_AFTER_DAYS = int(os.getenv("ARCHIVE_AFTER_DAYS", "180"))
+ARCHIVE_BATCH_SIZE = int(os.getenv("ARCHIVE_BATCH_SIZE", "1000"))
+# Seconds to sleep between batches, giving replicas and autovacuum room to keep up
+ARCHIVE_BATCH_PAUSE = float(os.getenv("ARCHIVE_BATCH_PAUSE", "0.1"))
+ARCHIVE_STATUSES = ("accepted", "rejected")
+
+_COLUMNS = ", ".join(APPLICATION_COLUMNS + ("pan_key", "identity_key"))
+# The archive stores the duplicate keys the live table indexes as expressions
+_MOVED = ", ".join(["a." + c for c in APPLICATION_COLUMNS]
+                   + ["normalize_pan(a.pan) AS pan_key", "normalize_identity(a.name, a.father_name) AS identity_key"])
+
+# One batch: the status/created_at condition is a range scan on
+# idx_applications_status_created_id for each archived status
+ARCHIVE_BATCH_SQL = f"""
+    WITH batch AS (
+        SELECT id FROM applications
+        WHERE status = ANY(%s) AND created_at < %s
+        LIMIT %s
+        FOR UPDATE SKIP LOCKED
+    ), moved AS (
+        DELETE FROM applications a USING batch b
+        WHERE a.id = b.id
+        RETURNING {_MOVED}
+    )
+    INSERT INTO applications_archive ({_COLUMNS})
+    SELECT {_COLUMNS} FROM moved
+"""
+
+
+def archive_decided(conn, older_than_days=ARCHIVE_AFTER_DAYS, batch_size=ARCHIVE_BATCH_SIZE,
+                    pause=ARCHIVE_BATCH_PAUSE, max_batches=None):
+    """Archive decided applications older than ``older_than_days``; return the number moved."""
+    cutoff = datetime.now() - timedelta(days=older_than_days)
+    statuses = list(ARCHIVE_STATUSES)
+    moved = 0
+    with conn.cursor() as cur:
+        try:
+            # Every year that may be moved gets its partition before any row is
+            cur.execute("SELECT create_archive_partitions(min(created_at), %s) FROM applications", (cutoff,))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        batches = 0
+        while max_batches is None or batches < max_batches:
+            try:
+                # Keeps the delete trigger from taking archived rows off the totals
+                cur.execute("SET LOCAL passport.archiving = 'on'")
+                cur.execute(ARCHIVE_BATCH_SQL, (statuses, cutoff, batch_size))
+                count = cur.rowcount
+                if count:
+                    # Delivered on commit, to every API worker's cache listener
+                    notify_invalidation(cur)
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            moved += count
+            batches += 1
+            if count < batch_size:
+                break
+            if pause:
+                time.sleep(pause)
+    return moved
+
+
+def run_once(args):
+    try:
+        conn = psycopg2.connect(os.getenv("DATABASE_URL"))
+    except Exception as e:
+        print(f"✗ Could not connect to the database: {e}")
+        return 1
+    try:
+        moved = archive_decided(conn, args.days, args.batch_size)
+        print(f"✓ Archived {moved} decided application(s) submitted more than {args.days} day(s) ago")
+        return 0
+    except Exception as e:
+        print(f"✗ Archiving failed: {e}")
+        return 1
+    finally:
+        conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Archive old accepted and rejected applications")
+    parser.add_argument("--days", type=int, default=ARCHIVE_AFTER_DAYS, help="archive applications submitted more than this many days ago")
+    parser.add_argument("--batch-size", type=int, default=ARCHIVE_BATCH_SIZE, help="rows moved per transaction")
+    parser.add_argument("--every", type=float, help="repeat every this many seconds instead of running once")
+    args = parser.parse_args()
+    if not args.every:
+        return run_once(args)
+    while True:
+        run_once(args)
+        time.sleep(args.every)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
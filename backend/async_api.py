@@ -0,0 +1,193 @@
+import logging
+from typing import Optional
+
+import psycopg
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+
+from async_db import pool
+from credentials import credentials
+from tokens import tokens, is_admin, require_user, require_admin
+from schemas import SignUpRequest, LoginRequest, ApplicationRequest
+from queries import build_list_query, build_item_query, next_cursor, parse_fields, DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
+from queries import RETURNING_COLUMNS, build_duplicate_lock_query, build_submit_query, DUPLICATE_POLICY
+from cache import response_cache, list_key, item_key
+import replicas
+
+logger = logging.getLogger("passport.api")
+
+# Async versions of the data endpoints in main.py, used when DB_MODE=async.
+# Queries and responses are kept identical to the sync handlers.
+router = APIRouter()
+
+@router.post("/api/signup")
+async def signup(data: SignUpRequest):
+    async with pool.connection() as conn:
+        try:
+            # Check if user exists (before spending a hash on it)
+            cur = await conn.execute("SELECT 1 FROM users WHERE username = %s", (data.username,))
+            if await cur.fetchone():
+                raise HTTPException(status_code=400, detail="Username already exists")
+        except HTTPException:
+            raise
+        except Exception as e:
+            logger.exception("Signup failed", extra={"fields": {"username": data.username}})
+            raise HTTPException(status_code=500, detail=str(e))
+
+    # Hash without holding a pooled connection
+    password_hash = await credentials.hash_password(data.password)
+
+    async with pool.connection() as conn:
+        try:
+            await conn.execute(
+                "INSERT INTO users (username, email, password, category) VALUES (%s, %s, %s, %s)",
+                (data.username, data.email, password_hash, data.category)
+            )
+            await conn.commit()
+            return {"message": "User created successfully", "category": data.category}
+        except psycopg.errors.UniqueViolation:
+            await conn.rollback()
+            raise HTTPException(status_code=400, detail="Username already exists")
+        except Exception as e:
+            await conn.rollback()
+            logger.exception("Signup failed", extra={"fields": {"username": data.username}})
+            raise HTTPException(status_code=500, detail=str(e))
+
+@router.post("/api/login")
+async def login(data: LoginRequest):
+    async with pool.connection() as conn:
+        try:
+            cur = await conn.execute(
+                "SELECT id, username, category, password FROM users WHERE email = %s ORDER BY id",
+                (data.email,)
+            )
+            users = await cur.fetchall()
+        except Exception as e:
+            logger.exception("Login failed")
+            raise HTTPException(status_code=500, detail=str(e))
+
+    if not users:
+        await credentials.verify_nothing(data.password)
+        raise HTTPException(status_code=401, detail="Invalid credentials")
+
+    for user in users:
+        matches, new_hash = await credentials.verify_password(user["password"], data.password)
+        if matches:
+            if new_hash:
+                async with pool.connection() as conn:
+                    # Only if unchanged since we read it, so a concurrent password change wins
+                    await conn.execute(
+                        "UPDATE users SET password = %s WHERE id = %s AND password = %s",
+                        (new_hash, user["id"], user["password"])
+                    )
+                    await conn.commit()
+            return {
+                "message": "Login successful",
+                "category": user["category"],
+                "username": user["username"],
+                "token": tokens.issue(user["username"], user["category"]),
+            }
+    raise HTTPException(status_code=401, detail="Invalid credentials")
+
+@router.post("/api/applications")
+async def submit_application(data: ApplicationRequest):
+    async with pool.connection() as conn:
+        try:
+            if DUPLICATE_POLICY == "reject":
+                await conn.execute(*build_duplicate_lock_query(data))
+            cur = await conn.execute(*build_submit_query(data, DUPLICATE_POLICY == "reject"))
+            row = await cur.fetchone()
+            await conn.commit()
+        except Exception as e:
+            await conn.rollback()
+            logger.exception("Application submit failed", extra={"fields": {"username": data.username}})
+            raise HTTPException(status_code=500, detail=str(e))
+    duplicates = row.pop("duplicates")
+    if row["id"] is None:
+        raise HTTPException(status_code=409, detail={"message": "Possible duplicate application", "duplicates": duplicates})
+    response_cache.invalidate()
+    return {"message": "Application submitted successfully", "application": row, "duplicates": duplicates}
+
+@router.get("/api/applications")
+async def get_applications(
+    request: Request,
+    session: dict = Depends(require_user),
+    status: Optional[str] = None,
+    username: Optional[str] = None,
+    cursor: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    fields: Optional[str] = None,
+    include_archived: bool = False,
+):
+    if not is_admin(session):
+        # Applicants only list their own applications, whatever ?username= says
+        username = session["sub"]
+    try:
+        columns = parse_fields(fields)
+        sql, params = build_list_query(status, username, cursor, limit, columns, include_archived)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    key = list_key(status, username, cursor, limit, columns, include_archived)
+    cached, generation = response_cache.get(key)
+    if cached and not replicas.router.pinned(session["sub"]):
+        return cached.to_response(request)
+
+    async with replicas.router.async_connection(session["sub"]) as conn:
+        try:
+            cur = await conn.execute(sql, params)
+            page = await cur.fetchone()
+        except Exception as e:
+            logger.exception("Application list failed")
+            raise HTTPException(status_code=500, detail=str(e))
+    next_page = next_cursor(page)
+    entry = response_cache.put(key, generation, page["body"], {"X-Next-Cursor": next_page} if next_page else None)
+    return entry.to_response(request)
+
+@router.get("/api/applications/{app_id}")
+async def get_application(request: Request, app_id: int, fields: Optional[str] = None, include_archived: bool = False,
+                          session: dict = Depends(require_user)):
+    try:
+        columns = parse_fields(fields)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    # Applicants only read their own applications; others are not found
+    owner = None if is_admin(session) else session["sub"]
+    key = item_key(app_id, columns, include_archived, owner)
+    cached, generation = response_cache.get(key)
+    if cached and not replicas.router.pinned(session["sub"]):
+        return cached.to_response(request)
+
+    sql, params = build_item_query(app_id, columns, include_archived, owner)
+    async with replicas.router.async_connection(session["sub"]) as conn:
+        try:
+            cur = await conn.execute(sql, params)
+            row = await cur.fetchone()
+        except Exception as e:
+            logger.exception("Application read failed", extra={"fields": {"application_id": app_id}})
+            raise HTTPException(status_code=500, detail=str(e))
+    if not row:
+        raise HTTPException(status_code=404, detail="Application not found")
+    return response_cache.put(key, generation, row["body"]).to_response(request)
+
+@router.put("/api/applications/{app_id}")
+async def update_application_status(app_id: int, status: str, session: dict = Depends(require_admin)):
+    async with pool.connection() as conn:
+        try:
+            cur = await conn.execute(
+                "UPDATE applications SET status = %s WHERE id = %s RETURNING " + RETURNING_COLUMNS,
+                (status, app_id)
+            )
+            application = await cur.fetchone()
+            if not application:
+                raise HTTPException(status_code=404, detail="Application not found")
+            await conn.commit()
+            response_cache.invalidate()
+            await replicas.router.note_write_async(session["sub"], conn)
+            return {"message": "Application updated", "application": application}
+        except HTTPException:
+            raise
+        except Exception as e:
+            await conn.rollback()
+            logger.exception("Application update failed", extra={"fields": {"application_id": app_id}})
+            raise HTTPException(status_code=500, detail=str(e))
@@ -0,0 +1,128 @@
+import os
+import time
+from contextlib import asynccontextmanager
+
+import psycopg_pool
+from psycopg import AsyncCursor
+from psycopg.pq import TransactionStatus
+from psycopg.rows import dict_row
+from dotenv import load_dotenv
+
+import metrics
+from db import PoolTimeout
+
+load_dotenv()
+
+
+class TimedAsyncCursor(AsyncCursor):
+    """AsyncCursor that reports the execution time of every statement to metrics."""
+
+    async def execute(self, query, params=None, **kwargs):
+        start = time.perf_counter()
+        try:
+            return await super().execute(query, params, **kwargs)
+        finally:
+            metrics.record_query(query, time.perf_counter() - start)
+
+    async def executemany(self, query, params_seq, **kwargs):
+        start = time.perf_counter()
+        try:
+            return await super().executemany(query, params_seq, **kwargs)
+        finally:
+            metrics.record_query(query, time.perf_counter() - start)
+
+
+class AsyncConnectionPool:
+    """Asyncio counterpart of ``db.ConnectionPool`` backed by psycopg 3.
+
+    It reads the same ``DB_POOL_*`` settings and reports stats under the same
+    keys, so the two engines can be compared side by side. The pool has to be
+    opened from the event loop that will use it (the app startup hook does this).
+    """
+
+    def __init__(self, dsn, min_size=1, max_size=10, timeout=5.0,
+                 max_lifetime=1800.0, max_idle=300.0, check_after=30.0, name="async"):
+        self.name = name
+        self.min_size = min_size
+        self.max_size = max_size
+        self._pool = psycopg_pool.AsyncConnectionPool(
+            dsn or "",
+            min_size=min_size,
+            max_size=max_size,
+            timeout=timeout,
+            max_lifetime=max_lifetime,
+            max_idle=max_idle,
+            # psycopg_pool can only ping on every checkout; do that when the
+            # sync pool would ping every connection too (DB_POOL_CHECK_AFTER=0)
+            check=psycopg_pool.AsyncConnectionPool.check_connection if check_after <= 0 else None,
+            kwargs={"row_factory": dict_row, "cursor_factory": TimedAsyncCursor},
+            open=False,
+        )
+        self._opened = False
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            os.getenv("DATABASE_URL"),
+            min_size=int(os.getenv("DB_POOL_MIN_SIZE", "1")),
+            max_size=int(os.getenv("DB_POOL_MAX_SIZE", "10")),
+            timeout=float(os.getenv("DB_POOL_TIMEOUT", "5")),
+            max_lifetime=float(os.getenv("DB_POOL_MAX_LIFETIME", "1800")),
+            max_idle=float(os.getenv("DB_POOL_MAX_IDLE", "300")),
+            check_after=float(os.getenv("DB_POOL_CHECK_AFTER", "30")),
+        )
+
+    async def open(self):
+        if not self._opened:
+            await self._pool.open()
+            self._opened = True
+
+    async def close(self):
+        if self._opened:
+            await self._pool.close()
+            self._opened = False
+
+    @asynccontextmanager
+    async def connection(self, timeout=None):
+        if not self._opened:
+            await self.open()
+        start = time.monotonic()
+        try:
+            conn = await self._pool.getconn(timeout)
+        except psycopg_pool.PoolTimeout as e:
+            raise PoolTimeout(str(e)) from e
+        finally:
+            metrics.record_acquire(self.name, time.monotonic() - start)
+        try:
+            yield conn
+        finally:
+            # Roll back read-only or failed transactions ourselves; psycopg_pool
+            # would do it too but logs a warning for every such return
+            if not conn.closed and conn.info.transaction_status != TransactionStatus.IDLE:
+                try:
+                    await conn.rollback()
+                except Exception:
+                    pass
+            await self._pool.putconn(conn)
+
+    def stats(self):
+        s = self._pool.get_stats()
+        size = s.get("pool_size", 0)
+        return {
+            "min_size": self.min_size,
+            "max_size": self.max_size,
+            "size": size,
+            "in_use": size - s.get("pool_available", 0),
+            "idle": s.get("pool_available", 0),
+            "waiting": s.get("requests_waiting", 0),
+            "waits": s.get("requests_queued", 0),
+            "wait_time_seconds": s.get("requests_wait_ms", 0) / 1000.0,
+            "timeouts": s.get("requests_errors", 0),
+            "connections_created": s.get("connections_num", 0),
+            "connections_recycled": s.get("connections_lost", 0) + s.get("returns_bad", 0),
+            "failed_health_checks": s.get("connections_lost", 0),
+            "connect_errors": s.get("connections_errors", 0),
+        }
+
+
+pool = AsyncConnectionPool.from_env()
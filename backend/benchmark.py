@@ -0,0 +1,392 @@
+"""Load test the API against a local Postgres and compare with a stored baseline.
+
+    python benchmark.py --rows 1m --concurrency 64 --duration 60
+    python benchmark.py --rows 10k --save-baseline
+
+The harness starts uvicorn on a free port, tops the applications table up to
+``--rows`` rows, drives a weighted mix of signup/login/submit/list/update
+requests from ``--concurrency`` async clients, and writes throughput and
+latency percentiles per endpoint as JSON. With a baseline file present it
+exits with status 1 when p95/p99 latency or throughput regress by more than
+``--tolerance``.
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import socket
+import string
+import subprocess
+import sys
+import time
+import uuid
+from datetime import datetime, timezone
+from urllib.parse import urlparse
+
+import httpx
+import psycopg2
+from dotenv import load_dotenv
+
+load_dotenv()
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_BASELINE = os.path.join(HERE, "benchmark_baseline.json")
+DEFAULT_MIX = {"list": 40, "login": 20, "submit": 15, "update": 15, "signup": 10}
+LOCAL_HOSTS = {"localhost", "127.0.0.1", "::1", "db"}
+
+BENCH_PASSWORD = "bench-password"
+SEED_BATCH_SIZE = 200_000
+# Largest number of existing ids sampled as targets for status updates
+UPDATE_ID_SAMPLE = 10_000
+
+SEED_USERS_SQL = """
+    INSERT INTO users (username, email, password, category)
+    SELECT 'bench-user-' || i, 'bench-user-' || i || '@example.com', %s, 'Applicant'
+    FROM generate_series(1, %s) AS i
+    ON CONFLICT (username) DO NOTHING
+"""
+# The list and update operations are admin routes; the run logs in as this user
+BENCH_ADMIN = "bench-admin"
+SEED_ADMIN_SQL = """
+    INSERT INTO users (username, email, password, category)
+    VALUES (%s, %s || '@example.com', %s, 'Passport Administrator')
+    ON CONFLICT (username) DO NOTHING
+"""
+
+# Rows spread over the last year with a 70/20/10 pending/accepted/rejected split
+SEED_APPLICATIONS_SQL = """
+    INSERT INTO applications (username, name, father_name, date_of_birth, permanent_address,
+                              temporary_address, phone, email, pan, status, created_at)
+    SELECT 'bench-applicant-' || (i %% 100000),
+           'Applicant ' || i,
+           'Parent ' || i,
+           DATE '1960-01-01' + (i %% 15000),
+           i || ' Benchmark Street, Hyderabad',
+           i || ' Benchmark Street, Hyderabad',
+           '9' || lpad((i %% 1000000000)::text, 9, '0'),
+           'bench-applicant-' || i || '@example.com',
+           upper(translate(substr(md5(i::text), 1, 5), '0123456789', 'ghijklmnop'))
+               || lpad((i %% 10000)::text, 4, '0') || 'B',
+           (ARRAY['pending', 'pending', 'pending', 'pending', 'pending', 'pending', 'pending',
+                  'accepted', 'accepted', 'rejected'])[1 + i %% 10],
+           LOCALTIMESTAMP - (i %% 525600) * INTERVAL '1 minute'
+    FROM generate_series(%s, %s) AS i
+"""
+
+
+def parse_count(value):
+    """Parse row counts such as 10000, 10k, 1m or 10M."""
+    value = value.strip().lower().replace("_", "")
+    multiplier = {"k": 1_000, "m": 1_000_000}.get(value[-1:], 1)
+    if multiplier > 1:
+        value = value[:-1]
+    return int(float(value) * multiplier)
+
+
+def parse_mix(value):
+    mix = {}
+    for part in value.split(","):
+        name, _, weight = part.partition("=")
+        if name.strip() not in DEFAULT_MIX:
+            raise argparse.ArgumentTypeError(f"Unknown operation {name!r}; choose from {', '.join(DEFAULT_MIX)}")
+        mix[name.strip()] = int(weight or 1)
+    return mix
+
+
+def seed(dsn, rows, users):
+    """Top the tables up to ``rows`` applications and ``users`` bench logins."""
+    conn = psycopg2.connect(dsn)
+    try:
+        with conn.cursor() as cur:
+            cur.execute(SEED_USERS_SQL, (BENCH_PASSWORD, users))
+            cur.execute(SEED_ADMIN_SQL, (BENCH_ADMIN, BENCH_ADMIN, BENCH_PASSWORD))
+            conn.commit()
+
+            cur.execute("SELECT count(*) FROM applications")
+            existing = cur.fetchone()[0]
+            if existing < rows:
+                print(f"Seeding {rows - existing} applications ({existing} present)...")
+            start = existing + 1
+            while start <= rows:
+                end = min(start + SEED_BATCH_SIZE - 1, rows)
+                # Goes through the normal triggers so the stats counters stay correct
+                cur.execute(SEED_APPLICATIONS_SQL, (start, end))
+                conn.commit()
+                print(f"  {end}/{rows}")
+                start = end + 1
+            cur.execute("ANALYZE applications")
+            conn.commit()
+
+            cur.execute("SELECT count(*) FROM applications")
+            total = cur.fetchone()[0]
+            percent = min(100.0, UPDATE_ID_SAMPLE * 200.0 / max(total, 1))
+            cur.execute(f"SELECT id FROM applications TABLESAMPLE SYSTEM ({percent}) LIMIT %s", (UPDATE_ID_SAMPLE,))
+            ids = [row[0] for row in cur.fetchall()]
+        print(f"✓ Database ready: {total} applications, {users} bench users")
+        return ids
+    finally:
+        conn.close()
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(dsn, port, workers, db_mode):
+    env = dict(os.environ, DATABASE_URL=dsn, DB_MODE=db_mode)
+    # The benchmark database is disposable, so bring its schema up to date
+    env.setdefault("AUTO_MIGRATE", "true")
+    # All load comes from one address, which the per-client limits would throttle
+    env.setdefault("RATE_LIMIT_BACKEND", "none")
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port),
+         "--workers", str(workers), "--log-level", "warning"],
+        cwd=HERE, env=env,
+    )
+
+
+async def wait_until_healthy(base_url, timeout=60):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient(base_url=base_url) as client:
+        while time.monotonic() < deadline:
+            try:
+                if (await client.get("/api/health")).status_code == 200:
+                    return
+            except httpx.TransportError:
+                pass
+            await asyncio.sleep(0.5)
+    raise RuntimeError(f"Server at {base_url} did not become healthy within {timeout}s")
+
+
+class Workload:
+    """Builds each request of the mix. One instance is shared by all clients."""
+
+    def __init__(self, users, update_ids, rng):
+        self.users = users
+        self.update_ids = update_ids or [1]
+        self.rng = rng
+
+    def signup(self):
+        name = f"bench-signup-{uuid.uuid4().hex[:12]}"
+        return "POST", "/api/signup", {"json": {
+            "username": name, "email": f"{name}@example.com",
+            "password": BENCH_PASSWORD, "category": "Applicant",
+        }}
+
+    def login(self):
+        n = self.rng.randint(1, self.users)
+        return "POST", "/api/login", {"json": {"email": f"bench-user-{n}@example.com", "password": BENCH_PASSWORD}}
+
+    def submit(self):
+        n = self.rng.randint(1, 100_000)
+        pan = "".join(self.rng.choices(string.ascii_uppercase, k=5)) + f"{self.rng.randint(0, 9999):04d}B"
+        return "POST", "/api/applications", {"json": {
+            "username": f"bench-applicant-{n}", "name": f"Applicant {n}", "father_name": f"Parent {n}",
+            "date_of_birth": "1990-01-01", "permanent_address": f"{n} Benchmark Street, Hyderabad",
+            "temporary_address": f"{n} Benchmark Street, Hyderabad", "phone": "9876543210",
+            "email": f"bench-applicant-{n}@example.com", "pan": pan,
+        }}
+
+    def list(self):
+        status = self.rng.choice(["pending", "pending", "accepted", "rejected", None])
+        params = {"limit": 50}
+        if status:
+            params["status"] = status
+        return "GET", "/api/applications", {"params": params}
+
+    def update(self):
+        app_id = self.rng.choice(self.update_ids)
+        status = self.rng.choice(["accepted", "rejected", "pending"])
+        return "PUT", f"/api/applications/{app_id}", {"params": {"status": status}}
+
+
+async def run_load(base_url, workload, mix, concurrency, duration, warmup):
+    """Run the mix for ``warmup`` + ``duration`` seconds; return latencies and errors per operation."""
+    names = list(mix)
+    weights = [mix[n] for n in names]
+    latencies = {n: [] for n in names}
+    errors = {n: 0 for n in names}
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    start = time.monotonic()
+    measure_from = start + warmup
+    stop_at = measure_from + duration
+
+    async def client_loop(client):
+        while True:
+            now = time.monotonic()
+            if now >= stop_at:
+                return
+            name = workload.rng.choices(names, weights)[0]
+            method, path, kwargs = getattr(workload, name)()
+            began = time.perf_counter()
+            try:
+                response = await client.request(method, path, **kwargs)
+                failed = response.status_code >= 400
+            except httpx.HTTPError:
+                failed = True
+            elapsed = time.perf_counter() - began
+            if now >= measure_from:
+                latencies[name].append(elapsed)
+                if failed:
+                    errors[name] += 1
+
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=30) as client:
+        login = await client.post("/api/login", json={"email": f"{BENCH_ADMIN}@example.com", "password": BENCH_PASSWORD})
+        login.raise_for_status()
+        client.headers["Authorization"] = f"Bearer {login.json()['token']}"
+        await asyncio.gather(*(client_loop(client) for _ in range(concurrency)))
+    return latencies, errors
+
+
+def percentile(sorted_values, p):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    return sorted_values[max(0, math.ceil(p / 100.0 * len(sorted_values)) - 1)]
+
+
+def _ms(seconds):
+    return round(seconds * 1000, 3) if seconds is not None else None
+
+
+def summarize(samples, errors, duration):
+    samples = sorted(samples)
+    return {
+        "requests": len(samples),
+        "errors": errors,
+        "throughput_rps": round(len(samples) / duration, 2),
+        "p50_ms": _ms(percentile(samples, 50)),
+        "p95_ms": _ms(percentile(samples, 95)),
+        "p99_ms": _ms(percentile(samples, 99)),
+        "max_ms": _ms(samples[-1] if samples else None),
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=HERE,
+                              capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def compare(result, baseline, tolerance):
+    """Print a comparison against ``baseline``; return the list of regressions."""
+    keys = ("rows", "concurrency", "mix", "db_mode", "workers")
+    mismatched = [k for k in keys if result["meta"].get(k) != baseline["meta"].get(k)]
+    if mismatched:
+        print(f"⚠ Baseline was recorded with different settings ({', '.join(mismatched)}); comparison is indicative only")
+
+    regressions = []
+    for name, base in baseline["endpoints"].items():
+        current = result["endpoints"].get(name)
+        if current is None:
+            continue
+        checks = [(m, current[m], base[m], current[m] > base[m] * (1 + tolerance))
+                  for m in ("p95_ms", "p99_ms") if current[m] is not None and base[m]]
+        checks.append(("throughput_rps", current["throughput_rps"], base["throughput_rps"],
+                       current["throughput_rps"] < base["throughput_rps"] * (1 - tolerance)))
+        for metric, value, reference, regressed in checks:
+            change = (value - reference) / reference * 100 if reference else 0.0
+            mark = "✗" if regressed else "✓"
+            print(f"{mark} {name:<7} {metric:<15} {value:>10} (baseline {reference}, {change:+.1f}%)")
+            if regressed:
+                regressions.append(f"{name} {metric}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the Passport API with a mixed workload")
+    parser.add_argument("--database-url", default=os.getenv("DATABASE_URL"), help="Postgres to benchmark against (default: DATABASE_URL)")
+    parser.add_argument("--rows", type=parse_count, default=parse_count("10k"), help="applications to seed, e.g. 10k, 1m, 10m")
+    parser.add_argument("--users", type=int, default=1000, help="bench users available for login")
+    parser.add_argument("--concurrency", type=int, default=32, help="concurrent clients")
+    parser.add_argument("--duration", type=float, default=30, help="measured seconds")
+    parser.add_argument("--warmup", type=float, default=5, help="seconds run before measuring")
+    parser.add_argument("--mix", type=parse_mix, default=DEFAULT_MIX, help="weights, e.g. list=40,login=20,submit=15,update=15,signup=10")
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn worker processes")
+    parser.add_argument("--db-mode", choices=["sync", "async"], default=os.getenv("DB_MODE", "sync"))
+    parser.add_argument("--url", help="benchmark an already running server instead of starting one")
+    parser.add_argument("--seed", type=int, default=1, help="random seed for the request mix")
+    parser.add_argument("--output", help="write the JSON report here (default: stdout)")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="baseline report to compare against")
+    parser.add_argument("--save-baseline", action="store_true", help="store this run as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed relative regression (0.2 = 20%%)")
+    parser.add_argument("--skip-seed", action="store_true", help="use the data already in the database")
+    parser.add_argument("--allow-remote", action="store_true", help="allow a non-local database (it will be written to)")
+    args = parser.parse_args()
+
+    if not args.database_url:
+        parser.error("DATABASE_URL is not set; pass --database-url")
+    host = urlparse(args.database_url).hostname or "localhost"
+    if host not in LOCAL_HOSTS and not args.allow_remote:
+        parser.error(f"Refusing to seed and load test {host}; pass --allow-remote if this is intended")
+
+    server = None
+    base_url = args.url
+    try:
+        if base_url is None:
+            port = free_port()
+            base_url = f"http://127.0.0.1:{port}"
+            print(f"Starting API on {base_url} ({args.workers} worker(s), DB_MODE={args.db_mode})...")
+            server = start_server(args.database_url, port, args.workers, args.db_mode)
+        # The app migrates the schema at startup, so seed only once it is healthy
+        asyncio.run(wait_until_healthy(base_url))
+
+        update_ids = seed(args.database_url, 0 if args.skip_seed else args.rows, args.users)
+
+        print(f"Running {args.duration:.0f}s (+{args.warmup:.0f}s warmup) at concurrency {args.concurrency}...")
+        workload = Workload(args.users, update_ids, random.Random(args.seed))
+        latencies, errors = asyncio.run(run_load(
+            base_url, workload, args.mix, args.concurrency, args.duration, args.warmup))
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait(10)
+
+    all_samples = [s for samples in latencies.values() for s in samples]
+    result = {
+        "meta": {
+            "rows": args.rows,
+            "concurrency": args.concurrency,
+            "duration_seconds": args.duration,
+            "mix": args.mix,
+            "db_mode": args.db_mode,
+            "workers": args.workers,
+            "commit": git_commit(),
+            "started_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        },
+        "endpoints": {name: summarize(latencies[name], errors[name], args.duration) for name in args.mix},
+        "overall": summarize(all_samples, sum(errors.values()), args.duration),
+    }
+
+    report = json.dumps(result, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(report + "\n")
+        print(f"✓ Report written to {args.output}")
+    else:
+        print(report)
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            f.write(report + "\n")
+        print(f"✓ Baseline saved to {args.baseline}")
+        return 0
+
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            regressions = compare(result, json.load(f), args.tolerance)
+        if regressions:
+            print(f"✗ {len(regressions)} regression(s) beyond {args.tolerance:.0%}: {', '.join(regressions)}")
+            return 1
+        print("✓ No regressions against baseline")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
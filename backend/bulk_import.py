@@ -0,0 +1,140 @@
+import csv
+import io
+import json
+from datetime import date
+
+from pydantic import ValidationError
+
+import dedupe
+from schemas import ApplicationRequest
+# Columns loaded by COPY, in order. id and created_at come from the table defaults.
+from queries import IMPORT_COLUMNS
+
+# VARCHAR limits of the applications table. Checking them up front keeps one
+# bad row from failing a whole COPY batch.
+COLUMN_LIMITS = {
+    "username": 255, "name": 255, "father_name": 255, "phone": 50,
+    "email": 255, "pan": 10, "status": 50,
+}
+
+DEFAULT_BATCH_SIZE = 1000
+MAX_REPORTED_ERRORS = 1000
+
+
+def iter_csv(stream):
+    """Yield (line_number, record) from a CSV text stream with a header row."""
+    reader = csv.DictReader(stream)
+    for record in reader:
+        yield reader.line_num, record
+
+
+def iter_ndjson(stream):
+    """Yield (line_number, record) from a newline-delimited JSON text stream."""
+    for line_number, line in enumerate(stream, start=1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError as e:
+            yield line_number, ValueError(f"Invalid JSON: {e}")
+            continue
+        yield line_number, record
+
+
+READERS = {"csv": iter_csv, "ndjson": iter_ndjson}
+
+
+def validate_record(record):
+    """Validate one input record with the ApplicationRequest rules.
+
+    Returns the row as a tuple in IMPORT_COLUMNS order, or raises ValueError
+    with a readable reason.
+    """
+    if isinstance(record, Exception):
+        raise record
+    if not isinstance(record, dict):
+        raise ValueError("Record must be an object")
+    # Empty CSV cells mean "use the default" for optional fields like status
+    record = {k: v for k, v in record.items() if k is not None and v not in ("", None)}
+    try:
+        application = ApplicationRequest(**record)
+    except ValidationError as e:
+        raise ValueError("; ".join(
+            f"{'.'.join(str(p) for p in err['loc'])}: {err['msg']}" for err in e.errors()
+        ))
+    try:
+        date.fromisoformat(application.date_of_birth)
+    except ValueError:
+        raise ValueError("date_of_birth: expected YYYY-MM-DD")
+    for column, limit in COLUMN_LIMITS.items():
+        if len(getattr(application, column)) > limit:
+            raise ValueError(f"{column}: longer than {limit} characters")
+    return tuple(getattr(application, column) for column in IMPORT_COLUMNS)
+
+
+def _copy_batch(cur, buffer):
+    buffer.seek(0)
+    cur.copy_expert(
+        f"COPY applications ({', '.join(IMPORT_COLUMNS)}) FROM STDIN WITH (FORMAT csv)",
+        buffer,
+    )
+
+
+def import_applications(conn, records, batch_size=DEFAULT_BATCH_SIZE):
+    """Validate ``records`` and load the valid ones with COPY in one transaction.
+
+    ``records`` is an iterable of (line_number, record) pairs, as produced by
+    iter_csv/iter_ndjson, and is consumed lazily: at most ``batch_size`` rows
+    are buffered before being sent, so memory stays flat for any input size.
+    Invalid rows are skipped and reported; if Postgres rejects a batch the
+    whole import is rolled back and the error propagates.
+
+    COPY bypasses the submit-time duplicate check, so before committing the
+    keys of the loaded rows are clustered in duplicate_clusters, as flag mode
+    would; imports are never rejected as duplicates.
+    """
+    imported = 0
+    rejected = 0
+    errors = []
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    pending = 0
+    clusters = 0
+
+    with conn.cursor() as cur:
+        try:
+            since = dedupe.last_application_id(cur)
+            for line_number, record in records:
+                try:
+                    row = validate_record(record)
+                except ValueError as e:
+                    rejected += 1
+                    if len(errors) < MAX_REPORTED_ERRORS:
+                        errors.append({"line": line_number, "reason": str(e)})
+                    continue
+                writer.writerow(row)
+                pending += 1
+                if pending >= batch_size:
+                    _copy_batch(cur, buffer)
+                    imported += pending
+                    pending = 0
+                    buffer.seek(0)
+                    buffer.truncate()
+            if pending:
+                _copy_batch(cur, buffer)
+                imported += pending
+            if imported:
+                clusters = dedupe.cluster_since(cur, since)["clusters"]
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+    return {
+        "imported": imported,
+        "duplicate_clusters": clusters,
+        "rejected": rejected,
+        "errors": errors,
+        "errors_truncated": rejected > len(errors),
+    }
@@ -0,0 +1,251 @@
+import hashlib
+import logging
+import os
+import select
+import struct
+import threading
+import time
+from collections import OrderedDict
+from email.utils import formatdate, parsedate_to_datetime
+
+import psycopg2
+from fastapi import Response
+from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
+
+logger = logging.getLogger("passport.cache")
+
+# Jobs that write outside the API (archive.py) NOTIFY this channel in the
+# writing transaction; every API worker listens and invalidates its cache
+INVALIDATION_CHANNEL = "response_cache_invalidations"
+
+
+class MemoryBackend:
+    """In-process cache with per-entry TTL and size-bounded LRU eviction.
+
+    Each worker process has its own copy; use a shared backend (RedisBackend)
+    when several workers must see each other's invalidations immediately.
+    """
+
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._entries.get(key)
+            if item is None:
+                return None
+            value, expires_at = item
+            if expires_at is not None and expires_at <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        expires_at = time.monotonic() + ttl if ttl else None
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+class RedisBackend:
+    """Cache shared by all workers, stored in Redis. Requires the ``redis`` package."""
+
+    def __init__(self, url, prefix="passport:"):
+        try:
+            import redis
+        except ImportError as e:
+            raise RuntimeError("CACHE_BACKEND=redis requires the redis package (pip install redis)") from e
+        self._client = redis.Redis.from_url(url)
+        self.prefix = prefix
+
+    def get(self, key):
+        return self._client.get(self.prefix + key)
+
+    def set(self, key, value, ttl=None):
+        self._client.set(self.prefix + key, value, ex=int(ttl) if ttl else None)
+
+
+class CachedResponse:
+    """A serialized JSON body plus the validators needed for conditional GETs."""
+
+    __slots__ = ("body", "etag", "last_modified", "headers")
+
+    def __init__(self, body, last_modified, headers=None, etag=None):
+        self.body = body
+        self.etag = etag or '"%s"' % hashlib.blake2b(body, digest_size=16).hexdigest()
+        self.last_modified = last_modified
+        self.headers = headers or {}
+
+    def dumps(self):
+        meta = "\n".join([self.etag] + [f"{k}:{v}" for k, v in self.headers.items()]).encode()
+        return struct.pack("!dI", self.last_modified, len(meta)) + meta + self.body
+
+    @classmethod
+    def loads(cls, data):
+        last_modified, meta_len = struct.unpack_from("!dI", data)
+        offset = struct.calcsize("!dI")
+        etag, *lines = data[offset:offset + meta_len].decode().split("\n")
+        headers = dict(line.split(":", 1) for line in lines)
+        return cls(data[offset + meta_len:], last_modified, headers, etag)
+
+    def not_modified(self, request):
+        if_none_match = request.headers.get("if-none-match")
+        if if_none_match is not None:
+            tags = [t.strip() for t in if_none_match.split(",")]
+            return "*" in tags or self.etag in tags or f"W/{self.etag}" in tags
+        if_modified_since = request.headers.get("if-modified-since")
+        if if_modified_since:
+            try:
+                return int(self.last_modified) <= parsedate_to_datetime(if_modified_since).timestamp()
+            except (TypeError, ValueError):
+                return False
+        return False
+
+    def to_response(self, request):
+        headers = {
+            "ETag": self.etag,
+            "Last-Modified": formatdate(self.last_modified, usegmt=True),
+            # Clients may store the response but must revalidate it every time
+            "Cache-Control": "private, no-cache",
+            **self.headers,
+        }
+        if self.not_modified(request):
+            return Response(status_code=304, headers=headers)
+        return Response(content=self.body, media_type="application/json", headers=headers)
+
+
+class ResponseCache:
+    """Cache of serialized application reads, invalidated on every write.
+
+    Keys are prefixed with a generation stamp kept in the backend; a write
+    bumps the generation, which orphans every earlier entry at once (they age
+    out through TTL/LRU) and also serves as the Last-Modified time.
+    """
+
+    GENERATION_KEY = "applications:generation"
+
+    def __init__(self, backend, ttl=30.0):
+        self.backend = backend
+        self.ttl = ttl
+
+    @classmethod
+    def from_env(cls):
+        kind = os.getenv("CACHE_BACKEND", "memory").lower()
+        ttl = float(os.getenv("CACHE_TTL", "30"))
+        if kind == "none":
+            return cls(None, ttl)
+        if kind == "redis":
+            return cls(RedisBackend(os.getenv("CACHE_REDIS_URL", "redis://localhost:6379/0")), ttl)
+        return cls(MemoryBackend(int(os.getenv("CACHE_MAX_ENTRIES", "1024"))), ttl)
+
+    def _generation(self):
+        raw = self.backend.get(self.GENERATION_KEY)
+        if raw is None:
+            # First read since start: nothing is known about earlier writes
+            raw = str(time.time()).encode()
+            self.backend.set(self.GENERATION_KEY, raw)
+        return raw.decode() if isinstance(raw, bytes) else raw
+
+    def get(self, key):
+        """Return (CachedResponse or None, generation) for ``key``."""
+        if self.backend is None:
+            return None, str(time.time())
+        generation = self._generation()
+        data = self.backend.get(f"{generation}:{key}")
+        return (CachedResponse.loads(data) if data is not None else None), generation
+
+    def put(self, key, generation, body, headers=None):
+        entry = CachedResponse(body.encode() if isinstance(body, str) else body, float(generation), headers)
+        if self.backend is not None:
+            self.backend.set(f"{generation}:{key}", entry.dumps(), self.ttl)
+        return entry
+
+    def invalidate(self):
+        if self.backend is not None:
+            self.backend.set(self.GENERATION_KEY, str(time.time()).encode())
+
+
+def notify_invalidation(cur):
+    """Have every API worker invalidate its cache once ``cur``'s transaction commits."""
+    cur.execute("SELECT pg_notify(%s, '')", (INVALIDATION_CHANNEL,))
+
+
+class InvalidationListener:
+    """LISTENs on INVALIDATION_CHANNEL and invalidates ``cache`` for each notification.
+
+    This is what lets the memory backend see writes made by other processes.
+    Notifications sent while the connection was down are lost, so the cache
+    is also invalidated on every (re)connect.
+    """
+
+    def __init__(self, cache, dsn):
+        self.cache = cache
+        self.dsn = dsn
+        self._thread = None
+        self._stopping = threading.Event()
+
+    def start(self):
+        if self.cache.backend is None or (self._thread and self._thread.is_alive()):
+            return
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name="cache-invalidation", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopping.set()
+        if self._thread:
+            self._thread.join(5)
+            self._thread = None
+
+    def _run(self):
+        backoff = 1
+        while not self._stopping.is_set():
+            conn = None
+            try:
+                conn = psycopg2.connect(self.dsn)
+                conn.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+                with conn.cursor() as cur:
+                    cur.execute(f"LISTEN {INVALIDATION_CHANNEL}")
+                self.cache.invalidate()
+                backoff = 1
+                while not self._stopping.is_set():
+                    if select.select([conn], [], [], 1.0) == ([], [], []):
+                        continue
+                    conn.poll()
+                    if conn.notifies:
+                        conn.notifies.clear()
+                        self.cache.invalidate()
+            except Exception as e:
+                logger.error("Cache invalidation listener error: %s", e)
+                self._stopping.wait(backoff)
+                backoff = min(backoff * 2, 30)
+            finally:
+                if conn is not None:
+                    conn.close()
+
+
+def list_key(status, username, cursor, limit, fields, include_archived=False):
+    scope = "all" if include_archived else "live"
+    return f"list:{scope}:{status or ''}:{username or ''}:{cursor or ''}:{limit}:{','.join(fields)}"
+
+
+def item_key(app_id, fields, include_archived=False, username=None):
+    scope = "all" if include_archived else "live"
+    return f"item:{scope}:{app_id}:{username or ''}:{','.join(fields)}"
+
+
+def stats_key(days, hours):
+    return f"stats:{days}:{hours}"
+
+
+def search_key(q, status, offset, limit, fields):
+    # The free-text query goes last so a ':' in it cannot collide with other parts
+    return f"search:{status or ''}:{offset}:{limit}:{','.join(fields)}:{q}"
+
+
+response_cache = ResponseCache.from_env()
@@ -0,0 +1,213 @@
+import asyncio
+import logging
+import os
+import select
+import threading
+import time
+from collections import deque
+
+import psycopg2
+from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
+from psycopg2.extras import RealDictCursor
+
+from db import pool
+
+logger = logging.getLogger("passport.changes")
+
+CHANNEL = "application_changes"
+REPLAY_LIMIT = int(os.getenv("CHANGE_FEED_REPLAY_LIMIT", "1000"))
+SUBSCRIBER_QUEUE_SIZE = int(os.getenv("CHANGE_FEED_QUEUE_SIZE", "1000"))
+RETENTION_HOURS = float(os.getenv("CHANGE_FEED_RETENTION_HOURS", "24"))
+# Change ids are allocated before commit, so a slow transaction can commit an
+# id below one already published. Each read looks this far back for such late
+# rows and skips the ones already sent.
+GAP_LOOKBACK = 100
+
+# Columns sent in each delta; the address TEXT columns are left out. The
+# triggers (migration 0012) snapshot these into application_changes.data.
+DELTA_COLUMNS = (
+    "id", "username", "name", "father_name", "date_of_birth",
+    "phone", "email", "pan", "status", "created_at",
+)
+
+# Rows logged before 0012 have no snapshot and fall back to the current row
+FETCH_CHANGES_SQL = f"""
+    SELECT c.id AS event_id, c.op, COALESCE(c.data, row_to_json(a))::text AS data
+    FROM application_changes c
+    LEFT JOIN LATERAL (
+        SELECT {', '.join(DELTA_COLUMNS)} FROM applications WHERE id = c.application_id AND c.data IS NULL
+    ) a ON true
+    WHERE c.id > %s AND (c.data IS NOT NULL OR a.id IS NOT NULL)
+    ORDER BY c.id
+    LIMIT %s
+"""
+
+
+def fetch_changes(cur, after_id, limit=REPLAY_LIMIT):
+    """Return change events with id > ``after_id``, oldest first."""
+    cur.execute(FETCH_CHANGES_SQL, (after_id, limit))
+    return [(row["event_id"], row["op"], row["data"]) for row in cur.fetchall()]
+
+
+class _RecentIds:
+    """Bounded set of the most recently published change ids."""
+
+    def __init__(self, size):
+        self._order = deque(maxlen=size)
+        self._ids = set()
+
+    def __contains__(self, event_id):
+        return event_id in self._ids
+
+    def append(self, event_id):
+        if len(self._order) == self._order.maxlen:
+            self._ids.discard(self._order[0])
+        self._order.append(event_id)
+        self._ids.add(event_id)
+
+
+class Subscription:
+    def __init__(self, loop):
+        self.loop = loop
+        self.queue = asyncio.Queue(SUBSCRIBER_QUEUE_SIZE)
+        self.overflowed = False
+
+    def _put(self, event):
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            # The client is too slow; it will be told to reload and resume
+            self.overflowed = True
+
+    def publish(self, event):
+        self.loop.call_soon_threadsafe(self._put, event)
+
+
+class ChangeFeed:
+    """One LISTEN connection per worker, fanned out to every SSE subscriber.
+
+    Triggers on ``applications`` append rows to ``application_changes`` and
+    send a payload-free NOTIFY per statement. On each notification the
+    listener thread reads the new change rows once and publishes them to all
+    subscribers, so the database cost does not grow with the number of open
+    dashboards.
+    """
+
+    def __init__(self, dsn):
+        self.dsn = dsn
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stopping = threading.Event()
+        self.last_event_id = None
+        self._floor = 0
+        self._recent = _RecentIds(GAP_LOOKBACK * 10)
+
+    def start(self):
+        with self._lock:
+            if self._thread and self._thread.is_alive():
+                return
+            self._stopping.clear()
+            self._ready = threading.Event()
+            self._thread = threading.Thread(target=self._run, name="change-feed", daemon=True)
+            self._thread.start()
+        # Wait until LISTEN is active so a new subscriber cannot miss events
+        self._ready.wait(5)
+
+    def stop(self):
+        self._stopping.set()
+        if self._thread:
+            self._thread.join(5)
+            self._thread = None
+
+    def subscribe(self, loop):
+        self.start()
+        subscription = Subscription(loop)
+        with self._lock:
+            self._subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscribers.discard(subscription)
+
+    def subscriber_count(self):
+        with self._lock:
+            return len(self._subscribers)
+
+    def _publish(self, events):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for event in events:
+            for subscription in subscribers:
+                subscription.publish(event)
+
+    def _run(self):
+        backoff = 1
+        while not self._stopping.is_set():
+            conn = None
+            try:
+                conn = psycopg2.connect(self.dsn, cursor_factory=RealDictCursor)
+                conn.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+                with conn.cursor() as cur:
+                    cur.execute(f"LISTEN {CHANNEL}")
+                    if self.last_event_id is None:
+                        cur.execute("SELECT COALESCE(max(id), 0) AS id FROM application_changes")
+                        self.last_event_id = self._floor = cur.fetchone()["id"]
+                    else:
+                        # Catch up on anything committed while we were disconnected
+                        self._drain(cur)
+                    self._ready.set()
+                    backoff = 1
+                    last_prune = 0
+                    while not self._stopping.is_set():
+                        if time.monotonic() - last_prune > 3600:
+                            cur.execute(
+                                "DELETE FROM application_changes WHERE changed_at < NOW() - %s * INTERVAL '1 hour'",
+                                (RETENTION_HOURS,),
+                            )
+                            last_prune = time.monotonic()
+                        if select.select([conn], [], [], 1.0) == ([], [], []):
+                            continue
+                        conn.poll()
+                        if conn.notifies:
+                            conn.notifies.clear()
+                            self._drain(cur)
+            except Exception as e:
+                logger.error("Change feed listener error: %s", e)
+                self._ready.set()
+                self._stopping.wait(backoff)
+                backoff = min(backoff * 2, 30)
+            finally:
+                if conn is not None:
+                    conn.close()
+
+    def _drain(self, cur):
+        while True:
+            events = fetch_changes(cur, max(self.last_event_id - GAP_LOOKBACK, 0))
+            # Events at or below the id seen at startup predate every subscriber
+            fresh = [e for e in events if e[0] > self._floor and e[0] not in self._recent]
+            for event in fresh:
+                self._recent.append(event[0])
+            if fresh:
+                self.last_event_id = max(self.last_event_id, fresh[-1][0])
+                self._publish(fresh)
+            if len(events) < REPLAY_LIMIT:
+                return
+
+
+def replay(after_id):
+    """Changes after ``after_id`` for a reconnecting client, read through the shared pool."""
+    with pool.connection() as conn, conn.cursor() as cur:
+        return fetch_changes(cur, after_id)
+
+
+def format_event(event_id, op, data):
+    # ``data`` is already JSON text from Postgres and ``op`` is "insert"/"update"
+    return f'id: {event_id}\nevent: change\ndata: {{"op": "{op}", "application": {data}}}\n\n'
+
+
+RESET_EVENT = "event: reset\ndata: {}\n\n"
+
+
+feed = ChangeFeed(os.getenv("DATABASE_URL"))
@@ -0,0 +1,71 @@
+"""Create a Passport Administrator account.
+
+    python create_admin.py USERNAME EMAIL   # prompts for the password
+
+Public signup only creates applicants, so administrators are added here, by
+someone with access to the database.
+"""
+import argparse
+import getpass
+import os
+import sys
+
+import psycopg2
+from dotenv import load_dotenv
+
+from credentials import hasher_from_env
+from schemas import EMAIL_PATTERN
+from tokens import ADMIN_CATEGORY
+
+load_dotenv()
+
+
+def create_admin(conn, username, email, password_hash):
+    """Insert an administrator; return False when the username is taken."""
+    with conn.cursor() as cur:
+        try:
+            cur.execute(
+                "INSERT INTO users (username, email, password, category) VALUES (%s, %s, %s, %s)",
+                (username, email, password_hash, ADMIN_CATEGORY)
+            )
+            conn.commit()
+            return True
+        except psycopg2.errors.UniqueViolation:
+            conn.rollback()
+            return False
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Create a Passport Administrator account")
+    parser.add_argument("username")
+    parser.add_argument("email")
+    args = parser.parse_args(argv)
+
+    if not EMAIL_PATTERN.match(args.email):
+        print(f"✗ Invalid email: {args.email}")
+        return 1
+    password = getpass.getpass("Password: ")
+    if not password or password != getpass.getpass("Repeat password: "):
+        print("✗ Passwords are empty or do not match")
+        return 1
+
+    try:
+        conn = psycopg2.connect(os.getenv("DATABASE_URL"))
+    except Exception as e:
+        print(f"✗ Could not connect to the database: {e}")
+        return 1
+    try:
+        if not create_admin(conn, args.username, args.email, hasher_from_env().hash(password)):
+            print(f"✗ Username {args.username} already exists")
+            return 1
+        print(f"✓ Created administrator {args.username}")
+        return 0
+    except Exception as e:
+        print(f"✗ Could not create the administrator: {e}")
+        return 1
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,97 @@
+import asyncio
+import hmac
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from argon2 import PasswordHasher
+from argon2.exceptions import InvalidHashError, VerificationError
+
+# Hashing threads. argon2-cffi releases the GIL while hashing, so threads run
+# in parallel; keep this at or below the CPU cores set aside for auth.
+HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(max(1, (os.cpu_count() or 2) // 2))))
+# Requests allowed to wait for a hashing thread; beyond that they get 503 at once
+HASH_QUEUE_SIZE = int(os.getenv("PASSWORD_HASH_QUEUE_SIZE", "32"))
+# Seconds a hash or verification may take including its time in the queue
+HASH_TIMEOUT = float(os.getenv("PASSWORD_HASH_TIMEOUT", "5"))
+
+
+class CredentialServiceBusy(Exception):
+    """Raised when the hashing pool is full or a hash did not finish within the timeout."""
+
+
+def hasher_from_env():
+    # Defaults are argon2-cffi's (RFC 9106 low-memory profile); raising them
+    # makes rehash-on-login upgrade existing hashes as users sign in
+    return PasswordHasher(
+        time_cost=int(os.getenv("PASSWORD_HASH_TIME_COST", "3")),
+        memory_cost=int(os.getenv("PASSWORD_HASH_MEMORY_KIB", "65536")),
+        parallelism=int(os.getenv("PASSWORD_HASH_PARALLELISM", "4")),
+    )
+
+
+class CredentialService:
+    """Password hashing and verification on a dedicated, bounded thread pool.
+
+    Hashes are deliberately expensive, so they never run on the request
+    threadpool or the event loop: callers await a slot on this pool instead.
+    At most ``workers`` hashes run at once and ``queue_size`` more may wait;
+    anything beyond that, or anything not done within ``timeout`` seconds,
+    raises CredentialServiceBusy so a login burst is shed instead of slowing
+    every other endpoint.
+    """
+
+    def __init__(self, hasher=None, workers=HASH_WORKERS, queue_size=HASH_QUEUE_SIZE, timeout=HASH_TIMEOUT):
+        self.hasher = hasher or hasher_from_env()
+        self.workers = workers
+        self.timeout = timeout
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="password-hash")
+        self._slots = threading.BoundedSemaphore(workers + queue_size)
+        # Verified against when no user matches, so unknown emails cost the same as wrong passwords
+        self._dummy_hash = None
+
+    async def _run(self, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            raise CredentialServiceBusy("Too many sign-ins in progress, try again shortly")
+        try:
+            future = self._executor.submit(fn, *args)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(future), self.timeout)
+        except asyncio.TimeoutError:
+            raise CredentialServiceBusy("Password check timed out, try again shortly")
+
+    async def hash_password(self, password):
+        return await self._run(self.hasher.hash, password)
+
+    def _verify(self, stored, password):
+        if stored.startswith("$argon2"):
+            try:
+                self.hasher.verify(stored, password)
+            except (VerificationError, InvalidHashError):
+                return False, None
+            # Stored with older parameters: upgrade while we have the password
+            if self.hasher.check_needs_rehash(stored):
+                return True, self.hasher.hash(password)
+            return True, None
+        # Rows written before hashing was introduced hold the plaintext;
+        # replace it with a hash on the user's next successful login
+        if hmac.compare_digest(stored.encode(), password.encode()):
+            return True, self.hasher.hash(password)
+        return False, None
+
+    async def verify_password(self, stored, password):
+        """Return (matches, new_hash); ``new_hash`` is set when the stored value should be replaced."""
+        return await self._run(self._verify, stored, password)
+
+    async def verify_nothing(self, password):
+        """Spend the same time as a real verification when no account matched."""
+        if self._dummy_hash is None:
+            self._dummy_hash = await self.hash_password("not-a-real-password")
+        await self.verify_password(self._dummy_hash, password)
+
+
+credentials = CredentialService()
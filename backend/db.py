@@ -0,0 +1,297 @@
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import psycopg2
+from psycopg2 import extensions
+from psycopg2.extras import RealDictCursor
+from dotenv import load_dotenv
+
+import metrics
+
+load_dotenv()
+
+
+class PoolTimeout(Exception):
+    """Raised when no connection could be borrowed within the acquire timeout."""
+
+
+class TimedCursor(RealDictCursor):
+    """RealDictCursor that reports the execution time of every statement to metrics."""
+
+    def execute(self, query, vars=None):
+        start = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            metrics.record_query(query, time.perf_counter() - start)
+
+    def executemany(self, query, vars_list):
+        start = time.perf_counter()
+        try:
+            return super().executemany(query, vars_list)
+        finally:
+            metrics.record_query(query, time.perf_counter() - start)
+
+    def copy_expert(self, sql, file, size=8192):
+        start = time.perf_counter()
+        try:
+            return super().copy_expert(sql, file, size)
+        finally:
+            metrics.record_query(sql, time.perf_counter() - start)
+
+
+class _PooledConnection:
+    __slots__ = ("conn", "created_at", "last_used")
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.created_at = time.monotonic()
+        self.last_used = self.created_at
+
+
+class ConnectionPool:
+    """Thread-safe psycopg2 connection pool.
+
+    Connections are opened lazily up to ``max_size`` and handed out LIFO so the
+    warmest connection is reused first. A connection that has been idle for
+    longer than ``check_after`` seconds is pinged before it is returned, and
+    connections older than ``max_lifetime`` or idle longer than ``max_idle``
+    are closed and replaced.
+    """
+
+    def __init__(self, dsn, min_size=1, max_size=10, timeout=5.0,
+                 max_lifetime=1800.0, max_idle=300.0, check_after=30.0,
+                 cursor_factory=TimedCursor, name="sync"):
+        if min_size < 0 or max_size < 1 or min_size > max_size:
+            raise ValueError("Invalid pool size: min=%s max=%s" % (min_size, max_size))
+        self.dsn = dsn
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.max_lifetime = max_lifetime
+        self.max_idle = max_idle
+        self.check_after = check_after
+        self.cursor_factory = cursor_factory
+        # The engine label of this pool's metrics, e.g. a replica's name
+        self.name = name
+
+        self._lock = threading.Condition()
+        self._idle = deque()
+        self._in_use = {}
+        self._size = 0
+        self._opened = False
+
+        self._waiting = 0
+        self._waits = 0
+        self._wait_time = 0.0
+        self._timeouts = 0
+        self._created = 0
+        self._recycled = 0
+        self._failed_checks = 0
+        self._connect_errors = 0
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            os.getenv("DATABASE_URL"),
+            min_size=int(os.getenv("DB_POOL_MIN_SIZE", "1")),
+            max_size=int(os.getenv("DB_POOL_MAX_SIZE", "10")),
+            timeout=float(os.getenv("DB_POOL_TIMEOUT", "5")),
+            max_lifetime=float(os.getenv("DB_POOL_MAX_LIFETIME", "1800")),
+            max_idle=float(os.getenv("DB_POOL_MAX_IDLE", "300")),
+            check_after=float(os.getenv("DB_POOL_CHECK_AFTER", "30")),
+        )
+
+    def _connect(self):
+        conn = psycopg2.connect(self.dsn, cursor_factory=self.cursor_factory)
+        with self._lock:
+            self._created += 1
+        return _PooledConnection(conn)
+
+    def _discard(self, pooled):
+        try:
+            pooled.conn.close()
+        except Exception:
+            pass
+
+    def _expired(self, pooled, now):
+        return (now - pooled.created_at > self.max_lifetime
+                or now - pooled.last_used > self.max_idle)
+
+    def _is_healthy(self, pooled, now):
+        if pooled.conn.closed:
+            return False
+        if now - pooled.last_used < self.check_after:
+            return True
+        try:
+            with pooled.conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            pooled.conn.rollback()
+            return True
+        except Exception:
+            with self._lock:
+                self._failed_checks += 1
+            return False
+
+    def open(self):
+        """Open the pool and pre-create ``min_size`` connections."""
+        with self._lock:
+            if self._opened:
+                return
+            self._opened = True
+            missing = self.min_size - self._size
+            self._size += max(missing, 0)
+        for _ in range(max(missing, 0)):
+            try:
+                pooled = self._connect()
+            except Exception:
+                with self._lock:
+                    self._size -= 1
+                    self._lock.notify()
+                raise
+            with self._lock:
+                self._idle.append(pooled)
+                self._lock.notify()
+
+    def close(self):
+        """Close idle connections and stop handing out new ones.
+
+        Connections still borrowed are closed when they are returned. The pool
+        can be reopened afterwards, which keeps repeated app start/stop cycles
+        (e.g. in tests) working.
+        """
+        with self._lock:
+            self._opened = False
+            idle = list(self._idle)
+            self._idle.clear()
+            self._size -= len(idle)
+            self._lock.notify_all()
+        for pooled in idle:
+            self._discard(pooled)
+
+    def getconn(self, timeout=None):
+        if not self._opened:
+            self.open()
+        timeout = self.timeout if timeout is None else timeout
+        start = time.monotonic()
+        deadline = start + timeout
+        waited = False
+
+        while True:
+            pooled = None
+            create = False
+            with self._lock:
+                while not self._idle and self._size >= self.max_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._timeouts += 1
+                        if waited:
+                            self._wait_time += time.monotonic() - start
+                        metrics.record_acquire(self.name, time.monotonic() - start)
+                        raise PoolTimeout(
+                            "Timed out after %.1fs waiting for a database connection" % timeout
+                        )
+                    if not waited:
+                        waited = True
+                        self._waits += 1
+                    self._waiting += 1
+                    try:
+                        self._lock.wait(remaining)
+                    finally:
+                        self._waiting -= 1
+                if self._idle:
+                    pooled = self._idle.pop()
+                else:
+                    self._size += 1
+                    create = True
+
+            if create:
+                try:
+                    pooled = self._connect()
+                except Exception:
+                    with self._lock:
+                        self._size -= 1
+                        self._connect_errors += 1
+                        self._lock.notify()
+                    raise
+            else:
+                now = time.monotonic()
+                if self._expired(pooled, now) or not self._is_healthy(pooled, now):
+                    self._discard(pooled)
+                    with self._lock:
+                        self._size -= 1
+                        self._recycled += 1
+                        self._lock.notify()
+                    continue
+
+            with self._lock:
+                if waited:
+                    self._wait_time += time.monotonic() - start
+                self._in_use[id(pooled.conn)] = pooled
+            metrics.record_acquire(self.name, time.monotonic() - start)
+            return pooled.conn
+
+    def putconn(self, conn):
+        with self._lock:
+            pooled = self._in_use.pop(id(conn), None)
+        if pooled is None:
+            raise ValueError("Connection does not belong to this pool")
+
+        keep = not conn.closed and self._opened
+        if keep and conn.info.transaction_status != extensions.TRANSACTION_STATUS_IDLE:
+            try:
+                conn.rollback()
+            except Exception:
+                keep = False
+        now = time.monotonic()
+        if keep and now - pooled.created_at > self.max_lifetime:
+            keep = False
+
+        if keep:
+            pooled.last_used = now
+            with self._lock:
+                self._idle.append(pooled)
+                self._lock.notify()
+        else:
+            self._discard(pooled)
+            with self._lock:
+                self._size -= 1
+                self._recycled += 1
+                self._lock.notify()
+
+    @contextmanager
+    def connection(self, timeout=None):
+        """Borrow a connection for the duration of the ``with`` block.
+
+        Any transaction left open by the caller is rolled back on return, so
+        handlers only need to commit on success.
+        """
+        conn = self.getconn(timeout)
+        try:
+            yield conn
+        finally:
+            self.putconn(conn)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "min_size": self.min_size,
+                "max_size": self.max_size,
+                "size": self._size,
+                "in_use": len(self._in_use),
+                "idle": len(self._idle),
+                "waiting": self._waiting,
+                "waits": self._waits,
+                "wait_time_seconds": round(self._wait_time, 6),
+                "timeouts": self._timeouts,
+                "connections_created": self._created,
+                "connections_recycled": self._recycled,
+                "failed_health_checks": self._failed_checks,
+                "connect_errors": self._connect_errors,
+            }
+
+
+pool = ConnectionPool.from_env()
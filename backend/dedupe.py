@@ -0,0 +1,135 @@
+"""Group duplicate applications into duplicate_clusters for review.
+
+    python dedupe.py
+
+One set-based pass: applications, live and archived, are grouped by
+normalized PAN and by normalized name + father's name + date of birth (the
+keys queries.DUPLICATE_KEYS_SQL reads), so the cost grows with the number of
+rows, not with the number of pairs. Clusters are upserted by key: a cluster
+that gained members is reopened, a reviewed one that did not keeps its
+status, and an open cluster whose key is no longer shared is marked
+resolved.
+"""
+import os
+import sys
+
+import psycopg2
+from dotenv import load_dotenv
+
+from queries import DUPLICATE_KEYS_SQL
+
+load_dotenv()
+
+# Memory for the grouping; more keeps large tables in one in-memory hash pass
+WORK_MEM = os.getenv("DEDUPE_WORK_MEM", "256MB")
+
+# Groups of applications sharing a key, upserted into duplicate_clusters. The
+# scopes narrow the groups to some keys; {resolve} decides whether open
+# clusters that were not found again are marked resolved.
+_CLUSTER_SQL = """
+    WITH all_keys AS {materialized}({keys}), found AS (
+        SELECT 'pan' AS match_type, pan_key AS match_key, array_agg(id ORDER BY id) AS ids
+        FROM all_keys
+        -- Blank or punctuation-only PANs are not a shared PAN
+        WHERE pan_key <> ''{pan_scope}
+        GROUP BY pan_key
+        HAVING count(*) > 1
+        UNION ALL
+        SELECT 'identity', identity_key || '|' || to_char(date_of_birth, 'YYYY-MM-DD'), array_agg(id ORDER BY id)
+        FROM all_keys{identity_scope}
+        GROUP BY identity_key, date_of_birth
+        HAVING count(*) > 1
+    ), upserted AS (
+        INSERT INTO duplicate_clusters (match_type, match_key, application_ids, size)
+        SELECT match_type, match_key, ids, cardinality(ids) FROM found
+        ON CONFLICT (match_type, match_key) DO UPDATE
+            SET application_ids = EXCLUDED.application_ids,
+                size = EXCLUDED.size,
+                status = CASE WHEN EXCLUDED.application_ids <@ duplicate_clusters.application_ids
+                              AND duplicate_clusters.status <> 'resolved'
+                              THEN duplicate_clusters.status ELSE 'open' END,
+                updated_at = NOW()
+            WHERE duplicate_clusters.application_ids IS DISTINCT FROM EXCLUDED.application_ids
+               OR duplicate_clusters.status = 'resolved'
+        RETURNING xmax = 0 AS created
+    ), resolved AS (
+        UPDATE duplicate_clusters d SET status = 'resolved', updated_at = NOW()
+        WHERE {resolve} AND d.status = 'open'
+          AND NOT EXISTS (SELECT 1 FROM found f WHERE f.match_type = d.match_type AND f.match_key = d.match_key)
+        RETURNING 1
+    )
+    SELECT (SELECT count(*) FROM found) AS clusters,
+           (SELECT count(*) FILTER (WHERE created) FROM upserted) AS created,
+           (SELECT count(*) FILTER (WHERE NOT created) FROM upserted) AS updated,
+           (SELECT count(*) FROM resolved) AS resolved
+"""
+
+DEDUPE_SQL = _CLUSTER_SQL.format(materialized="", keys=DUPLICATE_KEYS_SQL, pan_scope="", identity_scope="", resolve="true")
+
+# Only the keys of applications loaded after %(since)s; used after an import.
+# Inlined rather than materialized, so each group is an index probe.
+DEDUPE_SINCE_SQL = _CLUSTER_SQL.format(
+    materialized="NOT MATERIALIZED ",
+    keys=DUPLICATE_KEYS_SQL,
+    pan_scope="\n          AND pan_key IN (SELECT normalize_pan(pan) FROM applications WHERE id > %(since)s)",
+    identity_scope="\n        WHERE (identity_key, date_of_birth) IN (\n"
+                   "            SELECT normalize_identity(name, father_name), date_of_birth FROM applications WHERE id > %(since)s)",
+    resolve="false",
+)
+
+
+def last_application_id(cur):
+    """The highest id handed out so far; every application inserted later has a greater one."""
+    cur.execute("SELECT COALESCE(pg_sequence_last_value(pg_get_serial_sequence('applications', 'id')), 0) AS id")
+    row = cur.fetchone()
+    return row["id"] if isinstance(row, dict) else row[0]
+
+
+def cluster_since(cur, since):
+    """Cluster applications sharing a key with one inserted after id ``since``, in the caller's transaction.
+
+    For rows that bypassed the submit check, such as a bulk import; costs a
+    pass over those keys only, not the whole table. Returns the same counts
+    as find_duplicates (nothing is resolved).
+    """
+    cur.execute(DEDUPE_SINCE_SQL, {"since": since})
+    row = cur.fetchone()
+    keys = ("clusters", "created", "updated", "resolved")
+    return dict(row) if isinstance(row, dict) else dict(zip(keys, row))
+
+
+def find_duplicates(conn):
+    """Run the dedupe pass in one transaction; return counts of clusters found, created, updated and resolved."""
+    with conn.cursor() as cur:
+        try:
+            cur.execute("SET LOCAL work_mem = %s", (WORK_MEM,))
+            cur.execute(DEDUPE_SQL)
+            row = cur.fetchone()
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    keys = ("clusters", "created", "updated", "resolved")
+    return dict(row) if isinstance(row, dict) else dict(zip(keys, row))
+
+
+def main():
+    try:
+        conn = psycopg2.connect(os.getenv("DATABASE_URL"))
+    except Exception as e:
+        print(f"✗ Could not connect to the database: {e}")
+        return 1
+    try:
+        report = find_duplicates(conn)
+        print(f"✓ {report['clusters']} duplicate cluster(s): {report['created']} new, "
+              f"{report['updated']} changed, {report['resolved']} resolved")
+        return 0
+    except Exception as e:
+        print(f"✗ Dedupe failed: {e}")
+        return 1
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
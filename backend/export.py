@@ -0,0 +1,90 @@
+import csv
+import io
+import json
+import os
+import zlib
+from datetime import date, datetime
+
+from psycopg2.extensions import cursor as TupleCursor
+
+from db import pool
+from queries import APPLICATION_COLUMNS
+
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "2000"))
+
+MEDIA_TYPES = {"csv": "text/csv", "ndjson": "application/x-ndjson"}
+
+
+def _plain(value):
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    return value
+
+
+def _encode_csv(rows, header=False):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if header:
+        writer.writerow(APPLICATION_COLUMNS)
+    writer.writerows([_plain(v) for v in row] for row in rows)
+    return buffer.getvalue().encode()
+
+
+def _encode_ndjson(rows):
+    return "".join(
+        json.dumps(dict(zip(APPLICATION_COLUMNS, map(_plain, row)))) + "\n" for row in rows
+    ).encode()
+
+
+class Export:
+    """A CSV or NDJSON export of ``sql`` whose query has already started.
+
+    The connection is borrowed, the query run and its first batch read when
+    the export is created, before any response is sent, so a pool timeout or
+    a failing statement becomes an error status rather than a truncated file
+    behind a 200. ``chunks`` yields the body, one chunk per batch, through a
+    named (server-side) cursor: Postgres keeps the result set and only
+    ``batch_size`` rows are ever held in the API process. ``close`` returns
+    the pooled connection; it runs when ``chunks`` ends and is safe to call
+    again, e.g. from the response's background task when the client went
+    away before the body started.
+    """
+
+    def __init__(self, sql, params, fmt="csv", compress=False, batch_size=EXPORT_BATCH_SIZE):
+        self.fmt = fmt
+        self.compress = compress
+        self.batch_size = batch_size
+        self._conn = pool.getconn()
+        try:
+            self._cur = self._conn.cursor(name="applications_export", cursor_factory=TupleCursor)
+            self._cur.execute(sql, params)
+            # Errors while the query runs only surface on the first fetch
+            self._first = self._cur.fetchmany(batch_size)
+        except Exception:
+            self.close()
+            raise
+
+    def chunks(self):
+        compressor = zlib.compressobj(wbits=31) if self.compress else None
+        try:
+            if self.fmt == "csv":
+                chunk = _encode_csv([], header=True)
+                yield compressor.compress(chunk) if compressor else chunk
+            rows = self._first
+            while rows:
+                chunk = _encode_csv(rows) if self.fmt == "csv" else _encode_ndjson(rows)
+                if compressor:
+                    chunk = compressor.compress(chunk)
+                if chunk:
+                    yield chunk
+                rows = self._cur.fetchmany(self.batch_size)
+        finally:
+            self.close()
+        if compressor:
+            yield compressor.flush()
+
+    def close(self):
+        conn, self._conn = self._conn, None
+        if conn is not None:
+            # Rolling back (in putconn) also closes the server-side cursor
+            pool.putconn(conn)
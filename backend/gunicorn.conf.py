@@ -0,0 +1,27 @@
+# Production serving: gunicorn main:app -c gunicorn.conf.py
+import multiprocessing
+import os
+
+bind = os.getenv("BIND", "0.0.0.0:8000")
+workers = int(os.getenv("WEB_CONCURRENCY", multiprocessing.cpu_count()))
+worker_class = "uvicorn.workers.UvicornWorker"
+# Import the app once in the master; workers fork from it and start immediately
+preload_app = True
+timeout = int(os.getenv("WORKER_TIMEOUT", "30"))
+graceful_timeout = int(os.getenv("GRACEFUL_TIMEOUT", "30"))
+keepalive = 5
+
+# DB_POOL_TOTAL_SIZE is the connection budget for this host; split it across
+# workers. This file is read before the app is preloaded, so db.py sees the
+# per-worker values when it creates its pool.
+_total = os.getenv("DB_POOL_TOTAL_SIZE")
+if _total:
+    _per_worker = max(1, int(_total) // workers)
+    os.environ["DB_POOL_MAX_SIZE"] = str(_per_worker)
+    os.environ["DB_POOL_MIN_SIZE"] = str(min(int(os.getenv("DB_POOL_MIN_SIZE", "1")), _per_worker))
+
+
+def on_starting(server):
+    # Once per deployment, in the master before any worker forks
+    import main
+    main.check_schema()
@@ -0,0 +1,160 @@
+import logging
+import os
+import threading
+import time
+
+import migrate
+from db import PoolTimeout
+
+logger = logging.getLogger("passport.health")
+
+PROBE_INTERVAL = float(os.getenv("HEALTH_PROBE_INTERVAL", "5"))
+# A snapshot older than this is not trusted: readiness fails until a fresh probe succeeds
+MAX_STALENESS = float(os.getenv("HEALTH_MAX_STALENESS", "15"))
+PROBE_TIMEOUT = float(os.getenv("HEALTH_PROBE_TIMEOUT", "1"))
+
+
+def pool_saturated(stats):
+    """True when every connection is borrowed and callers are queueing for one."""
+    return stats["in_use"] >= stats["max_size"] and stats["waiting"] > 0
+
+
+class HealthMonitor:
+    """Probes the database on a fixed interval and caches the result.
+
+    The health endpoints read the cached snapshot, so load balancer probes
+    cost no database work no matter how often they arrive. Each probe borrows
+    a pooled connection for one query (the schema version), which checks the
+    same path requests use; a probe that cannot get a connection within
+    ``timeout`` marks the snapshot degraded rather than unhealthy.
+
+    With a ``replicas`` router the same probe checks each replica's health and
+    lag, which is what the router uses to decide where reads go. A replica
+    being down or behind does not change the status: reads fall back to the
+    primary.
+    """
+
+    def __init__(self, pool, pools=None, interval=PROBE_INTERVAL, max_staleness=MAX_STALENESS, timeout=PROBE_TIMEOUT,
+                 replicas=None):
+        self.pool = pool
+        self.replicas = replicas
+        # Pools whose saturation is reported, by engine name
+        self.pools = pools or {"sync": pool}
+        self.interval = interval
+        self.max_staleness = max_staleness
+        self.timeout = timeout
+        self._snapshot = None
+        self._checked_at = None
+        self._last_timeouts = {}
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stopping = threading.Event()
+
+    def probe(self):
+        """Run one probe now and store the snapshot."""
+        started = time.monotonic()
+        expected = migrate.latest_version()
+        version = None
+        error = None
+        try:
+            with self.pool.connection(timeout=self.timeout) as conn:
+                version = migrate.current_version(conn)
+            database = "connected"
+        except PoolTimeout as e:
+            database = "unknown"
+            error = f"Pool exhausted: {e}"
+        except Exception as e:
+            database = "disconnected"
+            error = str(e)
+
+        pools = {}
+        exhausted = database == "unknown"
+        for engine, pool in self.pools.items():
+            stats = pool.stats()
+            # New acquire timeouts since the previous probe also count as exhaustion
+            timed_out = stats["timeouts"] > self._last_timeouts.get(engine, stats["timeouts"])
+            self._last_timeouts[engine] = stats["timeouts"]
+            saturated = pool_saturated(stats) or timed_out
+            exhausted = exhausted or saturated
+            pools[engine] = {
+                "in_use": stats["in_use"],
+                "max_size": stats["max_size"],
+                "waiting": stats["waiting"],
+                "saturated": saturated,
+            }
+
+        if database == "disconnected":
+            status, message = "unhealthy", "Database connection failed"
+        elif exhausted:
+            status, message = "degraded", "Connection pool exhausted"
+        elif version < expected:
+            status, message = "degraded", f"Schema at version {version}, expected {expected}; run migrate.py"
+        else:
+            status, message = "healthy", "Database connection successful"
+
+        snapshot = {
+            "status": status,
+            "database": database,
+            "message": message,
+            "schema_version": version,
+            "expected_schema_version": expected,
+            "pools": pools,
+            "probe_ms": round((time.monotonic() - started) * 1000, 2),
+            "checked_at": time.time(),
+        }
+        if error:
+            snapshot["error"] = error
+        if self.replicas is not None and self.replicas.enabled:
+            snapshot["replicas"] = self.replicas.probe(self.timeout)
+        with self._lock:
+            self._snapshot = snapshot
+            self._checked_at = time.monotonic()
+        return snapshot
+
+    def snapshot(self):
+        """Return (snapshot, age_seconds) without touching the database; (None, None) before the first probe."""
+        with self._lock:
+            if self._snapshot is None:
+                return None, None
+            return self._snapshot, time.monotonic() - self._checked_at
+
+    def current(self):
+        """The cached snapshot, marked unhealthy when it is older than ``max_staleness``.
+
+        Without a running prober (e.g. the app was not started through its
+        lifespan) a missing or expired snapshot is refreshed inline instead.
+        """
+        snapshot, age = self.snapshot()
+        if not self.running and (snapshot is None or age >= self.interval):
+            snapshot, age = self.probe(), 0.0
+        if snapshot is None:
+            return {"status": "unhealthy", "database": "unknown", "message": "No health probe has completed yet"}
+        if age > self.max_staleness:
+            return {**snapshot, "status": "unhealthy", "message": f"Health snapshot is stale ({age:.1f}s old)",
+                    "age_seconds": round(age, 3)}
+        return {**snapshot, "age_seconds": round(age, 3)}
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        if self.running:
+            return
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name="health-probe", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopping.set()
+        if self._thread:
+            self._thread.join(5)
+            self._thread = None
+
+    def _run(self):
+        while not self._stopping.is_set():
+            try:
+                self.probe()
+            except Exception:
+                logger.exception("Health probe failed")
+            self._stopping.wait(self.interval)
@@ -0,0 +1,312 @@
+"""Idempotency-Key support for non-idempotent POST endpoints.
+
+A client sends ``Idempotency-Key: <unique value>`` and reuses it when it
+retries the same request. The first request runs normally and its response
+is recorded; repeats get the recorded response back (with
+``Idempotent-Replayed: true``) without reaching the handler or the database.
+A repeat that arrives while the first is still running waits for its result.
+Keys are scoped to method, path and caller: the token's ``sub`` when the
+request carries a valid one, otherwise the body's ``username`` plus the body
+hash, so one client's key never replays another client's response. A
+signed-in caller reusing a key with a different body is rejected with 422.
+"""
+import asyncio
+import base64
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from tokens import InvalidToken, _bearer, tokens
+
+# Endpoints that honour the header
+PATHS = ("/api/applications", "/api/signup")
+# Seconds a recorded response is replayed for
+TTL = float(os.getenv("IDEMPOTENCY_TTL", "3600"))
+MAX_ENTRIES = int(os.getenv("IDEMPOTENCY_MAX_ENTRIES", "10000"))
+# Seconds a repeat waits for the first request before giving up with 409
+WAIT_TIMEOUT = float(os.getenv("IDEMPOTENCY_WAIT_TIMEOUT", "10"))
+# A reservation is dropped after this long, in case its worker died mid-request
+PENDING_TTL = float(os.getenv("IDEMPOTENCY_PENDING_TTL", "60"))
+MAX_KEY_LENGTH = 255
+
+# Responses that describe the outcome of this request and are safe to replay.
+# Server errors, overload and auth failures are not: a retry should run again.
+_NOT_REPLAYED = {401, 403, 408, 425, 429}
+
+
+def replayable(status):
+    return status < 500 and status not in _NOT_REPLAYED
+
+
+class Record:
+    """The request fingerprint plus, once finished, the response to replay."""
+
+    __slots__ = ("fingerprint", "status", "headers", "body")
+
+    def __init__(self, fingerprint, status=None, headers=None, body=b""):
+        self.fingerprint = fingerprint
+        self.status = status
+        self.headers = headers or []
+        self.body = body
+
+    @property
+    def pending(self):
+        return self.status is None
+
+    def dumps(self):
+        return json.dumps({
+            "fingerprint": self.fingerprint,
+            "status": self.status,
+            "headers": [[k.decode("latin-1"), v.decode("latin-1")] for k, v in self.headers],
+            "body": base64.b64encode(self.body).decode(),
+        })
+
+    @classmethod
+    def loads(cls, data):
+        raw = json.loads(data)
+        headers = [(k.encode("latin-1"), v.encode("latin-1")) for k, v in raw["headers"]]
+        return cls(raw["fingerprint"], raw["status"], headers, base64.b64decode(raw["body"]))
+
+
+class MemoryStore:
+    """Records kept in this process, LRU-bounded and expired by TTL.
+
+    Each worker has its own, so a retry that lands on another worker runs
+    again; use RedisStore when several workers serve the same clients.
+    """
+
+    def __init__(self, ttl=TTL, max_entries=MAX_ENTRIES, pending_ttl=PENDING_TTL):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.pending_ttl = pending_ttl
+        self._entries = OrderedDict()
+        self._waiters = {}
+        self._lock = threading.Lock()
+
+    def _get(self, key, now):
+        item = self._entries.get(key)
+        if item is not None and item[1] <= now:
+            del self._entries[key]
+            return None
+        return item[0] if item else None
+
+    def reserve(self, key, fingerprint):
+        """Claim ``key`` for a new request; return None if claimed, else the existing record."""
+        now = time.monotonic()
+        with self._lock:
+            existing = self._get(key, now)
+            if existing is not None:
+                return existing
+            self._entries[key] = (Record(fingerprint), now + self.pending_ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return None
+
+    def complete(self, key, record):
+        with self._lock:
+            self._entries[key] = (record, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            self._wake(key)
+
+    def release(self, key):
+        """Forget a reservation whose request failed, so a retry can run it again."""
+        with self._lock:
+            self._entries.pop(key, None)
+            self._wake(key)
+
+    def _wake(self, key):
+        for waiter in self._waiters.pop(key, ()):
+            waiter.get_loop().call_soon_threadsafe(_resolve, waiter)
+
+    async def wait(self, key, timeout):
+        """Wait until ``key`` is completed or released, at most ``timeout`` seconds."""
+        with self._lock:
+            existing = self._get(key, time.monotonic())
+            if existing is None or not existing.pending:
+                return
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.setdefault(key, []).append(waiter)
+        try:
+            await asyncio.wait_for(waiter, timeout)
+        except asyncio.TimeoutError:
+            with self._lock:
+                if waiter in self._waiters.get(key, ()):
+                    self._waiters[key].remove(waiter)
+
+
+def _resolve(waiter):
+    if not waiter.done():
+        waiter.set_result(None)
+
+
+class RedisStore:
+    """Records shared by all workers, stored in Redis. Requires the ``redis`` package."""
+
+    POLL_INTERVAL = 0.05
+
+    def __init__(self, url, ttl=TTL, pending_ttl=PENDING_TTL, prefix="passport:idempotency:"):
+        try:
+            import redis
+        except ImportError as e:
+            raise RuntimeError("IDEMPOTENCY_BACKEND=redis requires the redis package (pip install redis)") from e
+        self._client = redis.Redis.from_url(url)
+        self.ttl = ttl
+        self.pending_ttl = pending_ttl
+        self.prefix = prefix
+
+    def _load(self, key):
+        data = self._client.get(self.prefix + key)
+        return Record.loads(data) if data is not None else None
+
+    def reserve(self, key, fingerprint):
+        if self._client.set(self.prefix + key, Record(fingerprint).dumps(), nx=True, ex=int(self.pending_ttl)):
+            return None
+        # Expired between the two calls: treat as free on the next attempt
+        return self._load(key) or Record(fingerprint)
+
+    def complete(self, key, record):
+        self._client.set(self.prefix + key, record.dumps(), ex=int(self.ttl))
+
+    def release(self, key):
+        self._client.delete(self.prefix + key)
+
+    async def wait(self, key, timeout):
+        # Other workers cannot wake us, so poll
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            record = self._load(key)
+            if record is None or not record.pending:
+                return
+            await asyncio.sleep(self.POLL_INTERVAL)
+
+
+def store_from_env():
+    kind = os.getenv("IDEMPOTENCY_BACKEND", "memory").lower()
+    if kind == "none":
+        return None
+    if kind == "redis":
+        return RedisStore(os.getenv("IDEMPOTENCY_REDIS_URL", "redis://localhost:6379/2"))
+    return MemoryStore()
+
+
+store = store_from_env()
+
+
+async def _send_json(send, status, detail, extra_headers=()):
+    body = json.dumps({"detail": detail}).encode()
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode()), *extra_headers],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+async def _read_body(receive):
+    chunks = []
+    while True:
+        message = await receive()
+        if message["type"] != "http.request":
+            return None
+        chunks.append(message.get("body", b""))
+        if not message.get("more_body", False):
+            return b"".join(chunks)
+
+
+def _caller(scope, body, fingerprint):
+    """Who sent the request: the verified token subject, else username + body hash."""
+    authorization = next((v.decode("latin-1") for k, v in scope["headers"] if k == b"authorization"), None)
+    token = _bearer(authorization)
+    if token:
+        try:
+            return ["sub", tokens.verify(token)["sub"]]
+        except InvalidToken:
+            pass
+    try:
+        username = json.loads(body).get("username")
+    except (ValueError, AttributeError):
+        username = None
+    return ["anonymous", username, fingerprint]
+
+
+class IdempotencyMiddleware:
+    """ASGI middleware applying the module's ``store`` to POSTs on PATHS that carry Idempotency-Key."""
+
+    def __init__(self, app, paths=PATHS):
+        self.app = app
+        self.paths = paths
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "POST" or scope["path"] not in self.paths or store is None:
+            await self.app(scope, receive, send)
+            return
+        key = next((v.decode("latin-1") for k, v in scope["headers"] if k == b"idempotency-key"), None)
+        if key is None:
+            await self.app(scope, receive, send)
+            return
+        if not key or len(key) > MAX_KEY_LENGTH:
+            await _send_json(send, 400, f"Idempotency-Key must be 1 to {MAX_KEY_LENGTH} characters")
+            return
+
+        body = await _read_body(receive)
+        if body is None:
+            return
+        fingerprint = hashlib.sha256(body).hexdigest()
+        store_key = json.dumps([scope["method"], scope["path"], *_caller(scope, body, fingerprint), key])
+
+        deadline = time.monotonic() + WAIT_TIMEOUT
+        while True:
+            existing = store.reserve(store_key, fingerprint)
+            if existing is None:
+                break
+            if existing.fingerprint != fingerprint:
+                await _send_json(send, 422, "Idempotency-Key was already used with a different request body")
+                return
+            if not existing.pending:
+                await send({"type": "http.response.start", "status": existing.status,
+                            "headers": existing.headers + [(b"idempotent-replayed", b"true")]})
+                await send({"type": "http.response.body", "body": existing.body})
+                return
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                await _send_json(send, 409, "A request with this Idempotency-Key is still in progress",
+                                 [(b"retry-after", b"1")])
+                return
+            # Woken when the first request finishes; if it failed and released
+            # the key, the next reserve() claims it and this request runs instead
+            await store.wait(store_key, remaining)
+
+        delivered = False
+
+        async def replay_receive():
+            nonlocal delivered
+            if not delivered:
+                delivered = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            return await receive()
+
+        response = Record(fingerprint)
+        chunks = []
+
+        async def recording_send(message):
+            if message["type"] == "http.response.start":
+                response.status = message["status"]
+                response.headers = list(message.get("headers", []))
+            elif message["type"] == "http.response.body":
+                chunks.append(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, replay_receive, recording_send)
+        except BaseException:
+            store.release(store_key)
+            raise
+        if response.status is not None and replayable(response.status):
+            response.body = b"".join(chunks)
+            store.complete(store_key, response)
+        else:
+            store.release(store_key)
@@ -0,0 +1,39 @@
+import argparse
+import os
+import sys
+
+import psycopg2
+from dotenv import load_dotenv
+
+import bulk_import
+
+load_dotenv()
+
+parser = argparse.ArgumentParser(description="Bulk import applications from a CSV or NDJSON file using COPY")
+parser.add_argument("path", help="CSV file with a header row, or NDJSON file with one application per line")
+parser.add_argument("--format", choices=sorted(bulk_import.READERS), help="defaults to the file extension")
+parser.add_argument("--batch-size", type=int, default=bulk_import.DEFAULT_BATCH_SIZE, help="rows sent per COPY batch")
+args = parser.parse_args()
+
+fmt = args.format or ("csv" if args.path.lower().endswith(".csv") else "ndjson")
+
+try:
+    print(f"Importing {args.path} ({fmt})...")
+    conn = psycopg2.connect(os.getenv("DATABASE_URL"))
+    with open(args.path, encoding="utf-8-sig", newline="") as f:
+        report = bulk_import.import_applications(conn, bulk_import.READERS[fmt](f), args.batch_size)
+    conn.close()
+
+    print(f"✓ Imported {report['imported']} applications, rejected {report['rejected']}")
+    if report["duplicate_clusters"]:
+        print(f"⚠ {report['duplicate_clusters']} duplicate cluster(s) flagged for review")
+    for error in report["errors"]:
+        print(f"  - line {error['line']}: {error['reason']}")
+    if report["errors_truncated"]:
+        print(f"  ... {report['rejected'] - len(report['errors'])} more rejected rows not shown")
+
+except Exception as e:
+    print(f"✗ Import failed: {e}")
+    import traceback
+    traceback.print_exc()
+    sys.exit(1)
@@ -0,0 +1,232 @@
+"""Structured logging that never blocks a request.
+
+Records are put on a bounded in-memory queue by the thread that logs them
+and written to stdout by a background listener thread, so a slow terminal
+or log shipper costs the API nothing. When the queue is full, new records
+are dropped and counted (``log_records_dropped_total``) rather than waited
+for.
+
+Every record carries the request's correlation id (``X-Request-ID``, taken
+from the client or generated), and sensitive fields such as the PAN, phone
+number and addresses are masked before they are written. Pass structured
+data as ``extra={"fields": {...}}``.
+"""
+import atexit
+import copy
+import json
+import logging
+import os
+import queue
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+import metrics
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+# json for log pipelines, text for reading in a terminal
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json").lower()
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+# Share of successful requests that get an access log line; errors and slow requests always do
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", "1.0"))
+# Requests at least this slow are always logged (0 disables the override)
+LOG_SLOW_MS = float(os.getenv("LOG_SLOW_MS", "1000"))
+
+REDACTED = "[redacted]"
+# "q" is the search term, which is usually a name, PAN or phone number
+REDACTED_FIELDS = frozenset({
+    "pan", "phone", "email", "name", "father_name", "date_of_birth", "permanent_address", "temporary_address",
+    "password", "authorization", "token", "q",
+})
+# PANs that reach a message some other way, e.g. in a database error's DETAIL
+_PAN_TEXT = re.compile(r"\b[A-Za-z]{5}[0-9]{4}[A-Za-z]\b")
+_REQUEST_ID = re.compile(r"^[A-Za-z0-9._-]{1,64}$")
+
+request_id = ContextVar("request_id", default=None)
+
+dropped_total = metrics.registry.counter(
+    "log_records_dropped_total", "Log records dropped because the log queue was full")
+
+logger = logging.getLogger("passport")
+access_logger = logging.getLogger("passport.access")
+
+
+def redact(value):
+    """``value`` with every REDACTED_FIELDS key masked, at any depth."""
+    if isinstance(value, dict):
+        return {k: REDACTED if k.lower() in REDACTED_FIELDS else redact(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [redact(v) for v in value]
+    if isinstance(value, str):
+        return _PAN_TEXT.sub(REDACTED, value)
+    return value
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": redact(record.getMessage()),
+        }
+        if getattr(record, "request_id", None):
+            entry["request_id"] = record.request_id
+        fields = getattr(record, "fields", None)
+        if fields:
+            entry.update(redact(fields))
+        if record.exc_info:
+            entry["exception"] = redact(self.formatException(record.exc_info))
+        return json.dumps(entry, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    def format(self, record):
+        line = f"{self.formatTime(record)} {record.levelname:<7} {record.name}"
+        if getattr(record, "request_id", None):
+            line += f" [{record.request_id}]"
+        line += f" {redact(record.getMessage())}"
+        fields = getattr(record, "fields", None)
+        if fields:
+            line += " " + " ".join(f"{k}={v}" for k, v in redact(fields).items())
+        if record.exc_info:
+            line += "\n" + redact(self.formatException(record.exc_info))
+        return line
+
+
+class DroppingQueueHandler(QueueHandler):
+    """QueueHandler that drops (and counts) records instead of blocking when the queue is full.
+
+    The listener thread is started on first use in each process, so workers
+    forked from a preloaded gunicorn master get their own.
+    """
+
+    def __init__(self, target, size=LOG_QUEUE_SIZE):
+        super().__init__(queue.Queue(size))
+        self.target = target
+        self.size = size
+        self.dropped = 0
+        self._listener = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _ensure_listener(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            # A forked child inherits the parent's queue but not its thread
+            self.queue = queue.Queue(self.size)
+            self._listener = QueueListener(self.queue, self.target, respect_handler_level=True)
+            self._listener.start()
+            self._pid = os.getpid()
+
+    def prepare(self, record):
+        # Only cheap work here, on the logging thread: the message is merged
+        # and the correlation id captured; formatting happens on the listener
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if not hasattr(record, "request_id"):
+            record.request_id = request_id.get()
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+            dropped_total.inc()
+
+    def emit(self, record):
+        self._ensure_listener()
+        super().emit(record)
+
+    def flush(self):
+        """Wait until every queued record has been written (used at exit and in tests)."""
+        if self._listener is not None and self._pid == os.getpid():
+            self._listener.stop()
+            self._pid = None
+
+    def close(self):
+        self.flush()
+        super().close()
+
+
+def configure(stream=None):
+    """Route the ``passport`` loggers through the queue; safe to call more than once."""
+    for handler in logger.handlers:
+        if isinstance(handler, DroppingQueueHandler):
+            return handler
+    target = logging.StreamHandler(stream or sys.stdout)
+    target.setFormatter(TextFormatter() if LOG_FORMAT == "text" else JsonFormatter())
+    handler = DroppingQueueHandler(target)
+    logger.addHandler(handler)
+    logger.setLevel(LOG_LEVEL)
+    # Otherwise uvicorn's or pytest's root handlers would write each record again, synchronously
+    logger.propagate = False
+    atexit.register(handler.flush)
+    return handler
+
+
+def _header(scope, name):
+    for key, value in scope["headers"]:
+        if key == name:
+            return value.decode("latin-1")
+    return None
+
+
+class RequestLogMiddleware:
+    """ASGI middleware assigning each request a correlation id and writing a sampled access log.
+
+    The id comes from a well-formed ``X-Request-ID`` header or is generated,
+    is returned in the response's ``X-Request-ID`` and is attached to every
+    record logged while the request is handled.
+    """
+
+    def __init__(self, app, sample_rate=LOG_SAMPLE_RATE, slow_ms=LOG_SLOW_MS):
+        self.app = app
+        self.sample_rate = sample_rate
+        self.slow_ms = slow_ms
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        incoming = _header(scope, b"x-request-id")
+        rid = incoming if incoming and _REQUEST_ID.match(incoming) else uuid.uuid4().hex
+        token = request_id.set(rid)
+        status = 500
+
+        async def send_with_id(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                message = {**message, "headers": list(message.get("headers", [])) + [(b"x-request-id", rid.encode())]}
+            await send(message)
+
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            ms = (time.perf_counter() - start) * 1000
+            if status >= 400 or (self.slow_ms and ms >= self.slow_ms) or random.random() < self.sample_rate:
+                access_logger.log(
+                    logging.WARNING if status >= 500 else logging.INFO,
+                    "%s %s %s", scope["method"], scope["path"], status,
+                    extra={"request_id": rid, "fields": {
+                        "method": scope["method"],
+                        "route": metrics.route_template(scope),
+                        "status": status,
+                        "duration_ms": round(ms, 2),
+                    }},
+                )
+            request_id.reset(token)
@@ -1,16 +1,55 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, APIRouter, Depends, HTTPException, Query, Request, Response, UploadFile
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel, field_validator
-from typing import List, Optional
+from fastapi.responses import JSONResponse, StreamingResponse
+from starlette.background import BackgroundTask
 from dotenv import load_dotenv
+import asyncio
+import io
+import logging
 import os
+from datetime import datetime
+from typing import Optional
 import psycopg2
-from psycopg2.extras import RealDictCursor
+from db import pool, PoolTimeout
+from credentials import credentials, CredentialServiceBusy
+from tokens import tokens, is_admin, require_user, require_admin, require_admin_stream
+from schemas import SignUpRequest, LoginRequest, ApplicationRequest, BulkStatusRequest
+from queries import build_list_query, build_item_query, next_cursor, parse_fields, DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
+from queries import RETURNING_COLUMNS, build_duplicate_lock_query, build_submit_query, DUPLICATE_POLICY
+from queries import build_bulk_status_query, build_filter_status_query, build_export_query, build_stats_query
+from queries import build_search_query, DEFAULT_SEARCH_LIMIT, MAX_SEARCH_LIMIT
+import bulk_import
+import export
+from cache import response_cache, list_key, item_key, stats_key, search_key, InvalidationListener
+import changes
+import metrics
+import admission
+import idempotency
+import migrate
+import health
+import async_db
+import async_api
+import replicas
+import logs
 
 load_dotenv()
 
+logs.configure()
+logger = logging.getLogger("passport.api")
+
+# "sync" serves the data endpoints from psycopg2 on the threadpool, "async" from
+# the asyncio pool in async_db.py. Both expose the same routes and responses.
+DB_MODE = os.getenv("DB_MODE", "sync").lower()
+
 app = FastAPI()
+app.state.ready = False
+router = APIRouter()
 
+# Innermost, so shed requests still get CORS headers and are counted in metrics
+app.add_middleware(admission.AdmissionMiddleware, routes=app.router.routes)
+# Outside admission control: replaying a recorded response costs nothing
+app.add_middleware(idempotency.IdempotencyMiddleware)
 app.add_middleware(
     CORSMiddleware,
     # Allow Vite dev server origins (5173 and 5174) and loopback variants during development
@@ -18,110 +57,94 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "ETag", "Last-Modified", "Retry-After", "Idempotent-Replayed", "X-Request-ID"],
 )
+# Added after CORS so it wraps it too and times every request end to end
+app.add_middleware(metrics.MetricsMiddleware)
+# Outermost, so the correlation id is set for everything below, metrics' slow log included
+app.add_middleware(logs.RequestLogMiddleware)
 
-# Database connection
-def get_db_connection():
-    return psycopg2.connect(
-        os.getenv("DATABASE_URL"),
-        cursor_factory=RealDictCursor
-    )
+metrics.registry.register_pool(pool)
+if DB_MODE == "async":
+    metrics.registry.register_pool(async_db.pool)
+
+for replica in replicas.router.replicas:
+    metrics.registry.register_pool(replica.async_pool if DB_MODE == "async" else replica.pool)
+
+# Invalidates the cache when the archive job (another process) moves rows
+cache_listener = InvalidationListener(response_cache, os.getenv("DATABASE_URL"))
+
+health_monitor = health.HealthMonitor(pool, {"sync": pool, "async": async_db.pool} if DB_MODE == "async" else None,
+                                      replicas=replicas.router)
 
-# Initialize database tables
-def init_database():
+# Schema changes are applied by migrate.py; startup only compares versions
+AUTO_MIGRATE = os.getenv("AUTO_MIGRATE", "false").lower() == "true"
+# Set once the check passed. Under gunicorn with preload_app the master runs
+# it before forking, so workers inherit True and skip it.
+schema_checked = False
+
+def check_schema():
+    global schema_checked
+    expected = migrate.latest_version()
+    # A dedicated connection rather than the pool: in the gunicorn master a
+    # pooled connection would be inherited by every forked worker
     try:
-        conn = get_db_connection()
-        cur = conn.cursor()
-        
-        # Create users table
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS users (
-                id SERIAL PRIMARY KEY,
-                username VARCHAR(255) UNIQUE NOT NULL,
-                email VARCHAR(255) NOT NULL,
-                password VARCHAR(255) NOT NULL,
-                category VARCHAR(50) NOT NULL,
-                created_at TIMESTAMP DEFAULT NOW()
-            )
-        """)
-        
-        # Create applications table
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS applications (
-                id SERIAL PRIMARY KEY,
-                username VARCHAR(255) NOT NULL,
-                name VARCHAR(255) NOT NULL,
-                father_name VARCHAR(255) NOT NULL,
-                date_of_birth DATE NOT NULL,
-                permanent_address TEXT NOT NULL,
-                temporary_address TEXT NOT NULL,
-                phone VARCHAR(50) NOT NULL,
-                email VARCHAR(255) NOT NULL,
-                pan VARCHAR(10) NOT NULL,
-                status VARCHAR(50) DEFAULT 'pending',
-                created_at TIMESTAMP DEFAULT NOW()
-            )
-        """)
-        
-        # Create indexes
-        cur.execute("CREATE INDEX IF NOT EXISTS idx_users_username ON users(username)")
-        cur.execute("CREATE INDEX IF NOT EXISTS idx_applications_username ON applications(username)")
-        cur.execute("CREATE INDEX IF NOT EXISTS idx_applications_status ON applications(status)")
-        
-        conn.commit()
-        cur.close()
-        conn.close()
-        print("✓ Database tables initialized successfully")
+        conn = migrate.connect()
     except Exception as e:
-        print(f"✗ Database initialization failed: {e}")
+        logger.error("Schema version check failed: %s", e)
+        return
+    try:
+        current = migrate.current_version(conn)
+        if current < expected:
+            if not AUTO_MIGRATE:
+                raise RuntimeError(
+                    f"Database schema is at version {current} but this build needs {expected}; "
+                    "run `python migrate.py` (or set AUTO_MIGRATE=true)"
+                )
+            applied = migrate.migrate(conn)
+            logger.info("Applied %d migration(s)", len(applied))
+    finally:
+        conn.close()
+    logger.info("Database schema at version %d", max(current, expected))
+    schema_checked = True
 
-# Initialize database on startup
 @app.on_event("startup")
 async def startup_event():
-    init_database()
-
-class SignUpRequest(BaseModel):
-    username: str
-    email: str
-    password: str
-    category: str  # "Applicant" or "Passport Administrator"
-
-    @field_validator('email')
-    def _validate_email(cls, v: str):
-        import re
-        if not re.match(r'^[^@\s]+@[^@\s]+\.[^@\s]+$', v):
-            raise ValueError('Invalid email')
-        return v
-
-class LoginRequest(BaseModel):
-    email: str
-    password: str
-
-    @field_validator('email')
-    def _validate_email(cls, v: str):
-        import re
-        if not re.match(r'^[^@\s]+@[^@\s]+\.[^@\s]+$', v):
-            raise ValueError('Invalid email')
-        return v
-
-class ApplicationRequest(BaseModel):
-    username: str
-    name: str
-    father_name: str
-    date_of_birth: str
-    permanent_address: str
-    temporary_address: str
-    phone: str
-    email: str
-    pan: str
-    status: str = "pending"
-
-    @field_validator('email')
-    def _validate_email(cls, v: str):
-        import re
-        if not re.match(r'^[^@\s]+@[^@\s]+\.[^@\s]+$', v):
-            raise ValueError('Invalid email')
-        return v
+    if not schema_checked:
+        check_schema()
+    # Open min_size connections now so the first requests do not pay for them;
+    # if the database is down, readiness reports it instead of the worker crashing
+    try:
+        await run_in_threadpool(pool.open)
+    except Exception as e:
+        logger.error("Could not open database pool: %s", e)
+    if DB_MODE == "async":
+        await async_db.pool.open()
+    health_monitor.start()
+    cache_listener.start()
+    app.state.ready = True
+
+# Close pooled connections when the app stops
+@app.on_event("shutdown")
+async def shutdown_event():
+    # Fail readiness first so load balancers stop routing here while we drain
+    app.state.ready = False
+    health_monitor.stop()
+    cache_listener.stop()
+    changes.feed.stop()
+    pool.close()
+    replicas.router.close()
+    if DB_MODE == "async":
+        await async_db.pool.close()
+        await replicas.router.close_async()
+
+@app.exception_handler(PoolTimeout)
+async def pool_timeout_handler(request, exc):
+    return JSONResponse(status_code=503, content={"detail": str(exc)}, headers={"Retry-After": "1"})
+
+@app.exception_handler(CredentialServiceBusy)
+async def credential_busy_handler(request, exc):
+    return JSONResponse(status_code=503, content={"detail": str(exc)}, headers={"Retry-After": "1"})
 
 @app.get("/")
 def root():
@@ -162,147 +185,448 @@ def get_test_results():
         "timestamp": "2024-12-04 10:30:45"
     }
 
+async def _health_snapshot():
+    # The background probe keeps the snapshot fresh, so serving it needs no I/O
+    if health_monitor.running:
+        return health_monitor.current()
+    return await run_in_threadpool(health_monitor.current)
+
 @app.get("/api/health")
-def health_check():
-    try:
-        conn = get_db_connection()
-        cur = conn.cursor()
-        
-        # Test database connection
-        cur.execute("SELECT 1")
-        cur.fetchone()
-        
-        # Check if tables exist
-        cur.execute("""
-            SELECT table_name 
-            FROM information_schema.tables 
-            WHERE table_schema = 'public' AND table_name IN ('users', 'applications')
-        """)
-        tables = [row['table_name'] for row in cur.fetchall()]
-        
-        cur.close()
-        conn.close()
-        
-        return {
-            "status": "healthy",
-            "database": "connected",
-            "tables": tables,
-            "message": "Database connection successful" if len(tables) == 2 else "Please run setup_database.sql"
-        }
-    except Exception as e:
-        return {
-            "status": "unhealthy",
-            "database": "disconnected",
-            "error": str(e),
-            "message": "Database connection failed"
-        }
-
-@app.post("/api/signup")
-def signup(data: SignUpRequest):
-    conn = get_db_connection()
-    cur = conn.cursor()
+async def health_check():
+    return await _health_snapshot()
+
+# Liveness: the process is up and serving; no I/O so it stays cheap under any load
+@app.get("/api/health/live")
+async def liveness():
+    return {"status": "alive"}
+
+# Readiness: startup finished and the last probe reached the database; 503
+# tells the load balancer to route elsewhere (during boot, shutdown, a
+# database outage, or when the probe has stopped reporting). A degraded
+# instance (pool exhausted) stays ready so load is not piled onto the others.
+@app.get("/api/health/ready")
+async def readiness():
+    if not app.state.ready:
+        return JSONResponse(status_code=503, content={"status": "starting"})
+    snapshot = await _health_snapshot()
+    if snapshot["status"] == "unhealthy":
+        return JSONResponse(status_code=503, content={"status": "unavailable", "health": snapshot})
+    return {"status": "ready", "health": snapshot}
+
+@app.get("/api/db/pool")
+def get_pool_stats():
+    if DB_MODE == "async":
+        return async_db.pool.stats()
+    return pool.stats()
+
+@app.get("/metrics")
+def get_metrics():
+    return Response(content=metrics.registry.render(), media_type=metrics.CONTENT_TYPE)
+
+def _username_taken(username):
+    with pool.connection() as conn, conn.cursor() as cur:
+        cur.execute("SELECT 1 FROM users WHERE username = %s", (username,))
+        return cur.fetchone() is not None
+
+def _create_user(data, password_hash):
+    with pool.connection() as conn, conn.cursor() as cur:
+        try:
+            cur.execute(
+                "INSERT INTO users (username, email, password, category) VALUES (%s, %s, %s, %s)",
+                (data.username, data.email, password_hash, data.category)
+            )
+            conn.commit()
+        except psycopg2.errors.UniqueViolation:
+            conn.rollback()
+            raise HTTPException(status_code=400, detail="Username already exists")
+
+# Signup and login are async so that, while a password is hashed on the
+# credential pool, no request thread is held; SQL still runs on the threadpool
+@router.post("/api/signup")
+async def signup(data: SignUpRequest):
     try:
-        # Check if user exists
-        cur.execute("SELECT * FROM users WHERE username = %s", (data.username,))
-        if cur.fetchone():
+        # Check if user exists (before spending a hash on it)
+        if await run_in_threadpool(_username_taken, data.username):
             raise HTTPException(status_code=400, detail="Username already exists")
-        
-        # Insert new user
-        cur.execute(
-            "INSERT INTO users (username, email, password, category) VALUES (%s, %s, %s, %s)",
-            (data.username, data.email, data.password, data.category)
-        )
-        conn.commit()
+
+        password_hash = await credentials.hash_password(data.password)
+        await run_in_threadpool(_create_user, data, password_hash)
         return {"message": "User created successfully", "category": data.category}
-    except HTTPException:
+    except (HTTPException, CredentialServiceBusy, PoolTimeout):
         raise
     except Exception as e:
-        conn.rollback()
+        logger.exception("Signup failed", extra={"fields": {"username": data.username}})
         raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        cur.close()
-        conn.close()
 
-@app.post("/api/login")
-def login(data: LoginRequest):
-    conn = get_db_connection()
-    cur = conn.cursor()
+def _users_by_email(email):
+    with pool.connection() as conn, conn.cursor() as cur:
+        cur.execute("SELECT id, username, category, password FROM users WHERE email = %s ORDER BY id", (email,))
+        return cur.fetchall()
+
+def _replace_password_hash(user_id, old_value, new_hash):
+    # Only if unchanged since we read it, so a concurrent password change wins
+    with pool.connection() as conn, conn.cursor() as cur:
+        cur.execute("UPDATE users SET password = %s WHERE id = %s AND password = %s", (new_hash, user_id, old_value))
+        conn.commit()
+
+@router.post("/api/login")
+async def login(data: LoginRequest):
     try:
-        cur.execute(
-            "SELECT * FROM users WHERE email = %s AND password = %s",
-            (data.email, data.password)
-        )
-        user = cur.fetchone()
-        
-        if not user:
+        users = await run_in_threadpool(_users_by_email, data.email)
+        if not users:
+            await credentials.verify_nothing(data.password)
             raise HTTPException(status_code=401, detail="Invalid credentials")
-        
-        return {"message": "Login successful", "category": user["category"], "username": user["username"]}
-    except HTTPException:
+
+        for user in users:
+            matches, new_hash = await credentials.verify_password(user["password"], data.password)
+            if matches:
+                if new_hash:
+                    await run_in_threadpool(_replace_password_hash, user["id"], user["password"], new_hash)
+                return {
+                    "message": "Login successful",
+                    "category": user["category"],
+                    "username": user["username"],
+                    "token": tokens.issue(user["username"], user["category"]),
+                }
+        raise HTTPException(status_code=401, detail="Invalid credentials")
+    except (HTTPException, CredentialServiceBusy, PoolTimeout):
         raise
     except Exception as e:
+        logger.exception("Login failed")
         raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        cur.close()
-        conn.close()
 
-@app.post("/api/applications")
+@app.post("/api/logout")
+def logout(session: dict = Depends(require_user)):
+    tokens.revoke(session)
+    return {"message": "Logged out"}
+
+@router.post("/api/applications")
 def submit_application(data: ApplicationRequest):
-    conn = get_db_connection()
-    cur = conn.cursor()
+    with pool.connection() as conn, conn.cursor() as cur:
+        try:
+            if DUPLICATE_POLICY == "reject":
+                cur.execute(*build_duplicate_lock_query(data))
+            cur.execute(*build_submit_query(data, DUPLICATE_POLICY == "reject"))
+            row = cur.fetchone()
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            logger.exception("Application submit failed", extra={"fields": {"username": data.username}})
+            raise HTTPException(status_code=500, detail=str(e))
+    duplicates = row.pop("duplicates")
+    if row["id"] is None:
+        raise HTTPException(status_code=409, detail={"message": "Possible duplicate application", "duplicates": duplicates})
+    response_cache.invalidate()
+    return {"message": "Application submitted successfully", "application": dict(row), "duplicates": duplicates}
+
+@router.get("/api/applications")
+def get_applications(
+    request: Request,
+    session: dict = Depends(require_user),
+    status: Optional[str] = None,
+    username: Optional[str] = None,
+    cursor: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    fields: Optional[str] = None,
+    include_archived: bool = False,
+):
+    if not is_admin(session):
+        # Applicants only list their own applications, whatever ?username= says
+        username = session["sub"]
     try:
-        print(f"Received application data: {data}")
-        cur.execute(
-            "INSERT INTO applications (username, name, father_name, date_of_birth, permanent_address, temporary_address, phone, email, pan, status) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s) RETURNING *",
-            (data.username, data.name, data.father_name, data.date_of_birth, data.permanent_address, data.temporary_address, data.phone, data.email, data.pan, data.status)
-        )
-        application = cur.fetchone()
-        conn.commit()
-        return {"message": "Application submitted successfully", "application": dict(application)}
-    except Exception as e:
-        conn.rollback()
-        print(f"Error submitting application: {e}")
-        print(f"Error type: {type(e)}")
-        import traceback
-        traceback.print_exc()
-        raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        cur.close()
-        conn.close()
+        columns = parse_fields(fields)
+        sql, params = build_list_query(status, username, cursor, limit, columns, include_archived)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    key = list_key(status, username, cursor, limit, columns, include_archived)
+    cached, generation = response_cache.get(key)
+    if cached and not replicas.router.pinned(session["sub"]):
+        return cached.to_response(request)
 
-@app.get("/api/applications")
-def get_applications():
-    conn = get_db_connection()
-    cur = conn.cursor()
+    with replicas.router.connection(session["sub"]) as conn, conn.cursor() as cur:
+        try:
+            # Postgres returns the page already serialized; pass the bytes straight through
+            cur.execute(sql, params)
+            page = cur.fetchone()
+        except Exception as e:
+            logger.exception("Application list failed")
+            raise HTTPException(status_code=500, detail=str(e))
+    next_page = next_cursor(page)
+    entry = response_cache.put(key, generation, page["body"], {"X-Next-Cursor": next_page} if next_page else None)
+    return entry.to_response(request)
+
+@router.get("/api/applications/{app_id}")
+def get_application(request: Request, app_id: int, fields: Optional[str] = None, include_archived: bool = False,
+                    session: dict = Depends(require_user)):
     try:
-        cur.execute("SELECT * FROM applications ORDER BY created_at DESC")
-        applications = cur.fetchall()
-        return [dict(app) for app in applications]
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        cur.close()
-        conn.close()
+        columns = parse_fields(fields)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    # Applicants only read their own applications; others are not found
+    owner = None if is_admin(session) else session["sub"]
+    key = item_key(app_id, columns, include_archived, owner)
+    cached, generation = response_cache.get(key)
+    if cached and not replicas.router.pinned(session["sub"]):
+        return cached.to_response(request)
+
+    sql, params = build_item_query(app_id, columns, include_archived, owner)
+    with replicas.router.connection(session["sub"]) as conn, conn.cursor() as cur:
+        try:
+            cur.execute(sql, params)
+            row = cur.fetchone()
+        except Exception as e:
+            logger.exception("Application read failed", extra={"fields": {"application_id": app_id}})
+            raise HTTPException(status_code=500, detail=str(e))
+    if not row:
+        raise HTTPException(status_code=404, detail="Application not found")
+    return response_cache.put(key, generation, row["body"]).to_response(request)
+
+@router.put("/api/applications/{app_id}")
+def update_application_status(app_id: int, status: str, session: dict = Depends(require_admin)):
+    with pool.connection() as conn, conn.cursor() as cur:
+        try:
+            cur.execute(
+                "UPDATE applications SET status = %s WHERE id = %s RETURNING " + RETURNING_COLUMNS,
+                (status, app_id)
+            )
+            application = cur.fetchone()
+            if not application:
+                raise HTTPException(status_code=404, detail="Application not found")
+            conn.commit()
+            response_cache.invalidate()
+            replicas.router.note_write(session["sub"], conn)
+            return {"message": "Application updated", "application": dict(application)}
+        except HTTPException:
+            raise
+        except Exception as e:
+            conn.rollback()
+            logger.exception("Application update failed", extra={"fields": {"application_id": app_id}})
+            raise HTTPException(status_code=500, detail=str(e))
 
-@app.put("/api/applications/{app_id}")
-def update_application_status(app_id: int, status: str):
-    conn = get_db_connection()
-    cur = conn.cursor()
+@app.get("/api/applications/stats")
+def get_application_stats(
+    request: Request,
+    session: dict = Depends(require_admin),
+    days: int = Query(30, ge=1, le=366),
+    hours: int = Query(48, ge=1, le=24 * 14),
+):
+    key = stats_key(days, hours)
+    cached, generation = response_cache.get(key)
+    if cached and not replicas.router.pinned(session["sub"]):
+        return cached.to_response(request)
+
+    sql, params = build_stats_query(days, hours)
+    with replicas.router.connection(session["sub"]) as conn, conn.cursor() as cur:
+        try:
+            cur.execute(sql, params)
+            row = cur.fetchone()
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=str(e))
+    return response_cache.put(key, generation, row["body"]).to_response(request)
+
+# Whether migration 0007 could build the trigram indexes; looked up on the first search
+_fuzzy_search = None
+
+def _fuzzy_search_available(cur):
+    global _fuzzy_search
+    if _fuzzy_search is None:
+        cur.execute("SELECT to_regclass('idx_applications_name_trgm') IS NOT NULL AS available")
+        _fuzzy_search = cur.fetchone()["available"]
+    return _fuzzy_search
+
+@app.get("/api/applications/search")
+def search_applications(
+    request: Request,
+    session: dict = Depends(require_admin),
+    q: str = Query(..., min_length=1, max_length=200),
+    status: Optional[str] = None,
+    offset: int = Query(0, ge=0),
+    limit: int = Query(DEFAULT_SEARCH_LIMIT, ge=1, le=MAX_SEARCH_LIMIT),
+    fields: Optional[str] = None,
+):
+    """Ranked search by name, father's name or address; exact lookup for a PAN or phone number."""
     try:
+        columns = parse_fields(fields)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    key = search_key(q, status, offset, limit, columns)
+    cached, generation = response_cache.get(key)
+    if cached and not replicas.router.pinned(session["sub"]):
+        return cached.to_response(request)
+
+    with replicas.router.connection(session["sub"]) as conn, conn.cursor() as cur:
+        try:
+            sql, params = build_search_query(q, status, offset, limit, columns, _fuzzy_search_available(cur))
+            cur.execute(sql, params)
+            row = cur.fetchone()
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=str(e))
+    return response_cache.put(key, generation, row["body"]).to_response(request)
+
+@app.get("/api/applications/duplicates")
+def get_duplicate_clusters(
+    session: dict = Depends(require_admin),
+    status: str = Query("open", pattern="^(open|confirmed|dismissed|resolved)$"),
+    after_id: int = 0,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+):
+    """Clusters of applications sharing a PAN or identity, oldest first; page with after_id."""
+    with replicas.router.connection(session["sub"]) as conn, conn.cursor() as cur:
+        cur.execute(
+            "SELECT id, match_type, application_ids, size, status, detected_at, updated_at FROM duplicate_clusters "
+            "WHERE status = %s AND id > %s ORDER BY id LIMIT %s",
+            (status, after_id, limit),
+        )
+        return [dict(row) for row in cur.fetchall()]
+
+@app.put("/api/applications/duplicates/{cluster_id}")
+def review_duplicate_cluster(cluster_id: int, status: str = Query(..., pattern="^(open|confirmed|dismissed)$"),
+                             session: dict = Depends(require_admin)):
+    with pool.connection() as conn, conn.cursor() as cur:
         cur.execute(
-            "UPDATE applications SET status = %s WHERE id = %s RETURNING *",
-            (status, app_id)
+            "UPDATE duplicate_clusters SET status = %s, updated_at = NOW() WHERE id = %s "
+            "RETURNING id, match_type, application_ids, size, status, detected_at, updated_at",
+            (status, cluster_id),
         )
-        application = cur.fetchone()
-        if not application:
-            raise HTTPException(status_code=404, detail="Application not found")
+        cluster = cur.fetchone()
         conn.commit()
-        return {"message": "Application updated", "application": dict(application)}
-    except HTTPException:
-        raise
-    except Exception as e:
-        conn.rollback()
-        raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        cur.close()
-        conn.close()
+        replicas.router.note_write(session["sub"], conn)
+    if not cluster:
+        raise HTTPException(status_code=404, detail="Duplicate cluster not found")
+    return {"message": "Cluster updated", "cluster": dict(cluster)}
+
+@app.post("/api/applications/bulk-status")
+def bulk_update_application_status(data: BulkStatusRequest, session: dict = Depends(require_admin)):
+    if data.updates is not None:
+        # Last entry wins when an id is listed twice
+        updates = list({u.id: u for u in data.updates}.values())
+        sql, params = build_bulk_status_query(updates)
+    else:
+        f = data.filter
+        sql, params = build_filter_status_query(data.status, f.ids, f.status, f.username)
+
+    with pool.connection() as conn, conn.cursor() as cur:
+        try:
+            cur.execute(sql, params)
+            rows = cur.fetchall()
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            raise HTTPException(status_code=500, detail=str(e))
+        if rows:
+            replicas.router.note_write(session["sub"], conn)
+    if rows:
+        response_cache.invalidate()
+
+    if data.updates is not None:
+        updated = [{"id": r["id"], "status": r["status"]} for r in rows if r["found"]]
+        not_found = [r["id"] for r in rows if not r["found"]]
+    else:
+        updated = [{"id": r["id"], "status": r["status"]} for r in rows]
+        matched = {r["id"] for r in rows}
+        not_found = [i for i in dict.fromkeys(data.filter.ids or []) if i not in matched]
+    return {"message": "Applications updated", "count": len(updated), "updated": updated, "not_found": not_found}
+
+@app.post("/api/applications/import")
+def import_applications(file: UploadFile, format: Optional[str] = None, batch_size: int = Query(bulk_import.DEFAULT_BATCH_SIZE, ge=1, le=50000),
+                        session: dict = Depends(require_admin)):
+    fmt = format or {"csv": "csv", "ndjson": "ndjson", "jsonl": "ndjson"}.get((file.filename or "").rsplit(".", 1)[-1].lower())
+    if fmt not in bulk_import.READERS:
+        raise HTTPException(status_code=400, detail="format must be csv or ndjson")
+
+    # UploadFile spools to disk past 1MB; wrapping it keeps reads streaming
+    stream = io.TextIOWrapper(file.file, encoding="utf-8-sig", newline="")
+    with pool.connection() as conn:
+        try:
+            report = bulk_import.import_applications(conn, bulk_import.READERS[fmt](stream), batch_size)
+        except UnicodeDecodeError:
+            raise HTTPException(status_code=400, detail="File must be UTF-8 encoded")
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=str(e))
+        finally:
+            stream.detach()
+        if report["imported"]:
+            replicas.router.note_write(session["sub"], conn)
+    if report["imported"]:
+        response_cache.invalidate()
+    return {"message": "Import finished", **report}
+
+@app.get("/api/applications/export", dependencies=[Depends(require_admin)])
+def export_applications(
+    format: str = Query("csv", pattern="^(csv|ndjson)$"),
+    gzip: bool = False,
+    status: Optional[str] = None,
+    username: Optional[str] = None,
+    created_from: Optional[datetime] = None,
+    created_to: Optional[datetime] = None,
+    include_archived: bool = False,
+):
+    sql, params = build_export_query(status, username, created_from, created_to, include_archived)
+    headers = {"Content-Disposition": f'attachment; filename="applications.{format}"'}
+    if gzip:
+        headers["Content-Encoding"] = "gzip"
+    # Started here, so database errors are still reported with an error status
+    body = export.Export(sql, params, format, compress=gzip)
+    return StreamingResponse(
+        body.chunks(),
+        media_type=export.MEDIA_TYPES[format],
+        headers=headers,
+        background=BackgroundTask(body.close),
+    )
+
+@app.get("/api/applications/changes", dependencies=[Depends(require_admin_stream)])
+async def stream_application_changes(request: Request, last_event_id: Optional[int] = None):
+    """Server-Sent Events stream of application inserts and status changes.
+
+    Reconnecting clients send Last-Event-ID (EventSource does this
+    automatically) and first receive what they missed. When that is more than
+    the replay limit, or the client falls too far behind, a "reset" event tells
+    it to reload the list instead.
+    """
+    resume_from = request.headers.get("last-event-id", last_event_id)
+    try:
+        resume_from = int(resume_from) if resume_from is not None else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Last-Event-ID must be an integer")
+    subscription = await run_in_threadpool(changes.feed.subscribe, asyncio.get_running_loop())
+
+    async def events():
+        try:
+            replayed_up_to = 0
+            if resume_from is not None:
+                missed = await run_in_threadpool(changes.replay, resume_from)
+                if len(missed) >= changes.REPLAY_LIMIT:
+                    yield changes.RESET_EVENT
+                    return
+                for event in missed:
+                    yield changes.format_event(*event)
+                if missed:
+                    replayed_up_to = missed[-1][0]
+            while not subscription.overflowed:
+                try:
+                    event = await asyncio.wait_for(subscription.queue.get(), 15)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+                    continue
+                # Live events can overlap with what was just replayed
+                if event[0] <= replayed_up_to:
+                    continue
+                replayed_up_to = 0
+                yield changes.format_event(*event)
+            yield changes.RESET_EVENT
+        finally:
+            changes.feed.unsubscribe(subscription)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+# The data endpoints are registered last so routes declared on `app` above take precedence
+app.include_router(async_api.router if DB_MODE == "async" else router)
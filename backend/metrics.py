@@ -0,0 +1,277 @@
+import logging
+import os
+import re
+import threading
+import time
+from contextvars import ContextVar
+from urllib.parse import parse_qs
+
+# Latency buckets in seconds, shared by the request, query and pool histograms
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Requests slower than this many milliseconds are logged with their SQL timings (0 disables)
+SLOW_REQUEST_MS = float(os.getenv("SLOW_REQUEST_MS", "0"))
+SLOW_LOG_SQL_CHARS = 200
+
+logger = logging.getLogger("passport.metrics")
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names, values, extra=""):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for values, total in sorted(self._values.items()):
+                lines.append(f"{self.name}{_labels(self.labels, values)} {total}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                # Per-bucket counts (not cumulative) plus +Inf, then the sum
+                series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+            counts = series[0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            else:
+                counts[-1] += 1
+            series[1] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            snapshot = sorted((values, list(counts), total) for values, (counts, total) in self._series.items())
+        for values, counts, total in snapshot:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = 'le="+Inf"' if bound == float("inf") else f'le="{bound}"'
+                lines.append(f"{self.name}_bucket{_labels(self.labels, values, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labels, values)} {total}")
+            lines.append(f"{self.name}_count{_labels(self.labels, values)} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._pools = {}
+
+    def counter(self, name, help, labels=()):
+        metric = Counter(name, help, labels)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        metric = Histogram(name, help, labels, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def register_pool(self, pool):
+        """Report ``pool.stats()`` under the pool's ``name`` as the ``engine`` label at every scrape."""
+        self._pools[pool.name] = pool
+
+    def _render_pools(self):
+        lines = []
+        stats = {engine: pool.stats() for engine, pool in self._pools.items()}
+        for key, name, kind, help in POOL_METRICS:
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {kind}")
+            for engine, values in sorted(stats.items()):
+                lines.append(f'{name}{{engine="{engine}"}} {values.get(key, 0)}')
+        return lines
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        lines.extend(self._render_pools())
+        return "\n".join(lines) + "\n"
+
+
+# (stats() key, metric name, type, help) for the connection pool figures
+POOL_METRICS = (
+    ("max_size", "db_pool_max_size", "gauge", "Maximum number of connections in the pool"),
+    ("size", "db_pool_size", "gauge", "Connections currently open"),
+    ("in_use", "db_pool_in_use", "gauge", "Connections currently borrowed"),
+    ("idle", "db_pool_idle", "gauge", "Connections idle in the pool"),
+    ("waiting", "db_pool_waiting", "gauge", "Callers currently waiting for a connection"),
+    ("waits", "db_pool_waits_total", "counter", "Acquires that had to wait"),
+    ("wait_time_seconds", "db_pool_wait_seconds_total", "counter", "Total time spent waiting for a connection"),
+    ("timeouts", "db_pool_timeouts_total", "counter", "Acquires that timed out"),
+    ("connections_created", "db_pool_connections_created_total", "counter", "Connections opened"),
+    ("connections_recycled", "db_pool_connections_recycled_total", "counter", "Connections closed and replaced"),
+    ("connect_errors", "db_pool_connect_errors_total", "counter", "Failed attempts to open a connection"),
+)
+
+registry = Registry()
+requests_total = registry.counter(
+    "http_requests_total", "HTTP requests by route template and status code", ("method", "route", "status"))
+request_duration = registry.histogram(
+    "http_request_duration_seconds", "HTTP request latency by route template", ("method", "route"))
+query_duration = registry.histogram(
+    "db_query_duration_seconds", "SQL statement execution time by route and statement type", ("route", "operation"))
+acquire_duration = registry.histogram(
+    "db_pool_acquire_duration_seconds", "Time to borrow a connection from the pool", ("engine",))
+
+
+class RequestTimings:
+    """Database timings collected while one request is being handled."""
+
+    __slots__ = ("scope", "queries", "db_seconds", "acquire_seconds")
+
+    def __init__(self, scope):
+        self.scope = scope
+        self.queries = []
+        self.db_seconds = 0.0
+        self.acquire_seconds = 0.0
+
+
+_current = ContextVar("request_timings", default=None)
+
+
+def route_template(scope):
+    # FastAPI stores the matched route in the scope; unmatched paths share one
+    # label so random URLs cannot grow the number of series
+    route = scope.get("route")
+    return getattr(route, "path", None) or "unmatched"
+
+
+def _statement_text(statement):
+    if isinstance(statement, bytes):
+        statement = statement.decode(errors="replace")
+    return str(statement)
+
+
+_OPERATION = re.compile(r"\s*(\w+)")
+_WRITE = re.compile(r"\b(INSERT|UPDATE|DELETE)\b", re.IGNORECASE)
+
+
+def _operation(text):
+    match = _OPERATION.match(text)
+    if not match:
+        return "UNKNOWN"
+    operation = match.group(1).upper()
+    if operation == "WITH":
+        # Statements built from CTEs are named after the write they make, if any
+        write = _WRITE.search(text)
+        return write.group(1).upper() if write else "SELECT"
+    return operation
+
+
+def record_query(statement, seconds):
+    timings = _current.get()
+    text = _statement_text(statement)
+    route = route_template(timings.scope) if timings else "none"
+    query_duration.observe(seconds, route, _operation(text))
+    if timings is not None:
+        timings.db_seconds += seconds
+        # Statement texts are only kept when they may be needed for the slow log
+        timings.queries.append((text if SLOW_REQUEST_MS > 0 else None, seconds))
+
+
+def record_acquire(engine, seconds):
+    acquire_duration.observe(seconds, engine)
+    timings = _current.get()
+    if timings is not None:
+        timings.acquire_seconds += seconds
+
+
+def _query_params(scope):
+    params = parse_qs(scope.get("query_string", b"").decode(errors="replace"), keep_blank_values=True)
+    return {name: values[0] if len(values) == 1 else values for name, values in params.items()}
+
+
+def _log_slow_request(scope, status, seconds, timings):
+    logger.warning(
+        "Slow request: %s %s -> %s in %.1fms", scope["method"], route_template(scope), status, seconds * 1000,
+        extra={"fields": {
+            "route": route_template(scope),
+            "status": status,
+            "duration_ms": round(seconds * 1000, 1),
+            "db_ms": round(timings.db_seconds * 1000, 1),
+            "pool_acquire_ms": round(timings.acquire_seconds * 1000, 1),
+            "path_params": scope.get("path_params", {}),
+            # A dict, so the log formatter masks ?token= (the SSE feed) and search terms like other fields
+            "query": _query_params(scope),
+            "sql": [
+                {"ms": round(query_seconds * 1000, 1), "statement": " ".join(text.split())[:SLOW_LOG_SQL_CHARS]}
+                for text, query_seconds in timings.queries if text is not None
+            ],
+        }},
+    )
+
+
+class MetricsMiddleware:
+    """ASGI middleware counting requests and timing them per route template.
+
+    Written as plain ASGI rather than BaseHTTPMiddleware so streamed responses
+    (exports, the SSE change feed) pass through untouched; their duration is
+    the time until the stream ends.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        timings = RequestTimings(scope)
+        token = _current.set(timings)
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            seconds = time.perf_counter() - start
+            _current.reset(token)
+            route = route_template(scope)
+            requests_total.inc(scope["method"], route, str(status))
+            request_duration.observe(seconds, scope["method"], route)
+            if SLOW_REQUEST_MS > 0 and seconds * 1000 >= SLOW_REQUEST_MS:
+                _log_slow_request(scope, status, seconds, timings)
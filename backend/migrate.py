@@ -0,0 +1,247 @@
+"""Apply the versioned SQL files in migrations/ to DATABASE_URL.
+
+    python migrate.py            # apply pending migrations
+    python migrate.py --status   # list applied and pending versions
+    python migrate.py --check    # exit 1 if migrations are pending
+
+Files are named ``NNNN_description.sql`` and applied in version order, each
+recorded in ``schema_migrations``. A file runs in a single transaction unless
+its first line is ``-- migrate: no-transaction``; such files run statement by
+statement in autocommit mode so they can use CREATE/DROP INDEX CONCURRENTLY,
+and must be safe to re-run (IF [NOT] EXISTS) in case they are interrupted. In
+those files a ``-- migrate: if-extension NAME`` line makes the next statement
+run only when that extension is installed.
+"""
+import argparse
+import hashlib
+import os
+import re
+import sys
+import time
+
+import psycopg2
+from psycopg2 import errors
+from dotenv import load_dotenv
+
+load_dotenv()
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "migrations")
+NO_TRANSACTION = "-- migrate: no-transaction"
+# pg_advisory_lock key held while migrating, so concurrent deploys apply each file once
+LOCK_KEY = 72438110
+# Transactional migrations give up instead of queueing behind long-running
+# transactions, which would block every other query on the table meanwhile
+LOCK_TIMEOUT = os.getenv("MIGRATION_LOCK_TIMEOUT", "5s")
+
+_IF_EXTENSION = re.compile(r"^--\s*migrate:\s*if-extension\s+(\w+)\s*$")
+_FILENAME = re.compile(r"^(\d{4})_(\w+)\.sql$")
+_CONCURRENT_INDEX = re.compile(
+    r"CREATE\s+(?:UNIQUE\s+)?INDEX\s+CONCURRENTLY\s+IF\s+NOT\s+EXISTS\s+(\w+)", re.IGNORECASE)
+
+VERSION_TABLE_SQL = """
+    CREATE TABLE IF NOT EXISTS schema_migrations (
+        version INTEGER PRIMARY KEY,
+        name VARCHAR(255) NOT NULL,
+        checksum VARCHAR(64) NOT NULL,
+        applied_at TIMESTAMP DEFAULT NOW(),
+        duration_ms INTEGER
+    )
+"""
+
+
+class Migration:
+    def __init__(self, version, name, path):
+        self.version = version
+        self.name = name
+        self.path = path
+        with open(path, encoding="utf-8") as f:
+            self.sql = f.read()
+        self.checksum = hashlib.sha256(self.sql.encode()).hexdigest()
+        self.transactional = not self.sql.lstrip().startswith(NO_TRANSACTION)
+
+    def statements(self):
+        """Split a no-transaction file into (statement, required extension or None) pairs.
+
+        Statements may not contain $$ bodies.
+        """
+        lines = []
+        for line in self.sql.splitlines():
+            condition = _IF_EXTENSION.match(line.strip())
+            if condition:
+                lines.append(f"@requires {condition.group(1)}")
+            elif not line.strip().startswith("--"):
+                lines.append(line)
+        statements = []
+        for chunk in "\n".join(lines).split(";"):
+            chunk_lines = chunk.strip().splitlines()
+            requires = None
+            while chunk_lines and chunk_lines[0].startswith("@requires "):
+                requires = chunk_lines.pop(0).split()[1]
+            statement = "\n".join(chunk_lines).strip()
+            if statement:
+                statements.append((statement, requires))
+        return statements
+
+    def __repr__(self):
+        return f"{self.version:04d}_{self.name}"
+
+
+def discover(directory=MIGRATIONS_DIR):
+    """Return the migrations in ``directory`` sorted by version."""
+    migrations = {}
+    for filename in sorted(os.listdir(directory)):
+        match = _FILENAME.match(filename)
+        if not match:
+            continue
+        version = int(match.group(1))
+        if version in migrations:
+            raise ValueError(f"Duplicate migration version {version:04d}: {filename}")
+        migrations[version] = Migration(version, match.group(2), os.path.join(directory, filename))
+    return [migrations[v] for v in sorted(migrations)]
+
+
+def latest_version(directory=MIGRATIONS_DIR):
+    """Highest version shipped with the code, read from the file names only."""
+    versions = [int(m.group(1)) for m in map(_FILENAME.match, os.listdir(directory)) if m]
+    return max(versions, default=0)
+
+
+def current_version(conn):
+    """Version the database is at (0 if it has never been migrated). One query."""
+    with conn.cursor() as cur:
+        try:
+            cur.execute("SELECT COALESCE(max(version), 0) AS version FROM schema_migrations")
+            row = cur.fetchone()
+        except errors.UndefinedTable:
+            conn.rollback()
+            return 0
+    conn.rollback()
+    return row["version"] if isinstance(row, dict) else row[0]
+
+
+def connect(dsn=None):
+    conn = psycopg2.connect(dsn or os.getenv("DATABASE_URL"))
+    conn.autocommit = True
+    return conn
+
+
+def _applied(cur):
+    cur.execute("SELECT version, checksum FROM schema_migrations")
+    return dict(cur.fetchall())
+
+
+def _drop_invalid_indexes(cur, migration):
+    # An interrupted CREATE INDEX CONCURRENTLY leaves an INVALID index behind,
+    # which IF NOT EXISTS would otherwise keep forever
+    names = _CONCURRENT_INDEX.findall(migration.sql)
+    if not names:
+        return
+    cur.execute("""
+        SELECT c.relname FROM pg_index i
+        JOIN pg_class c ON c.oid = i.indexrelid
+        WHERE NOT i.indisvalid AND c.relname = ANY(%s) AND pg_table_is_visible(c.oid)
+    """, (names,))
+    for (name,) in cur.fetchall():
+        print(f"  dropping invalid index {name} left by an interrupted build")
+        cur.execute(f'DROP INDEX CONCURRENTLY IF EXISTS "{name}"')
+
+
+def _apply(cur, migration):
+    start = time.monotonic()
+    if migration.transactional:
+        cur.execute("BEGIN")
+        try:
+            cur.execute("SET LOCAL lock_timeout = %s", (LOCK_TIMEOUT,))
+            cur.execute(migration.sql)
+            cur.execute(
+                "INSERT INTO schema_migrations (version, name, checksum, duration_ms) VALUES (%s, %s, %s, %s)",
+                (migration.version, migration.name, migration.checksum, int((time.monotonic() - start) * 1000)),
+            )
+            cur.execute("COMMIT")
+        except Exception:
+            cur.execute("ROLLBACK")
+            raise
+    else:
+        _drop_invalid_indexes(cur, migration)
+        for statement, requires in migration.statements():
+            if requires:
+                cur.execute("SELECT 1 FROM pg_extension WHERE extname = %s", (requires,))
+                if cur.fetchone() is None:
+                    print(f"  skipping a statement that needs the {requires} extension, which is not installed")
+                    continue
+            cur.execute(statement)
+        cur.execute(
+            "INSERT INTO schema_migrations (version, name, checksum, duration_ms) VALUES (%s, %s, %s, %s)",
+            (migration.version, migration.name, migration.checksum, int((time.monotonic() - start) * 1000)),
+        )
+
+
+def migrate(conn, migrations=None):
+    """Apply every pending migration on an autocommit connection; return those applied."""
+    migrations = discover() if migrations is None else migrations
+    applied_now = []
+    with conn.cursor() as cur:
+        cur.execute("SELECT pg_advisory_lock(%s)", (LOCK_KEY,))
+        try:
+            cur.execute(VERSION_TABLE_SQL)
+            applied = _applied(cur)
+            for migration in migrations:
+                if migration.version in applied:
+                    if applied[migration.version] != migration.checksum:
+                        print(f"⚠ {migration} was modified after it was applied; add a new migration instead")
+                    continue
+                print(f"Applying {migration}...")
+                _apply(cur, migration)
+                applied_now.append(migration)
+        finally:
+            cur.execute("SELECT pg_advisory_unlock(%s)", (LOCK_KEY,))
+    return applied_now
+
+
+def status(conn, migrations=None):
+    """Return [(migration, applied_at or None)] for every known migration."""
+    migrations = discover() if migrations is None else migrations
+    with conn.cursor() as cur:
+        cur.execute(VERSION_TABLE_SQL)
+        cur.execute("SELECT version, applied_at FROM schema_migrations")
+        applied = dict(cur.fetchall())
+    return [(m, applied.get(m.version)) for m in migrations]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Apply versioned schema migrations")
+    parser.add_argument("--status", action="store_true", help="list applied and pending migrations")
+    parser.add_argument("--check", action="store_true", help="exit with status 1 if migrations are pending")
+    args = parser.parse_args()
+
+    try:
+        conn = connect()
+    except Exception as e:
+        print(f"✗ Could not connect to the database: {e}")
+        return 1
+
+    try:
+        if args.status or args.check:
+            rows = status(conn)
+            for migration, applied_at in rows:
+                print(f"  {'✓' if applied_at else ' '} {migration}" + (f"  ({applied_at:%Y-%m-%d %H:%M})" if applied_at else ""))
+            pending = [m for m, applied_at in rows if applied_at is None]
+            if args.check and pending:
+                print(f"✗ {len(pending)} pending migration(s)")
+                return 1
+            return 0
+
+        applied = migrate(conn)
+        print(f"✓ Database at version {current_version(conn)} ({len(applied)} migration(s) applied)")
+        return 0
+    except Exception as e:
+        print(f"✗ Migration failed: {e}")
+        import traceback
+        traceback.print_exc()
+        return 1
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
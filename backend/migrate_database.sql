@@ -1,22 +0,0 @@
--- Drop the old applications table
-DROP TABLE IF EXISTS applications;
-
--- Create new applications table with updated fields
-CREATE TABLE applications (
-    id SERIAL PRIMARY KEY,
-    username VARCHAR(255) NOT NULL,
-    name VARCHAR(255) NOT NULL,
-    father_name VARCHAR(255) NOT NULL,
-    date_of_birth DATE NOT NULL,
-    permanent_address TEXT NOT NULL,
-    temporary_address TEXT NOT NULL,
-    phone VARCHAR(50) NOT NULL,
-    email VARCHAR(255) NOT NULL,
-    pan VARCHAR(10) NOT NULL,
-    status VARCHAR(50) DEFAULT 'pending',
-    created_at TIMESTAMP DEFAULT NOW()
-);
-
--- Create indexes for better performance
-CREATE INDEX IF NOT EXISTS idx_applications_username ON applications(username);
-CREATE INDEX IF NOT EXISTS idx_applications_status ON applications(status);
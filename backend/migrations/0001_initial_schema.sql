@@ -1,6 +1,5 @@
--- Run this SQL in your Supabase SQL Editor
-
--- Create users table
+-- Tables as originally created at startup by init_database(). IF NOT EXISTS
+-- lets databases created before the migration runner adopt this version as is.
 CREATE TABLE IF NOT EXISTS users (
     id SERIAL PRIMARY KEY,
     username VARCHAR(255) UNIQUE NOT NULL,
@@ -10,7 +9,6 @@ CREATE TABLE IF NOT EXISTS users (
     created_at TIMESTAMP DEFAULT NOW()
 );
 
--- Create applications table
 CREATE TABLE IF NOT EXISTS applications (
     id SERIAL PRIMARY KEY,
     username VARCHAR(255) NOT NULL,
@@ -26,7 +24,6 @@ CREATE TABLE IF NOT EXISTS applications (
     created_at TIMESTAMP DEFAULT NOW()
 );
 
--- Create indexes for better performance
 CREATE INDEX IF NOT EXISTS idx_users_username ON users(username);
 CREATE INDEX IF NOT EXISTS idx_applications_username ON applications(username);
 CREATE INDEX IF NOT EXISTS idx_applications_status ON applications(status);
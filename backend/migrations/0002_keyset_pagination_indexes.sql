@@ -0,0 +1,4 @@
+-- migrate: no-transaction
+-- Keyset pagination indexes: filter column first, then the (created_at, id) sort key
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_applications_created_id ON applications(created_at DESC, id DESC);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_applications_status_created_id ON applications(status, created_at DESC, id DESC);
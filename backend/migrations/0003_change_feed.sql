@@ -0,0 +1,46 @@
+-- Change log + statement-level triggers feeding the live dashboard stream.
+-- One NOTIFY per statement, so bulk updates and imports wake listeners once.
+CREATE TABLE IF NOT EXISTS application_changes (
+    id BIGSERIAL PRIMARY KEY,
+    application_id INTEGER NOT NULL,
+    op VARCHAR(10) NOT NULL,
+    status VARCHAR(50),
+    changed_at TIMESTAMP DEFAULT NOW()
+);
+
+CREATE INDEX IF NOT EXISTS idx_application_changes_changed_at ON application_changes(changed_at);
+
+CREATE OR REPLACE FUNCTION record_application_inserts() RETURNS trigger AS $$
+BEGIN
+    INSERT INTO application_changes (application_id, op, status)
+    SELECT id, 'insert', status FROM new_rows ORDER BY id;
+    IF FOUND THEN
+        PERFORM pg_notify('application_changes', '');
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION record_application_updates() RETURNS trigger AS $$
+BEGIN
+    INSERT INTO application_changes (application_id, op, status)
+    SELECT n.id, 'update', n.status
+    FROM new_rows n JOIN old_rows o ON o.id = n.id
+    WHERE n.status IS DISTINCT FROM o.status
+    ORDER BY n.id;
+    IF FOUND THEN
+        PERFORM pg_notify('application_changes', '');
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS applications_changes_insert ON applications;
+CREATE TRIGGER applications_changes_insert AFTER INSERT ON applications
+REFERENCING NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE FUNCTION record_application_inserts();
+
+DROP TRIGGER IF EXISTS applications_changes_update ON applications;
+CREATE TRIGGER applications_changes_update AFTER UPDATE ON applications
+REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE FUNCTION record_application_updates();
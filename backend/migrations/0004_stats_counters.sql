@@ -0,0 +1,74 @@
+-- Summary counters for /api/applications/stats, kept current by statement-level triggers
+CREATE TABLE IF NOT EXISTS application_status_counts (
+    status VARCHAR(50) PRIMARY KEY,
+    total BIGINT NOT NULL DEFAULT 0
+);
+
+CREATE TABLE IF NOT EXISTS application_hourly_submissions (
+    hour TIMESTAMP PRIMARY KEY,
+    total BIGINT NOT NULL DEFAULT 0
+);
+
+CREATE OR REPLACE FUNCTION count_application_inserts() RETURNS trigger AS $$
+BEGIN
+    INSERT INTO application_status_counts AS c (status, total)
+    SELECT status, count(*) FROM new_rows WHERE status IS NOT NULL GROUP BY status
+    ON CONFLICT (status) DO UPDATE SET total = c.total + EXCLUDED.total;
+    INSERT INTO application_hourly_submissions AS h (hour, total)
+    SELECT date_trunc('hour', created_at), count(*) FROM new_rows WHERE created_at IS NOT NULL GROUP BY 1
+    ON CONFLICT (hour) DO UPDATE SET total = h.total + EXCLUDED.total;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION count_application_updates() RETURNS trigger AS $$
+BEGIN
+    INSERT INTO application_status_counts AS c (status, total)
+    SELECT status, sum(delta) FROM (
+        SELECT n.status, 1 AS delta FROM new_rows n JOIN old_rows o ON o.id = n.id
+        WHERE n.status IS DISTINCT FROM o.status AND n.status IS NOT NULL
+        UNION ALL
+        SELECT o.status, -1 FROM new_rows n JOIN old_rows o ON o.id = n.id
+        WHERE n.status IS DISTINCT FROM o.status AND o.status IS NOT NULL
+    ) changes
+    GROUP BY status
+    ON CONFLICT (status) DO UPDATE SET total = c.total + EXCLUDED.total;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION count_application_deletes() RETURNS trigger AS $$
+BEGIN
+    UPDATE application_status_counts c SET total = c.total - d.removed
+    FROM (SELECT status, count(*) AS removed FROM old_rows WHERE status IS NOT NULL GROUP BY status) d
+    WHERE c.status = d.status;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS applications_counts_insert ON applications;
+CREATE TRIGGER applications_counts_insert AFTER INSERT ON applications
+REFERENCING NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE FUNCTION count_application_inserts();
+
+DROP TRIGGER IF EXISTS applications_counts_update ON applications;
+CREATE TRIGGER applications_counts_update AFTER UPDATE ON applications
+REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE FUNCTION count_application_updates();
+
+DROP TRIGGER IF EXISTS applications_counts_delete ON applications;
+CREATE TRIGGER applications_counts_delete AFTER DELETE ON applications
+REFERENCING OLD TABLE AS old_rows
+FOR EACH STATEMENT EXECUTE FUNCTION count_application_deletes();
+
+-- Backfill once, in the same transaction that installs the triggers
+DO $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM application_status_counts) THEN
+        INSERT INTO application_status_counts (status, total)
+        SELECT status, count(*) FROM applications WHERE status IS NOT NULL GROUP BY status;
+        INSERT INTO application_hourly_submissions (hour, total)
+        SELECT date_trunc('hour', created_at), count(*) FROM applications WHERE created_at IS NOT NULL GROUP BY 1;
+    END IF;
+END
+$$;
@@ -0,0 +1,9 @@
+-- migrate: no-transaction
+-- login looks users up by email
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_users_email ON users(email);
+-- Keyset pages of one applicant's applications
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_applications_username_created_id ON applications(username, created_at DESC, id DESC);
+-- Covered by the composite indexes above and by the users.username UNIQUE constraint
+DROP INDEX CONCURRENTLY IF EXISTS idx_applications_username;
+DROP INDEX CONCURRENTLY IF EXISTS idx_applications_status;
+DROP INDEX CONCURRENTLY IF EXISTS idx_users_username;
@@ -0,0 +1,33 @@
+-- Full-text document for GET /api/applications/search: the name weighs most,
+-- then the father's name, then the addresses. The 'simple' configuration
+-- keeps words as written (no English stemming), which suits names and places.
+-- It is indexed as an expression (0007) rather than stored in a column, which
+-- would rewrite the whole table under an exclusive lock; queries must call
+-- the function with the same arguments for the index to apply.
+CREATE OR REPLACE FUNCTION application_search_vector(
+    name TEXT, father_name TEXT, permanent_address TEXT, temporary_address TEXT
+) RETURNS tsvector AS $$
+    SELECT setweight(to_tsvector('simple', name), 'A') ||
+           setweight(to_tsvector('simple', father_name), 'B') ||
+           setweight(to_tsvector('simple', permanent_address || ' ' || temporary_address), 'C')
+$$ LANGUAGE sql IMMUTABLE PARALLEL SAFE;
+
+-- PANs are stored as submitted; exact PAN lookups compare them upper-cased
+-- and without spaces or punctuation, also through an expression index (0007)
+CREATE OR REPLACE FUNCTION normalize_pan(pan TEXT) RETURNS TEXT AS $$
+    SELECT upper(regexp_replace(pan, '[^[:alnum:]]', '', 'g'))
+$$ LANGUAGE sql IMMUTABLE PARALLEL SAFE;
+
+-- Typo-tolerant name search needs pg_trgm. Where it is not installed and
+-- cannot be, search still works with full-text and exact lookups only.
+DO $$
+BEGIN
+    IF EXISTS (SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm') THEN
+        CREATE EXTENSION IF NOT EXISTS pg_trgm;
+    ELSE
+        RAISE NOTICE 'pg_trgm is not available; fuzzy name search is disabled';
+    END IF;
+EXCEPTION WHEN insufficient_privilege THEN
+    RAISE NOTICE 'Not allowed to create pg_trgm; fuzzy name search is disabled';
+END
+$$;
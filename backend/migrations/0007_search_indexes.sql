@@ -0,0 +1,13 @@
+-- migrate: no-transaction
+-- Full-text matches
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_applications_search ON applications
+    USING GIN (application_search_vector(name, father_name, permanent_address, temporary_address));
+-- Exact lookups by PAN and phone number. PANs are only compared normalized
+-- and for equality, where a hash index is smaller than a btree.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_applications_pan_key ON applications USING HASH (normalize_pan(pan));
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_applications_phone ON applications(phone);
+-- Fuzzy name matches; skipped when 0006 could not install pg_trgm
+-- migrate: if-extension pg_trgm
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_applications_name_trgm ON applications USING GIN (name gin_trgm_ops);
+-- migrate: if-extension pg_trgm
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_applications_father_name_trgm ON applications USING GIN (father_name gin_trgm_ops);
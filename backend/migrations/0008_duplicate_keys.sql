@@ -0,0 +1,27 @@
+-- Normalized keys for duplicate detection. Two applications are duplicates
+-- when their PAN matches, or their name, father's name and date of birth do,
+-- ignoring case, spacing and punctuation. The PAN key is normalize_pan()
+-- from 0006. The keys are indexed as expressions (0007, 0009) rather than
+-- stored in columns, which would rewrite the whole table under an exclusive
+-- lock.
+CREATE OR REPLACE FUNCTION normalize_identity(name TEXT, father_name TEXT) RETURNS TEXT AS $$
+    SELECT lower(trim(regexp_replace(name, '[^[:alnum:]]+', ' ', 'g')))
+        || '|' || lower(trim(regexp_replace(father_name, '[^[:alnum:]]+', ' ', 'g')))
+$$ LANGUAGE sql IMMUTABLE PARALLEL SAFE;
+
+-- Review queue: one row per group of applications sharing a key, written by
+-- dedupe.py and by submissions flagged at insert time
+CREATE TABLE IF NOT EXISTS duplicate_clusters (
+    id BIGSERIAL PRIMARY KEY,
+    match_type VARCHAR(10) NOT NULL,
+    match_key TEXT NOT NULL,
+    application_ids INTEGER[] NOT NULL,
+    size INTEGER NOT NULL,
+    -- open, confirmed (fraud or a real duplicate) or dismissed; resolved once no longer shared
+    status VARCHAR(20) NOT NULL DEFAULT 'open',
+    detected_at TIMESTAMP DEFAULT NOW(),
+    updated_at TIMESTAMP DEFAULT NOW(),
+    UNIQUE (match_type, match_key)
+);
+
+CREATE INDEX IF NOT EXISTS idx_duplicate_clusters_status ON duplicate_clusters(status, id);
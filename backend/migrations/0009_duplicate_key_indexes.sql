@@ -0,0 +1,3 @@
+-- migrate: no-transaction
+-- Identity lookups at insert time; PANs use idx_applications_pan_key (0007)
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_applications_identity_key ON applications(normalize_identity(name, father_name), date_of_birth);
@@ -0,0 +1,67 @@
+-- Cold storage for decided applications, moved here by archive.py. The live
+-- applications table then only holds pending and recent rows, so its indexes
+-- stay small and the dashboard's hot reads never touch years of history.
+-- Range partitioned by year of submission; partitions are created by
+-- create_archive_partitions() before rows for that year are moved, and whole
+-- years can later be detached or dropped without touching the rest.
+CREATE TABLE IF NOT EXISTS applications_archive (
+    id INTEGER NOT NULL,
+    username VARCHAR(255) NOT NULL,
+    name VARCHAR(255) NOT NULL,
+    father_name VARCHAR(255) NOT NULL,
+    date_of_birth DATE NOT NULL,
+    permanent_address TEXT NOT NULL,
+    temporary_address TEXT NOT NULL,
+    phone VARCHAR(50) NOT NULL,
+    email VARCHAR(255) NOT NULL,
+    pan VARCHAR(10) NOT NULL,
+    status VARCHAR(50),
+    created_at TIMESTAMP NOT NULL,
+    -- Copied from applications so duplicate checks keep covering archived rows
+    pan_key TEXT,
+    identity_key TEXT,
+    archived_at TIMESTAMP NOT NULL DEFAULT NOW(),
+    PRIMARY KEY (id, created_at)
+) PARTITION BY RANGE (created_at);
+
+-- Safety net only: archive.py creates the year's partition first, so this stays empty
+CREATE TABLE IF NOT EXISTS applications_archive_default PARTITION OF applications_archive DEFAULT;
+
+-- The table is empty when this runs, so building the partitioned indexes is instant
+CREATE INDEX IF NOT EXISTS idx_applications_archive_created_id ON applications_archive(created_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_applications_archive_status_created_id ON applications_archive(status, created_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_applications_archive_username_created_id ON applications_archive(username, created_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_applications_archive_pan_key ON applications_archive(pan_key);
+CREATE INDEX IF NOT EXISTS idx_applications_archive_identity_key ON applications_archive(identity_key, date_of_birth);
+
+CREATE OR REPLACE FUNCTION create_archive_partitions(first TIMESTAMP, last TIMESTAMP) RETURNS INTEGER AS $$
+DECLARE
+    year_start TIMESTAMP := date_trunc('year', first);
+    created INTEGER := 0;
+BEGIN
+    WHILE year_start <= last LOOP
+        IF to_regclass('applications_archive_' || to_char(year_start, 'YYYY')) IS NULL THEN
+            EXECUTE format(
+                'CREATE TABLE %I PARTITION OF applications_archive FOR VALUES FROM (%L) TO (%L)',
+                'applications_archive_' || to_char(year_start, 'YYYY'), year_start, year_start + INTERVAL '1 year');
+            created := created + 1;
+        END IF;
+        year_start := year_start + INTERVAL '1 year';
+    END LOOP;
+    RETURN created;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Archived rows still count towards the dashboard totals: the archive job
+-- sets passport.archiving for its transaction and its deletes are not counted
+CREATE OR REPLACE FUNCTION count_application_deletes() RETURNS trigger AS $$
+BEGIN
+    IF current_setting('passport.archiving', true) = 'on' THEN
+        RETURN NULL;
+    END IF;
+    UPDATE application_status_counts c SET total = c.total - d.removed
+    FROM (SELECT status, count(*) AS removed FROM old_rows WHERE status IS NOT NULL GROUP BY status) d
+    WHERE c.status = d.status;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
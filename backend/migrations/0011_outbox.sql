@@ -0,0 +1,43 @@
+-- Transactional outbox: side effects of a decision (notification emails and
+-- the like) are queued here by a trigger in the same transaction as the
+-- status change, and delivered afterwards by outbox.py workers. A committed
+-- decision therefore always gets its events, and a rolled back one never does.
+CREATE TABLE IF NOT EXISTS outbox (
+    id BIGSERIAL PRIMARY KEY,
+    event VARCHAR(100) NOT NULL,
+    application_id INTEGER,
+    payload JSONB NOT NULL,
+    -- pending, delivered or dead (gave up after OUTBOX_MAX_ATTEMPTS)
+    status VARCHAR(20) NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    available_at TIMESTAMP NOT NULL DEFAULT NOW(),
+    last_error TEXT,
+    created_at TIMESTAMP NOT NULL DEFAULT NOW(),
+    delivered_at TIMESTAMP
+);
+
+-- Workers claim the oldest due rows; the partial index holds only the backlog
+CREATE INDEX IF NOT EXISTS idx_outbox_pending ON outbox(available_at, id) WHERE status = 'pending';
+CREATE INDEX IF NOT EXISTS idx_outbox_dead ON outbox(id) WHERE status = 'dead';
+CREATE INDEX IF NOT EXISTS idx_outbox_delivered_at ON outbox(delivered_at) WHERE status = 'delivered';
+
+CREATE OR REPLACE FUNCTION enqueue_application_decisions() RETURNS trigger AS $$
+BEGIN
+    INSERT INTO outbox (event, application_id, payload)
+    SELECT 'application.decided', n.id, jsonb_build_object(
+        'application_id', n.id, 'username', n.username, 'name', n.name, 'email', n.email,
+        'status', n.status, 'previous_status', o.status)
+    FROM new_rows n JOIN old_rows o ON o.id = n.id
+    WHERE n.status IS DISTINCT FROM o.status AND n.status IN ('accepted', 'rejected')
+    ORDER BY n.id;
+    IF FOUND THEN
+        PERFORM pg_notify('outbox', '');
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS applications_outbox_update ON applications;
+CREATE TRIGGER applications_outbox_update AFTER UPDATE ON applications
+REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE FUNCTION enqueue_application_decisions();
@@ -0,0 +1,37 @@
+-- Change rows carry the application as it was when it changed, so a replayed
+-- delta shows the status it was given then (not the current one), and still
+-- arrives after the row has been archived. Keys and order match
+-- changes.DELTA_COLUMNS; json (not jsonb) keeps that order.
+ALTER TABLE application_changes ADD COLUMN IF NOT EXISTS data JSON;
+
+CREATE OR REPLACE FUNCTION record_application_inserts() RETURNS trigger AS $$
+BEGIN
+    INSERT INTO application_changes (application_id, op, status, data)
+    SELECT id, 'insert', status, json_build_object(
+        'id', id, 'username', username, 'name', name, 'father_name', father_name,
+        'date_of_birth', date_of_birth, 'phone', phone, 'email', email, 'pan', pan,
+        'status', status, 'created_at', created_at)
+    FROM new_rows ORDER BY id;
+    IF FOUND THEN
+        PERFORM pg_notify('application_changes', '');
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION record_application_updates() RETURNS trigger AS $$
+BEGIN
+    INSERT INTO application_changes (application_id, op, status, data)
+    SELECT n.id, 'update', n.status, json_build_object(
+        'id', n.id, 'username', n.username, 'name', n.name, 'father_name', n.father_name,
+        'date_of_birth', n.date_of_birth, 'phone', n.phone, 'email', n.email, 'pan', n.pan,
+        'status', n.status, 'created_at', n.created_at)
+    FROM new_rows n JOIN old_rows o ON o.id = n.id
+    WHERE n.status IS DISTINCT FROM o.status
+    ORDER BY n.id;
+    IF FOUND THEN
+        PERFORM pg_notify('application_changes', '');
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
@@ -0,0 +1,62 @@
+-- Every submission used to update the same counter row for its status (and
+-- its hour), so concurrent inserts queued on that row lock until each other
+-- committed. Each counter is now split over a fixed number of slots: a
+-- statement adds its delta to one slot picked at random, and readers sum the
+-- slots. Existing totals become slot 0.
+ALTER TABLE application_status_counts ADD COLUMN IF NOT EXISTS slot SMALLINT NOT NULL DEFAULT 0;
+ALTER TABLE application_status_counts DROP CONSTRAINT IF EXISTS application_status_counts_pkey;
+ALTER TABLE application_status_counts ADD PRIMARY KEY (status, slot);
+
+ALTER TABLE application_hourly_submissions ADD COLUMN IF NOT EXISTS slot SMALLINT NOT NULL DEFAULT 0;
+ALTER TABLE application_hourly_submissions DROP CONSTRAINT IF EXISTS application_hourly_submissions_pkey;
+ALTER TABLE application_hourly_submissions ADD PRIMARY KEY (hour, slot);
+
+-- 16 slots: enough that a handful of concurrent writers rarely meet, few
+-- enough that summing them on read stays negligible
+CREATE OR REPLACE FUNCTION stats_counter_slot() RETURNS SMALLINT AS $$
+    SELECT floor(random() * 16)::smallint;
+$$ LANGUAGE sql VOLATILE;
+
+CREATE OR REPLACE FUNCTION count_application_inserts() RETURNS trigger AS $$
+DECLARE
+    s SMALLINT := stats_counter_slot();
+BEGIN
+    INSERT INTO application_status_counts AS c (status, slot, total)
+    SELECT status, s, count(*) FROM new_rows WHERE status IS NOT NULL GROUP BY status
+    ON CONFLICT (status, slot) DO UPDATE SET total = c.total + EXCLUDED.total;
+    INSERT INTO application_hourly_submissions AS h (hour, slot, total)
+    SELECT date_trunc('hour', created_at), s, count(*) FROM new_rows WHERE created_at IS NOT NULL GROUP BY 1
+    ON CONFLICT (hour, slot) DO UPDATE SET total = h.total + EXCLUDED.total;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION count_application_updates() RETURNS trigger AS $$
+BEGIN
+    INSERT INTO application_status_counts AS c (status, slot, total)
+    SELECT status, stats_counter_slot(), sum(delta) FROM (
+        SELECT n.status, 1 AS delta FROM new_rows n JOIN old_rows o ON o.id = n.id
+        WHERE n.status IS DISTINCT FROM o.status AND n.status IS NOT NULL
+        UNION ALL
+        SELECT o.status, -1 FROM new_rows n JOIN old_rows o ON o.id = n.id
+        WHERE n.status IS DISTINCT FROM o.status AND o.status IS NOT NULL
+    ) changes
+    GROUP BY status
+    ON CONFLICT (status, slot) DO UPDATE SET total = c.total + EXCLUDED.total;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Deletes add a negative delta to a slot, so a slot may go below zero; only
+-- the sum over a status's slots is meaningful. Archiving still skips them.
+CREATE OR REPLACE FUNCTION count_application_deletes() RETURNS trigger AS $$
+BEGIN
+    IF current_setting('passport.archiving', true) = 'on' THEN
+        RETURN NULL;
+    END IF;
+    INSERT INTO application_status_counts AS c (status, slot, total)
+    SELECT status, stats_counter_slot(), -count(*) FROM old_rows WHERE status IS NOT NULL GROUP BY status
+    ON CONFLICT (status, slot) DO UPDATE SET total = c.total + EXCLUDED.total;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
@@ -0,0 +1,361 @@
+"""Deliver the side effects queued in the outbox table.
+
+    python outbox.py run [--workers 4]    # deliver until stopped
+    python outbox.py stats                # backlog, delivered and dead counts
+    python outbox.py dead [--limit 50]    # list dead letters
+    python outbox.py requeue [ID ...]     # retry dead letters (all if no ids)
+    python outbox.py prune                # drop delivered rows past retention
+
+Migration 0011 queues an ``application.decided`` event whenever an
+application becomes accepted or rejected, in the same transaction as the
+status change, so admin requests never wait for delivery. Each worker claims
+a batch of due rows with FOR UPDATE SKIP LOCKED in a short transaction that
+leases them, by moving available_at OUTBOX_LEASE seconds ahead, and commits.
+It then runs the event's handlers outside any transaction, so a slow mail
+server holds no locks, and records the outcomes in a second short
+transaction. Any number of workers and processes can run side by side
+without claiming the same row; the rows of a worker that dies mid-batch are
+claimed by the others once the lease runs out.
+
+Delivery is at least once: a handler may see an event again if its outcome
+could not be recorded, or if delivering a batch outlasted the lease, so
+handlers should be idempotent (use the event id).
+A failed event is retried with exponential backoff and becomes a dead
+letter after OUTBOX_MAX_ATTEMPTS.
+"""
+import argparse
+import os
+import random
+import select
+import signal
+import smtplib
+import sys
+import threading
+import time
+from email.message import EmailMessage
+
+import psycopg2
+from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
+from psycopg2.extras import RealDictCursor
+from dotenv import load_dotenv
+
+load_dotenv()
+
+CHANNEL = "outbox"
+BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", "50"))
+WORKERS = int(os.getenv("OUTBOX_WORKERS", "4"))
+MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "8"))
+# Seconds a claimed batch is reserved for its worker; keep it above the time the
+# handlers can take for a whole batch (the SMTP timeout is 10s per event)
+LEASE = float(os.getenv("OUTBOX_LEASE", "600"))
+# Retry n waits about BASE_BACKOFF * 2**(n-1) seconds, at most MAX_BACKOFF
+BASE_BACKOFF = float(os.getenv("OUTBOX_BASE_BACKOFF", "5"))
+MAX_BACKOFF = float(os.getenv("OUTBOX_MAX_BACKOFF", "3600"))
+# Seconds an idle worker sleeps when no NOTIFY arrives, to pick up retries that came due
+POLL_INTERVAL = float(os.getenv("OUTBOX_POLL_INTERVAL", "5"))
+RETENTION_HOURS = float(os.getenv("OUTBOX_RETENTION_HOURS", "168"))
+
+SMTP_HOST = os.getenv("SMTP_HOST")
+SMTP_PORT = int(os.getenv("SMTP_PORT", "587"))
+SMTP_USER = os.getenv("SMTP_USER")
+SMTP_PASSWORD = os.getenv("SMTP_PASSWORD")
+MAIL_FROM = os.getenv("MAIL_FROM", "passport@localhost")
+
+# Leases the oldest due rows: they stay pending, but are not due again until
+# the lease runs out. Each claim counts as an attempt.
+CLAIM_SQL = """
+    UPDATE outbox o
+    SET available_at = NOW() + %s * INTERVAL '1 second', attempts = o.attempts + 1
+    FROM (
+        SELECT id FROM outbox
+        WHERE status = 'pending' AND available_at <= NOW()
+        ORDER BY available_at, id
+        LIMIT %s
+        FOR UPDATE SKIP LOCKED
+    ) c
+    WHERE o.id = c.id
+    RETURNING o.id, o.event, o.application_id, o.payload, o.attempts
+"""
+
+# Outcomes only apply to rows still pending, so a late worker whose lease ran
+# out cannot undo a delivery recorded by the worker that took the row over
+DELIVERED_SQL = """
+    UPDATE outbox SET status = 'delivered', delivered_at = NOW(), last_error = NULL
+    WHERE id = ANY(%s) AND status = 'pending'
+"""
+
+FAILED_SQL = """
+    UPDATE outbox o
+    SET last_error = f.error,
+        status = CASE WHEN o.attempts >= %s THEN 'dead' ELSE 'pending' END,
+        available_at = NOW() + f.delay * INTERVAL '1 second'
+    FROM unnest(%s::bigint[], %s::text[], %s::float8[]) AS f(id, error, delay)
+    WHERE o.id = f.id AND o.status = 'pending'
+    RETURNING o.id, o.status
+"""
+
+
+def send_decision_email(event):
+    """Tell the applicant their application was decided. Needs SMTP_HOST."""
+    payload = event["payload"]
+    message = EmailMessage()
+    message["From"] = MAIL_FROM
+    message["To"] = payload["email"]
+    message["Subject"] = f"Your passport application #{payload['application_id']} was {payload['status']}"
+    # Lets the receiving side drop a redelivered event
+    message["Message-ID"] = f"<outbox-{event['id']}@passport>"
+    message.set_content(
+        f"Dear {payload['name']},\n\nYour passport application #{payload['application_id']} "
+        f"has been {payload['status']}.\n"
+    )
+    with smtplib.SMTP(SMTP_HOST, SMTP_PORT, timeout=10) as smtp:
+        if SMTP_USER:
+            smtp.starttls()
+            smtp.login(SMTP_USER, SMTP_PASSWORD)
+        smtp.send_message(message)
+
+
+# Event name -> handlers, each called with the outbox row as a dict
+HANDLERS = {"application.decided": [send_decision_email] if SMTP_HOST else []}
+
+
+def backoff(attempt):
+    """Seconds before retry number ``attempt``, with jitter so failed batches spread out."""
+    delay = min(MAX_BACKOFF, BASE_BACKOFF * 2 ** (attempt - 1))
+    return delay * random.uniform(0.5, 1.0)
+
+
+def process_batch(conn, handlers=None, batch_size=BATCH_SIZE, max_attempts=MAX_ATTEMPTS, lease=LEASE):
+    """Claim, deliver and record one batch; return counts of claimed, delivered, retried and dead rows.
+
+    The claim and the outcomes are two short transactions. The handlers run
+    between them, with nothing locked or open on ``conn``.
+    """
+    handlers = HANDLERS if handlers is None else handlers
+    with conn.cursor() as cur:
+        try:
+            cur.execute(CLAIM_SQL, (lease, batch_size))
+            rows = cur.fetchall()
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+    delivered, failed = [], []
+    for row in rows:
+        try:
+            for handler in handlers.get(row["event"], ()):
+                handler(row)
+            delivered.append(row["id"])
+        except Exception as e:
+            failed.append((row["id"], f"{type(e).__name__}: {e}"[:1000], backoff(row["attempts"])))
+
+    outcomes = []
+    with conn.cursor() as cur:
+        try:
+            if delivered:
+                cur.execute(DELIVERED_SQL, (delivered,))
+            if failed:
+                ids, errors, delays = (list(column) for column in zip(*failed))
+                cur.execute(FAILED_SQL, (max_attempts, ids, errors, delays))
+                outcomes = [r["status"] for r in cur.fetchall()]
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    dead = outcomes.count("dead")
+    return {"claimed": len(rows), "delivered": len(delivered), "retried": len(failed) - dead, "dead": dead}
+
+
+def connect(dsn=None):
+    return psycopg2.connect(dsn or os.getenv("DATABASE_URL"), cursor_factory=RealDictCursor)
+
+
+class WorkerPool:
+    """``workers`` threads delivering batches, woken by NOTIFY on the outbox channel."""
+
+    def __init__(self, dsn=None, workers=WORKERS, batch_size=BATCH_SIZE):
+        self.dsn = dsn or os.getenv("DATABASE_URL")
+        self.workers = workers
+        self.batch_size = batch_size
+        self._stopping = threading.Event()
+        self._wake = threading.Condition()
+        self._signals = 0
+        self._threads = []
+
+    def start(self):
+        self._threads = [threading.Thread(target=self._listen, name="outbox-listener", daemon=True)]
+        self._threads += [threading.Thread(target=self._work, name=f"outbox-worker-{i}", daemon=True)
+                          for i in range(self.workers)]
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self):
+        self._stopping.set()
+        self._notify()
+        for thread in self._threads:
+            thread.join(15)
+
+    def _notify(self):
+        with self._wake:
+            self._signals += 1
+            self._wake.notify_all()
+
+    def _listen(self):
+        backoff_seconds = 1
+        while not self._stopping.is_set():
+            conn = None
+            try:
+                conn = connect(self.dsn)
+                conn.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+                with conn.cursor() as cur:
+                    cur.execute(f"LISTEN {CHANNEL}")
+                backoff_seconds = 1
+                last_prune = 0
+                while not self._stopping.is_set():
+                    if time.monotonic() - last_prune > 3600:
+                        prune(conn)
+                        last_prune = time.monotonic()
+                    if select.select([conn], [], [], 1.0) == ([], [], []):
+                        continue
+                    conn.poll()
+                    if conn.notifies:
+                        conn.notifies.clear()
+                        self._notify()
+            except Exception as e:
+                print(f"✗ Outbox listener error: {e}")
+                self._stopping.wait(backoff_seconds)
+                backoff_seconds = min(backoff_seconds * 2, 30)
+            finally:
+                if conn is not None:
+                    conn.close()
+
+    def _work(self):
+        conn = None
+        while not self._stopping.is_set():
+            with self._wake:
+                # A NOTIFY that arrives while this batch runs must not be slept through
+                seen = self._signals
+            try:
+                if conn is None or conn.closed:
+                    conn = connect(self.dsn)
+                result = process_batch(conn, batch_size=self.batch_size)
+                if result["retried"] or result["dead"]:
+                    print(f"⚠ Outbox: {result['retried']} event(s) will be retried, {result['dead']} dead")
+                if result["claimed"] == self.batch_size:
+                    continue
+            except Exception as e:
+                print(f"✗ Outbox worker error: {e}")
+                if conn is not None:
+                    conn.close()
+                conn = None
+            with self._wake:
+                if self._signals == seen:
+                    self._wake.wait(POLL_INTERVAL)
+        if conn is not None:
+            conn.close()
+
+
+def stats(conn):
+    with conn.cursor() as cur:
+        cur.execute("""
+            SELECT count(*) FILTER (WHERE status = 'pending') AS pending,
+                   count(*) FILTER (WHERE status = 'pending' AND available_at <= NOW()) AS due,
+                   count(*) FILTER (WHERE status = 'delivered') AS delivered,
+                   count(*) FILTER (WHERE status = 'dead') AS dead,
+                   EXTRACT(EPOCH FROM NOW() - min(created_at) FILTER (WHERE status = 'pending'))::bigint AS oldest_pending_seconds
+            FROM outbox
+        """)
+        return dict(cur.fetchone())
+
+
+def requeue(conn, ids=None):
+    """Move dead letters (all, or ``ids``) back to pending with a fresh attempt count."""
+    with conn.cursor() as cur:
+        cur.execute(
+            "UPDATE outbox SET status = 'pending', attempts = 0, available_at = NOW() "
+            "WHERE status = 'dead' AND (%s::bigint[] IS NULL OR id = ANY(%s::bigint[]))",
+            (ids, ids),
+        )
+        count = cur.rowcount
+        cur.execute(f"NOTIFY {CHANNEL}")
+    conn.commit()
+    return count
+
+
+def prune(conn, retention_hours=RETENTION_HOURS):
+    with conn.cursor() as cur:
+        cur.execute(
+            "DELETE FROM outbox WHERE status = 'delivered' AND delivered_at < NOW() - %s * INTERVAL '1 hour'",
+            (retention_hours,),
+        )
+        count = cur.rowcount
+    conn.commit()
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Deliver and inspect outbox events")
+    commands = parser.add_subparsers(dest="command", required=True)
+    run = commands.add_parser("run", help="deliver events until stopped")
+    run.add_argument("--workers", type=int, default=WORKERS, help="delivery threads in this process")
+    run.add_argument("--batch-size", type=int, default=BATCH_SIZE, help="events claimed per transaction")
+    commands.add_parser("stats", help="show backlog and dead letter counts")
+    dead = commands.add_parser("dead", help="list dead letters")
+    dead.add_argument("--limit", type=int, default=50)
+    retry = commands.add_parser("requeue", help="retry dead letters")
+    retry.add_argument("ids", type=int, nargs="*", help="outbox ids (default: every dead letter)")
+    commands.add_parser("prune", help="delete delivered events older than OUTBOX_RETENTION_HOURS")
+    args = parser.parse_args()
+
+    if args.command == "run":
+        if not any(HANDLERS.values()):
+            print("⚠ No outbox handlers configured (set SMTP_HOST for decision emails); events are marked delivered")
+        workers = WorkerPool(workers=args.workers, batch_size=args.batch_size)
+        stopped = threading.Event()
+        signal.signal(signal.SIGTERM, lambda *_: stopped.set())
+        workers.start()
+        print(f"✓ Outbox delivery running with {args.workers} worker(s)")
+        try:
+            while not stopped.wait(1):
+                pass
+        except KeyboardInterrupt:
+            pass
+        workers.stop()
+        print("✓ Outbox delivery stopped")
+        return 0
+
+    try:
+        conn = connect()
+    except Exception as e:
+        print(f"✗ Could not connect to the database: {e}")
+        return 1
+    try:
+        if args.command == "stats":
+            s = stats(conn)
+            print(f"✓ {s['pending']} pending ({s['due']} due), {s['delivered']} delivered, {s['dead']} dead"
+                  + (f"; oldest pending {s['oldest_pending_seconds']}s" if s["oldest_pending_seconds"] is not None else ""))
+        elif args.command == "dead":
+            with conn.cursor() as cur:
+                cur.execute(
+                    "SELECT id, event, application_id, attempts, last_error FROM outbox WHERE status = 'dead' "
+                    "ORDER BY id DESC LIMIT %s",
+                    (args.limit,),
+                )
+                for row in cur.fetchall():
+                    print(f"✗ #{row['id']} {row['event']} application {row['application_id']} "
+                          f"after {row['attempts']} attempt(s): {row['last_error']}")
+        elif args.command == "requeue":
+            print(f"✓ Requeued {requeue(conn, args.ids or None)} dead letter(s)")
+        elif args.command == "prune":
+            print(f"✓ Pruned {prune(conn)} delivered event(s)")
+        return 0
+    except Exception as e:
+        print(f"✗ {args.command} failed: {e}")
+        return 1
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,442 @@
+import base64
+import os
+import re
+from datetime import datetime
+
+# SQL shared by the sync (main.py) and async (async_api.py) handlers. Both
+# psycopg2 and psycopg 3 accept the same %s placeholders.
+
+APPLICATION_COLUMNS = (
+    "id", "username", "name", "father_name", "date_of_birth", "permanent_address",
+    "temporary_address", "phone", "email", "pan", "status", "created_at",
+)
+# Explicit rather than *, so columns the database maintains stay internal
+RETURNING_COLUMNS = ", ".join(APPLICATION_COLUMNS)
+# Columns a client supplies when submitting, in INSERT order
+IMPORT_COLUMNS = (
+    "username", "name", "father_name", "date_of_birth", "permanent_address",
+    "temporary_address", "phone", "email", "pan", "status",
+)
+
+# Every application's duplicate keys. Live rows compute them with the same
+# expressions as idx_applications_pan_key / idx_applications_identity_key, so
+# conditions on the keys use those indexes; archived rows store them.
+DUPLICATE_KEYS_SQL = """
+    SELECT id, normalize_pan(pan) AS pan_key, normalize_identity(name, father_name) AS identity_key, date_of_birth
+    FROM applications
+    UNION ALL
+    SELECT id, pan_key, identity_key, date_of_birth FROM applications_archive
+"""
+
+# What a submission matching an earlier application's PAN or identity does:
+# "flag" stores it and queues the match for review, "reject" refuses it (409)
+DUPLICATE_POLICY = os.getenv("DUPLICATE_POLICY", "flag").lower()
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(created_at, app_id):
+    raw = f"{created_at.isoformat()}|{app_id}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        created_at, app_id = raw.rsplit("|", 1)
+        return datetime.fromisoformat(created_at), int(app_id)
+    except (ValueError, UnicodeDecodeError) as e:
+        raise InvalidCursor("Invalid cursor") from e
+
+
+def parse_fields(fields):
+    """Validate a comma separated ?fields= projection against APPLICATION_COLUMNS."""
+    if not fields:
+        return APPLICATION_COLUMNS
+    selected = [f.strip() for f in fields.split(",") if f.strip()]
+    unknown = [f for f in selected if f not in APPLICATION_COLUMNS]
+    if unknown or not selected:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}" if unknown else "No fields selected")
+    return tuple(dict.fromkeys(selected))
+
+
+def build_duplicate_lock_query(data):
+    """Return (sql, params) locking ``data``'s duplicate keys until the transaction ends.
+
+    The submit check reads a snapshot, so two identical submissions running
+    at once would each find no match and both be inserted. Run in its own
+    statement before build_submit_query, the advisory locks make the second
+    wait until the first commits; its check then starts with a snapshot that
+    includes the first. The PAN lock is taken first, and not at all for a
+    blank PAN.
+    """
+    sql = """
+        SELECT CASE WHEN k.pan_key <> '' THEN pg_advisory_xact_lock(hashtextextended('pan|' || k.pan_key, 0)) END,
+               pg_advisory_xact_lock(hashtextextended('identity|' || k.identity_key || '|' || k.dob, 0))
+        FROM (SELECT normalize_pan(%s) AS pan_key, normalize_identity(%s, %s) AS identity_key, %s::date::text AS dob) k
+    """
+    return sql, [data.pan, data.name, data.father_name, data.date_of_birth]
+
+
+def build_submit_query(data, reject_duplicates=False):
+    """Return (sql, params) inserting one application after checking it for duplicates.
+
+    Earlier applications sharing its normalized PAN (idx_applications_pan_key)
+    or name + father's name + date of birth (idx_applications_identity_key)
+    are found in the same statement, so the check costs two index probes per
+    table, not a scan. Archived applications are checked too. With
+    ``reject_duplicates`` nothing is inserted when there are matches;
+    otherwise the row is inserted and its clusters in duplicate_clusters are
+    created or extended for review. The row's columns are null when it was
+    rejected; ``duplicates`` lists the matches either way. Rejecting needs
+    build_duplicate_lock_query to run first in the same transaction.
+    """
+    columns = ", ".join(IMPORT_COLUMNS)
+    sql = f"""
+        WITH candidate AS (
+            -- A PAN with no letters or digits matches nothing, rather than every other such PAN
+            SELECT NULLIF(normalize_pan(%s), '') AS pan_key, normalize_identity(%s, %s) AS identity_key, %s::date AS dob
+        ), matches AS (
+            SELECT a.id, a.pan_key = c.pan_key AS same_pan,
+                   a.identity_key = c.identity_key AND a.date_of_birth = c.dob AS same_identity
+            FROM ({DUPLICATE_KEYS_SQL}) a, candidate c
+            WHERE a.pan_key = c.pan_key OR (a.identity_key = c.identity_key AND a.date_of_birth = c.dob)
+            ORDER BY a.id
+            LIMIT 50
+        ), inserted AS (
+            INSERT INTO applications ({columns})
+            SELECT %s, %s, %s, %s, %s, %s, %s, %s, %s, %s
+            WHERE NOT %s OR NOT EXISTS (SELECT 1 FROM matches)
+            RETURNING {RETURNING_COLUMNS}
+        ), flagged AS (
+            INSERT INTO duplicate_clusters (match_type, match_key, application_ids, size)
+            SELECT t.match_type, t.match_key, t.ids || i.id, cardinality(t.ids) + 1
+            FROM inserted i, candidate c, LATERAL (VALUES
+                ('pan', c.pan_key, ARRAY(SELECT id FROM matches WHERE same_pan)),
+                ('identity', c.identity_key || '|' || to_char(c.dob, 'YYYY-MM-DD'),
+                 ARRAY(SELECT id FROM matches WHERE same_identity))
+            ) AS t(match_type, match_key, ids)
+            WHERE cardinality(t.ids) > 0
+            ON CONFLICT (match_type, match_key) DO UPDATE
+                SET application_ids = duplicate_clusters.application_ids || EXCLUDED.application_ids[EXCLUDED.size],
+                    size = duplicate_clusters.size + 1,
+                    status = 'open',
+                    updated_at = NOW()
+        )
+        SELECT i.*, m.duplicates
+        FROM (
+            SELECT COALESCE(json_agg(json_build_object('id', id, 'pan', same_pan, 'identity', same_identity)
+                                     ORDER BY id), '[]'::json) AS duplicates
+            FROM matches
+        ) m
+        LEFT JOIN inserted i ON true
+    """
+    values = [getattr(data, column) for column in IMPORT_COLUMNS]
+    return sql, [data.pan, data.name, data.father_name, data.date_of_birth] + values + [reject_duplicates]
+
+
+def _hot_and_cold(select, include_archived, limited=False):
+    """``select`` (with a ``{table}`` placeholder) on applications, or merged with applications_archive.
+
+    Both branches keep their ORDER BY (and LIMIT) so each is an index range
+    scan; the merged rows are then ordered newest first and, when
+    ``limited``, cut to one more LIMIT parameter.
+    """
+    if not include_archived:
+        return select.format(table="applications")
+    return (f"({select.format(table='applications')}) UNION ALL ({select.format(table='applications_archive')}) "
+            "ORDER BY created_at DESC, id DESC" + (" LIMIT %s" if limited else ""))
+
+
+def build_list_query(status=None, username=None, cursor=None, limit=DEFAULT_PAGE_SIZE, fields=APPLICATION_COLUMNS,
+                     include_archived=False):
+    """Return (sql, params) for one page of applications, newest first.
+
+    Pages are keyed on (created_at, id) so each page is a range scan on
+    idx_applications_created_id / idx_applications_status_created_id (or
+    idx_applications_username_created_id for one applicant) instead of an OFFSET
+    that reads and discards every earlier row.
+
+    Postgres renders the page as a single JSON array (``body``) so the API can
+    return it without building or re-encoding per-row dicts. One extra row is
+    fetched to tell whether another page follows; it is left out of ``body``
+    and only used for ``has_more``. ``last_created_at``/``last_id`` identify the
+    last row of the page for the next cursor.
+
+    With ``include_archived`` the page is merged from applications and
+    applications_archive, each read through its own keyset index.
+    """
+    conditions = []
+    params = []
+    if status:
+        conditions.append("status = %s")
+        params.append(status)
+    if username:
+        conditions.append("username = %s")
+        params.append(username)
+    if cursor:
+        created_at, app_id = decode_cursor(cursor)
+        conditions.append("(created_at, id) < (%s, %s)")
+        params.extend([created_at, app_id])
+
+    where = f"WHERE {' AND '.join(conditions)} " if conditions else ""
+    # Field names are whitelisted by parse_fields, so they are safe to inline
+    columns = ", ".join(dict.fromkeys(("id", "created_at") + tuple(fields)))
+    projection = ", ".join(f"p.{f}" for f in fields)
+    rows = _hot_and_cold(f"SELECT {columns} FROM {{table}} {where}ORDER BY created_at DESC, id DESC LIMIT %s",
+                         include_archived, limited=True)
+    sql = f"""
+        SELECT
+            COALESCE(json_agg(row_to_json(f) ORDER BY p.rn) FILTER (WHERE p.rn <= %s), '[]')::text AS body,
+            max(p.created_at) FILTER (WHERE p.rn = %s) AS last_created_at,
+            max(p.id) FILTER (WHERE p.rn = %s) AS last_id,
+            count(*) > %s AS has_more
+        FROM (
+            SELECT a.*, row_number() OVER (ORDER BY a.created_at DESC, a.id DESC) AS rn
+            FROM ({rows}) a
+        ) p
+        CROSS JOIN LATERAL (SELECT {projection}) f
+    """
+    if include_archived:
+        return sql, [limit, limit, limit, limit] + (params + [limit + 1]) * 2 + [limit + 1]
+    return sql, [limit, limit, limit, limit] + params + [limit + 1]
+
+
+def build_item_query(app_id, fields=APPLICATION_COLUMNS, include_archived=False, username=None):
+    """Return (sql, params) rendering one application as JSON text (no row if missing).
+
+    With ``username`` only that applicant's application matches.
+    """
+    columns = ", ".join(fields)
+    condition, key = ("id = %s AND username = %s", [app_id, username]) if username else ("id = %s", [app_id])
+    if include_archived:
+        source = (f"(SELECT {columns} FROM applications WHERE {condition} "
+                  f"UNION ALL SELECT {columns} FROM applications_archive WHERE {condition} LIMIT 1)")
+        params = key + key
+    else:
+        source = f"(SELECT {columns} FROM applications WHERE {condition})"
+        params = key
+    return f"SELECT row_to_json(a)::text AS body FROM {source} a", params
+
+
+def next_cursor(page):
+    """Cursor for the page after ``page`` (a row returned by build_list_query)."""
+    if page["has_more"]:
+        return encode_cursor(page["last_created_at"], page["last_id"])
+    return None
+
+
+def build_bulk_status_query(updates):
+    """Return (sql, params) applying many (id, status) pairs in one statement.
+
+    The pairs are passed as two arrays and joined with unnest(), so the
+    statement text and parameter count stay the same for 1 or 5000 rows. Every
+    requested id comes back with ``found`` telling whether it matched a row.
+    Duplicate ids should be collapsed by the caller beforehand.
+    """
+    ids = [u.id for u in updates]
+    statuses = [u.status for u in updates]
+    sql = """
+        WITH input AS (
+            SELECT * FROM unnest(%s::int[], %s::text[]) AS v(id, status)
+        ), updated AS (
+            UPDATE applications a SET status = input.status
+            FROM input
+            WHERE a.id = input.id
+            RETURNING a.id, a.status
+        )
+        SELECT input.id, updated.status, updated.id IS NOT NULL AS found
+        FROM input LEFT JOIN updated ON updated.id = input.id
+        ORDER BY input.id
+    """
+    return sql, [ids, statuses]
+
+
+def build_filter_status_query(status, ids=None, current_status=None, username=None):
+    """Return (sql, params) moving every application matching the filter to ``status``."""
+    conditions = []
+    params = [status]
+    if ids:
+        conditions.append("id = ANY(%s)")
+        params.append(list(ids))
+    if current_status:
+        conditions.append("status = %s")
+        params.append(current_status)
+    if username:
+        conditions.append("username = %s")
+        params.append(username)
+    sql = f"UPDATE applications SET status = %s WHERE {' AND '.join(conditions)} RETURNING id, status"
+    return sql, params
+
+
+def build_export_query(status=None, username=None, created_from=None, created_to=None, include_archived=False):
+    """Return (sql, params) selecting every matching application for export, newest first."""
+    conditions = []
+    params = []
+    if status:
+        conditions.append("status = %s")
+        params.append(status)
+    if username:
+        conditions.append("username = %s")
+        params.append(username)
+    if created_from:
+        conditions.append("created_at >= %s")
+        params.append(created_from)
+    if created_to:
+        conditions.append("created_at < %s")
+        params.append(created_to)
+    where = f"WHERE {' AND '.join(conditions)} " if conditions else ""
+    select = f"SELECT {', '.join(APPLICATION_COLUMNS)} FROM {{table}} {where}ORDER BY created_at DESC, id DESC"
+    return _hot_and_cold(select, include_archived), params * (2 if include_archived else 1)
+
+
+def build_stats_query(days=30, hours=48):
+    """Return (sql, params) rendering the dashboard statistics as one JSON document.
+
+    Totals come from application_status_counts and the histograms from
+    application_hourly_submissions, both maintained by triggers and split
+    into slots that are summed here, so the cost depends on the number of
+    statuses and buckets rather than on the number of applications. The oldest pending application is the first entry of
+    idx_applications_status_created_id for status 'pending'.
+    """
+    sql = """
+        WITH oldest AS (
+            SELECT min(created_at) AS created_at FROM applications WHERE status = 'pending'
+        )
+        SELECT json_build_object(
+            'totals', COALESCE((
+                SELECT json_object_agg(status, total ORDER BY status)
+                FROM (
+                    SELECT status, sum(total) AS total FROM application_status_counts
+                    GROUP BY status HAVING sum(total) <> 0
+                ) t
+            ), '{}'::json),
+            'total', (SELECT COALESCE(sum(total), 0) FROM application_status_counts),
+            'daily', COALESCE((
+                SELECT json_agg(json_build_object('day', d.day, 'count', d.total) ORDER BY d.day)
+                FROM (
+                    SELECT hour::date AS day, sum(total) AS total
+                    FROM application_hourly_submissions
+                    WHERE hour >= date_trunc('day', LOCALTIMESTAMP) - (%s - 1) * INTERVAL '1 day'
+                    GROUP BY 1
+                ) d
+            ), '[]'::json),
+            'hourly', COALESCE((
+                SELECT json_agg(json_build_object('hour', h.hour, 'count', h.total) ORDER BY h.hour)
+                FROM (
+                    SELECT hour, sum(total) AS total
+                    FROM application_hourly_submissions
+                    WHERE hour >= date_trunc('hour', LOCALTIMESTAMP) - (%s - 1) * INTERVAL '1 hour'
+                    GROUP BY hour
+                ) h
+            ), '[]'::json),
+            'oldest_pending_at', oldest.created_at,
+            'oldest_pending_age_seconds', EXTRACT(EPOCH FROM LOCALTIMESTAMP - oldest.created_at)::bigint,
+            'generated_at', LOCALTIMESTAMP
+        )::text AS body
+        FROM oldest
+    """
+    return sql, [days, hours]
+
+
+DEFAULT_SEARCH_LIMIT = 20
+MAX_SEARCH_LIMIT = 100
+# Results reachable by paging (offset + limit). Every page ranks all matches
+# and keeps the top offset + limit, so deeper pages are refused rather than
+# served; a narrower query or a status filter finds the rest.
+MAX_SEARCH_RESULTS = 1000
+
+PAN_PATTERN = re.compile(r"^[A-Za-z]{5}[0-9]{4}[A-Za-z]$")
+PHONE_PATTERN = re.compile(r"^\+?[0-9][0-9 ()-]{5,18}[0-9]$")
+
+
+def search_mode(q):
+    """How ``q`` is looked up: "pan" or "phone" (exact) or "text" (ranked)."""
+    q = q.strip()
+    if PAN_PATTERN.match(re.sub(r"[\s-]", "", q)):
+        return "pan"
+    if PHONE_PATTERN.match(q):
+        return "phone"
+    return "text"
+
+
+def prefix_tsquery(q):
+    """Turn free text into a tsquery matching every word as a prefix ("ram kum" -> "ram:* & kum:*")."""
+    words = re.findall(r"\w+", q.lower())
+    if not words:
+        raise ValueError("Search query has no words")
+    return " & ".join(f"{w}:*" for w in words)
+
+
+def _search_vector(alias):
+    # Must match idx_applications_search's expression for the index to be used
+    return f"application_search_vector({alias}.name, {alias}.father_name, {alias}.permanent_address, {alias}.temporary_address)"
+
+
+def build_search_query(q, status=None, offset=0, limit=DEFAULT_SEARCH_LIMIT, fields=APPLICATION_COLUMNS, fuzzy=False):
+    """Return (sql, params) for one page of search results as a JSON document.
+
+    A PAN or phone number is an exact lookup on idx_applications_pan_key /
+    idx_applications_phone. Anything else matches every word as a prefix
+    against application_search_vector() (idx_applications_search) and, with
+    ``fuzzy``, also names within trigram distance (idx_applications_*_trgm,
+    only present where pg_trgm is installed). Every match is ranked; results
+    are ordered by rank, then newest first. ``next_offset`` is null on the
+    last page, and pages past MAX_SEARCH_RESULTS raise ValueError.
+    """
+    if offset + limit > MAX_SEARCH_RESULTS:
+        raise ValueError(f"Only the first {MAX_SEARCH_RESULTS} results can be paged through; narrow the search")
+    mode = search_mode(q)
+    params = []
+    if mode == "pan":
+        # PANs are stored as submitted; compare normalized, on idx_applications_pan_key
+        match, rank = "normalize_pan(a.pan) = normalize_pan(%s)", "1.0"
+        params.append(q)
+    elif mode == "phone":
+        digits = re.sub(r"[^0-9+]", "", q)
+        match, rank = "a.phone = ANY(%s)", "1.0"
+        params.append(list(dict.fromkeys([q.strip(), digits])))
+    else:
+        tsquery = prefix_tsquery(q)
+        match = f"{_search_vector('a')} @@ to_tsquery('simple', %s)"
+        rank = f"ts_rank_cd({_search_vector('a')}, to_tsquery('simple', %s))"
+        params.append(tsquery)
+        rank_params = [tsquery]
+        if fuzzy:
+            # % is pg_trgm's similarity operator (escaped for the driver)
+            match = f"({match} OR a.name %% %s OR a.father_name %% %s)"
+            rank = f"{rank} + greatest(similarity(a.name, %s), similarity(a.father_name, %s) * 0.5)"
+            params.extend([q, q])
+            rank_params.extend([q, q])
+    if status:
+        match += " AND a.status = %s"
+        params.append(status)
+
+    projection = ", ".join(f"p.{f}" for f in fields)
+    sql = f"""
+        SELECT json_build_object(
+            'mode', %s,
+            'results', COALESCE(json_agg(row_to_json(f) ORDER BY p.rn) FILTER (WHERE p.rn <= %s), '[]'::json),
+            'next_offset', CASE WHEN count(*) > %s THEN %s::int END
+        )::text AS body
+        FROM (
+            SELECT r.*, row_number() OVER (ORDER BY r.rank DESC, r.created_at DESC, r.id DESC) AS rn
+            FROM (
+                SELECT a.*, {rank} AS rank
+                FROM applications a
+                WHERE {match}
+                ORDER BY rank DESC, a.created_at DESC, a.id DESC
+                LIMIT %s OFFSET %s
+            ) r
+        ) p
+        CROSS JOIN LATERAL (SELECT {projection}, round(p.rank::numeric, 4) AS rank) f
+    """
+    next_offset = offset + limit if offset + limit < MAX_SEARCH_RESULTS else None
+    head = [mode, limit, limit, next_offset]
+    ranking = rank_params if mode == "text" else []
+    return sql, head + ranking + params + [limit + 1, offset]
@@ -0,0 +1,337 @@
+"""Read routing to streaming replicas.
+
+With ``REPLICA_URLS`` set, read-only handlers borrow their connection from
+``router`` instead of the primary pool. Replicas are used round robin and
+only while they pass the health probe and lag at most ``REPLICA_MAX_LAG``
+seconds behind; otherwise reads go to the primary. Writes always use the
+primary.
+
+Read-your-writes: after a write the handler records the primary's WAL
+position for its user. That user's reads stay on the primary until the
+probe has seen a replica replay past that position, so an admin never reads
+a list from before their own status change.
+"""
+import itertools
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager, contextmanager
+
+import psycopg2
+
+import async_db
+import db
+import metrics
+from db import ConnectionPool, PoolTimeout
+
+logger = logging.getLogger("passport.replicas")
+
+# Comma separated DSNs of streaming replicas; empty routes everything to the primary
+REPLICA_URLS = os.getenv("REPLICA_URLS", "")
+# Seconds of replay lag after which a replica stops serving reads
+REPLICA_MAX_LAG = float(os.getenv("REPLICA_MAX_LAG", "5"))
+REPLICA_POOL_MAX_SIZE = int(os.getenv("REPLICA_POOL_MAX_SIZE", os.getenv("DB_POOL_MAX_SIZE", "10")))
+# Short, so a busy or unreachable replica costs a read little before it falls back
+REPLICA_ACQUIRE_TIMEOUT = float(os.getenv("REPLICA_ACQUIRE_TIMEOUT", "1"))
+# How long a user's last write is remembered; comfortably above any lag a replica may serve with
+WRITE_TTL = float(os.getenv("READ_YOUR_WRITES_TTL", "60"))
+
+reads_total = metrics.registry.counter(
+    "db_reads_total", "Read-only handler connections by target and reason", ("target", "reason"))
+
+# Past any real WAL position: no replica qualifies
+UNKNOWN_LSN = 2 ** 63
+
+PRIMARY_LSN_SQL = "SELECT pg_current_wal_lsn() - '0/0'::pg_lsn AS lsn"
+# A server that is not in recovery (e.g. a promoted replica) is as current as it gets
+REPLICA_STATUS_SQL = """
+    SELECT pg_is_in_recovery() AS standby,
+           CASE WHEN pg_is_in_recovery() THEN pg_last_wal_replay_lsn() ELSE pg_current_wal_lsn() END
+               - '0/0'::pg_lsn AS replay_lsn,
+           EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) AS replay_age
+"""
+
+
+class Replica:
+    """One replica, its pools and what the last probe found."""
+
+    def __init__(self, name, dsn):
+        self.name = name
+        self.dsn = dsn
+        self.pool = ConnectionPool(
+            dsn, min_size=0, max_size=REPLICA_POOL_MAX_SIZE, timeout=REPLICA_ACQUIRE_TIMEOUT, name=name)
+        self.async_pool = async_db.AsyncConnectionPool(
+            dsn, min_size=0, max_size=REPLICA_POOL_MAX_SIZE, timeout=REPLICA_ACQUIRE_TIMEOUT, name=name)
+        self.healthy = False
+        self.lag = None
+        self.replay_lsn = 0
+        self.error = None
+        self.checked_at = None
+
+    def status(self):
+        return {
+            "healthy": self.healthy,
+            "lag_seconds": None if self.lag is None else round(self.lag, 3),
+            "error": self.error,
+            "checked_at": self.checked_at,
+        }
+
+
+class MemoryWrites:
+    """Last write position per user, kept in this process."""
+
+    def __init__(self, ttl=WRITE_TTL, max_entries=100_000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user):
+        with self._lock:
+            entry = self._entries.get(user)
+            if entry is None or entry[1] <= time.monotonic():
+                return 0
+            return entry[0]
+
+    def set(self, user, lsn):
+        with self._lock:
+            self._entries[user] = (lsn, time.monotonic() + self.ttl)
+            self._entries.move_to_end(user)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def prune(self, replayed_lsn):
+        """Forget writes every replica has replayed."""
+        now = time.monotonic()
+        with self._lock:
+            self._entries = OrderedDict(
+                (user, entry) for user, entry in self._entries.items() if entry[0] > replayed_lsn and entry[1] > now)
+
+
+class RedisWrites:
+    """Last write position per user, shared by all workers. Requires the ``redis`` package."""
+
+    def __init__(self, url, ttl=WRITE_TTL, prefix="passport:last-write:"):
+        try:
+            import redis
+        except ImportError as e:
+            raise RuntimeError("READ_YOUR_WRITES_BACKEND=redis requires the redis package (pip install redis)") from e
+        self._client = redis.Redis.from_url(url)
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def get(self, user):
+        value = self._client.get(self.prefix + user)
+        return int(value) if value is not None else 0
+
+    def set(self, user, lsn):
+        self._client.set(self.prefix + user, lsn, ex=int(self.ttl))
+
+    def prune(self, replayed_lsn):
+        # Entries expire by TTL
+        pass
+
+
+def writes_from_env():
+    if os.getenv("READ_YOUR_WRITES_BACKEND", "memory").lower() == "redis":
+        return RedisWrites(os.getenv("READ_YOUR_WRITES_REDIS_URL", "redis://localhost:6379/3"))
+    return MemoryWrites()
+
+
+class ReplicaRouter:
+    """Chooses the connection for each read: a caught-up healthy replica, else the primary."""
+
+    def __init__(self, primary, async_primary, replicas, max_lag=REPLICA_MAX_LAG, writes=None):
+        self.primary = primary
+        self.async_primary = async_primary
+        self.replicas = replicas
+        self.max_lag = max_lag
+        self.writes = writes if writes is not None else MemoryWrites()
+        self._next = itertools.count()
+
+    @classmethod
+    def from_env(cls):
+        dsns = [dsn.strip() for dsn in REPLICA_URLS.split(",") if dsn.strip()]
+        replicas = [Replica(f"replica{i}", dsn) for i, dsn in enumerate(dsns)]
+        return cls(db.pool, async_db.pool, replicas, writes=writes_from_env() if replicas else None)
+
+    @property
+    def enabled(self):
+        return bool(self.replicas)
+
+    def _candidates(self, needed):
+        return [r for r in self.replicas
+                if r.healthy and r.lag is not None and r.lag <= self.max_lag and r.replay_lsn >= needed]
+
+    def choose(self, user=None):
+        """The replica to read from for ``user``, or None to read from the primary."""
+        if not self.replicas:
+            return None
+        needed = self.writes.get(user) if user else 0
+        candidates = self._candidates(needed)
+        if not candidates:
+            if needed and self._candidates(0):
+                reason = "read_your_writes"
+            elif any(r.healthy for r in self.replicas):
+                reason = "lag"
+            else:
+                reason = "no_replica"
+            reads_total.inc("primary", reason)
+            return None
+        reads_total.inc("replica", "ok")
+        return candidates[next(self._next) % len(candidates)]
+
+    def pinned(self, user):
+        """True when ``user`` has a write no usable replica has replayed yet.
+
+        Such a user must not be served from the response cache either: another
+        reader may have filled it from a replica that predates the write.
+        """
+        if not self.enabled or not user:
+            return False
+        needed = self.writes.get(user)
+        return needed > 0 and not self._candidates(needed)
+
+    def eject(self, replica, error):
+        """Stop using ``replica`` until the next successful probe."""
+        replica.healthy = False
+        replica.error = str(error)
+        logger.warning("Replica %s ejected: %s", replica.name, error)
+
+    def _check_after_error(self, replica, broken, error):
+        # A failed query is the handler's business; a connection the server dropped means the replica is gone
+        if broken:
+            self.eject(replica, f"connection lost: {error}")
+
+    @contextmanager
+    def connection(self, user=None):
+        """Borrow a connection for a read-only handler (sync engine)."""
+        replica = self.choose(user)
+        if replica is not None:
+            try:
+                conn = replica.pool.getconn()
+            except PoolTimeout:
+                reads_total.inc("primary", "replica_busy")
+            except psycopg2.OperationalError as e:
+                self.eject(replica, e)
+            else:
+                try:
+                    yield conn
+                except Exception as e:
+                    self._check_after_error(replica, bool(conn.closed), e)
+                    raise
+                finally:
+                    replica.pool.putconn(conn)
+                return
+        with self.primary.connection() as conn:
+            yield conn
+
+    @asynccontextmanager
+    async def async_connection(self, user=None):
+        """Borrow a connection for a read-only handler (async engine)."""
+        replica = self.choose(user)
+        if replica is not None:
+            connect_errors = replica.async_pool.stats()["connect_errors"]
+            acquired = False
+            try:
+                async with replica.async_pool.connection() as conn:
+                    acquired = True
+                    try:
+                        yield conn
+                    except Exception as e:
+                        self._check_after_error(replica, conn.broken, e)
+                        raise
+                return
+            except PoolTimeout as e:
+                if acquired:
+                    raise
+                # psycopg_pool retries failed connects in the background and
+                # reports an unreachable server as a timeout; tell the two apart
+                if replica.async_pool.stats()["connect_errors"] > connect_errors:
+                    self.eject(replica, f"could not connect: {e}")
+                else:
+                    reads_total.inc("primary", "replica_busy")
+        async with self.async_primary.connection() as conn:
+            yield conn
+
+    def _note_failed(self, user, error):
+        # The write is committed either way; without its position, keep the user on the primary until WRITE_TTL
+        logger.warning("Could not read the WAL position after a write by %s: %s", user, error)
+        self.writes.set(user, UNKNOWN_LSN)
+
+    def note_write(self, user, conn):
+        """Record the primary's WAL position after ``user`` committed on ``conn`` (sync engine)."""
+        if not self.enabled or not user:
+            return
+        try:
+            with conn.cursor() as cur:
+                cur.execute(PRIMARY_LSN_SQL)
+                self.writes.set(user, int(cur.fetchone()["lsn"]))
+            conn.rollback()
+        except Exception as e:
+            self._note_failed(user, e)
+
+    async def note_write_async(self, user, conn):
+        if not self.enabled or not user:
+            return
+        try:
+            cur = await conn.execute(PRIMARY_LSN_SQL)
+            self.writes.set(user, int((await cur.fetchone())["lsn"]))
+            await conn.rollback()
+        except Exception as e:
+            self._note_failed(user, e)
+
+    def probe(self, timeout=REPLICA_ACQUIRE_TIMEOUT):
+        """Check every replica's health and lag; called by the health monitor on its interval."""
+        if not self.replicas:
+            return {}
+        try:
+            # Read before the replicas, so a replica at or past it has everything committed by now
+            with self.primary.connection(timeout=timeout) as conn, conn.cursor() as cur:
+                cur.execute(PRIMARY_LSN_SQL)
+                primary_lsn = int(cur.fetchone()["lsn"])
+        except Exception:
+            primary_lsn = None
+        for replica in self.replicas:
+            try:
+                with replica.pool.connection(timeout=timeout) as conn, conn.cursor() as cur:
+                    cur.execute(REPLICA_STATUS_SQL)
+                    row = cur.fetchone()
+            except PoolTimeout:
+                # Busy serving reads is not a failure; keep the last result
+                continue
+            except Exception as e:
+                if replica.healthy:
+                    self.eject(replica, e)
+                replica.error = str(e)
+                replica.checked_at = time.time()
+                continue
+            replica.replay_lsn = int(row["replay_lsn"] or 0)
+            if primary_lsn is not None and replica.replay_lsn >= primary_lsn:
+                replica.lag = 0.0
+            else:
+                # Time since the last replayed commit: an upper bound while the primary is busy
+                replica.lag = float(row["replay_age"]) if row["replay_age"] is not None else None
+            replica.healthy = True
+            replica.error = None
+            replica.checked_at = time.time()
+        healthy = [r.replay_lsn for r in self.replicas if r.healthy]
+        if len(healthy) == len(self.replicas):
+            self.writes.prune(min(healthy))
+        return self.status()
+
+    def status(self):
+        return {replica.name: replica.status() for replica in self.replicas}
+
+    def close(self):
+        for replica in self.replicas:
+            replica.pool.close()
+
+    async def close_async(self):
+        for replica in self.replicas:
+            await replica.async_pool.close()
+
+
+router = ReplicaRouter.from_env()
@@ -0,0 +1,82 @@
+import re
+from typing import List, Literal, Optional
+from pydantic import BaseModel, field_validator, model_validator
+
+MAX_BULK_UPDATES = 5000
+
+# Compiled once at import; the validators run on every request
+EMAIL_PATTERN = re.compile(r'^[^@\s]+@[^@\s]+\.[^@\s]+$')
+
+def _check_email(v: str):
+    if not EMAIL_PATTERN.match(v):
+        raise ValueError('Invalid email')
+    return v
+
+class SignUpRequest(BaseModel):
+    username: str
+    email: str
+    password: str
+    # Signup only creates applicants; administrators are added with create_admin.py
+    category: Literal["Applicant"] = "Applicant"
+
+    @field_validator('email')
+    def _validate_email(cls, v: str):
+        return _check_email(v)
+
+class LoginRequest(BaseModel):
+    email: str
+    password: str
+
+    @field_validator('email')
+    def _validate_email(cls, v: str):
+        return _check_email(v)
+
+class ApplicationRequest(BaseModel):
+    username: str
+    name: str
+    father_name: str
+    date_of_birth: str
+    permanent_address: str
+    temporary_address: str
+    phone: str
+    email: str
+    pan: str
+    status: str = "pending"
+
+    @field_validator('email')
+    def _validate_email(cls, v: str):
+        return _check_email(v)
+
+class StatusUpdate(BaseModel):
+    id: int
+    status: str
+
+class ApplicationFilter(BaseModel):
+    ids: Optional[List[int]] = None
+    status: Optional[str] = None
+    username: Optional[str] = None
+
+class BulkStatusRequest(BaseModel):
+    # Either explicit (id, status) pairs, or a filter plus one target status
+    updates: Optional[List[StatusUpdate]] = None
+    filter: Optional[ApplicationFilter] = None
+    status: Optional[str] = None
+
+    @model_validator(mode='after')
+    def _validate_mode(self):
+        if self.updates is not None:
+            if self.filter is not None or self.status is not None:
+                raise ValueError('Send either updates or filter + status, not both')
+            if not self.updates:
+                raise ValueError('updates must not be empty')
+            if len(self.updates) > MAX_BULK_UPDATES:
+                raise ValueError(f'At most {MAX_BULK_UPDATES} updates per request')
+        else:
+            if self.filter is None or self.status is None:
+                raise ValueError('Send either updates or filter + status')
+            f = self.filter
+            if not (f.ids or f.status or f.username):
+                raise ValueError('filter needs at least one of ids, status, username')
+            if f.ids and len(f.ids) > MAX_BULK_UPDATES:
+                raise ValueError(f'At most {MAX_BULK_UPDATES} ids per request')
+        return self
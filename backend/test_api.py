@@ -1,9 +1,24 @@
+import asyncio
 import pytest
+from fastapi import FastAPI
 from fastapi.testclient import TestClient
 from main import app
+from db import ConnectionPool, PoolTimeout, pool
+import async_api
+import async_db
+import changes
+import admission
+from tokens import tokens, ADMIN_CATEGORY
+import os
 import json
+import time
+import uuid
 
-client = TestClient(app)
+# Most tests exercise admin routes; they authenticate as an administrator
+ADMIN_HEADERS = {"Authorization": f"Bearer {tokens.issue('test-admin', ADMIN_CATEGORY)}"}
+client = TestClient(app, headers=ADMIN_HEADERS)
+# The whole suite comes from one client address; Test 51 covers the rate limits
+admission.rate_limiter = None
 
 # Test 1: Root endpoint
 def test_root_endpoint():
@@ -111,7 +126,7 @@ def test_login_returns_user_category():
         "username": "categorytest",
         "email": "category@example.com",
         "password": "pass123",
-        "category": "Passport Administrator"
+        "category": "Applicant"
     })
     response = client.post("/api/login", json={
         "email": "category@example.com",
@@ -232,5 +247,1236 @@ def test_pan_number_validation():
     })
     assert response.status_code in [200, 422, 500]
 
+# Test 21: Connection pool stats endpoint
+def test_pool_stats_endpoint():
+    client.get("/api/health")
+    response = client.get("/api/db/pool")
+    assert response.status_code == 200
+    data = response.json()
+    for key in ["in_use", "idle", "waits", "wait_time_seconds", "max_size"]:
+        assert key in data
+
+# Test 22: Connection pool reuses connections and times out when exhausted
+def test_pool_reuse_and_timeout():
+    test_pool = ConnectionPool(os.getenv("DATABASE_URL"), min_size=0, max_size=1, timeout=0.2)
+    try:
+        with test_pool.connection() as conn:
+            first = id(conn)
+            with pytest.raises(PoolTimeout):
+                test_pool.getconn()
+        with test_pool.connection() as conn:
+            assert id(conn) == first
+        stats = test_pool.stats()
+        assert stats["timeouts"] == 1
+        assert stats["waits"] == 1
+        assert stats["connections_created"] == 1
+    finally:
+        test_pool.close()
+
+# Test 23: Async engine serves the data endpoints with the same responses
+def test_async_engine_endpoints():
+    async_app = FastAPI()
+    async_app.include_router(async_api.router)
+    async_app.add_event_handler("shutdown", async_db.pool.close)
+    with TestClient(async_app, headers=ADMIN_HEADERS) as async_client:
+        async_client.post("/api/signup", json={
+            "username": "asyncuser",
+            "email": "asyncuser@example.com",
+            "password": "asyncpass",
+            "category": "Applicant"
+        })
+        response = async_client.post("/api/login", json={
+            "email": "asyncuser@example.com",
+            "password": "asyncpass"
+        })
+        assert response.status_code == 200
+        assert response.json()["username"] == "asyncuser"
+        applicant = {"Authorization": f"Bearer {response.json()['token']}"}
+
+        app_response = async_client.post("/api/applications", json={
+            "username": "asyncuser",
+            "name": "Async Doe",
+            "father_name": "Sync Doe",
+            "date_of_birth": "1991-02-03",
+            "permanent_address": "1 Loop St",
+            "temporary_address": "2 Await Ave",
+            "phone": "5550001111",
+            "email": "asyncuser@example.com",
+            "pan": "ASYNC1234A"
+        })
+        assert app_response.status_code == 200
+        app_id = app_response.json()["application"]["id"]
+
+        response = async_client.put(f"/api/applications/{app_id}?status=accepted")
+        assert response.status_code == 200
+        assert response.json()["application"]["status"] == "accepted"
+        assert async_client.put("/api/applications/99999999?status=accepted").status_code == 404
+        assert any(a["id"] == app_id for a in async_client.get("/api/applications").json())
+        # Applicants read only their own applications, whatever ?username= says
+        own = async_client.get("/api/applications", params={"username": "someoneelse"}, headers=applicant).json()
+        assert app_id in [a["id"] for a in own] and {a["username"] for a in own} == {"asyncuser"}
+        assert async_client.get(f"/api/applications/{app_id}", headers=applicant).status_code == 200
+        other_id = async_client.post("/api/applications", json=_application_payload("asyncother")).json()["application"]["id"]
+        assert async_client.get(f"/api/applications/{other_id}").status_code == 200
+        assert async_client.get(f"/api/applications/{other_id}", headers=applicant).status_code == 404
+
+        # Failures are logged as in the sync handlers
+        records, stop = _capture_logs("passport.api")
+        try:
+            bad_date = async_client.post("/api/applications", json={**_application_payload("async"), "date_of_birth": "not-a-date"})
+        finally:
+            stop()
+        assert bad_date.status_code == 500
+        assert [r.getMessage() for r in records] == ["Application submit failed"] and records[0].exc_info
+
+# Test 24: Applications are paginated with a keyset cursor and filterable
+def test_get_applications_pagination():
+    ids = []
+    for i in range(3):
+        app_response = client.post("/api/applications", json={
+            "username": "pagetest",
+            "name": f"Page {i}",
+            "father_name": "Pager",
+            "date_of_birth": "1990-01-01",
+            "permanent_address": "1 Cursor Rd",
+            "temporary_address": "2 Keyset Ln",
+            "phone": "5550000000",
+            "email": "page@example.com",
+            "pan": "PAGES1234P"
+        })
+        ids.append(app_response.json()["application"]["id"])
+
+    first = client.get("/api/applications?username=pagetest&limit=2")
+    assert first.status_code == 200
+    assert len(first.json()) == 2
+    assert all(a["username"] == "pagetest" for a in first.json())
+    cursor = first.headers["X-Next-Cursor"]
+
+    seen = [a["id"] for a in first.json()]
+    while cursor:
+        page = client.get(f"/api/applications?username=pagetest&limit=2&cursor={cursor}")
+        assert page.status_code == 200
+        seen += [a["id"] for a in page.json()]
+        cursor = page.headers.get("X-Next-Cursor")
+    assert len(seen) == len(set(seen))
+    assert set(ids) <= set(seen)
+
+    pending = client.get("/api/applications?status=pending&limit=5")
+    assert all(a["status"] == "pending" for a in pending.json())
+
+# Test 25: Invalid pagination parameters are rejected
+def test_get_applications_invalid_cursor():
+    assert client.get("/api/applications?cursor=not-a-cursor").status_code == 400
+    assert client.get("/api/applications?limit=0").status_code == 422
+
+# Test 26: Field projection returns only the requested columns
+def test_get_applications_fields_projection():
+    response = client.get("/api/applications?fields=id,name,status,date_of_birth&limit=5")
+    assert response.status_code == 200
+    for app in response.json():
+        assert set(app) == {"id", "name", "status", "date_of_birth"}
+        assert len(app["date_of_birth"]) == 10
+    assert client.get("/api/applications?fields=id,password").status_code == 400
+
+def _create_application(username, name="Bulk Doe", pan="BULKS1234B"):
+    response = client.post("/api/applications", json={
+        "username": username,
+        "name": name,
+        "father_name": "Batch Doe",
+        "date_of_birth": "1993-04-05",
+        "permanent_address": "5 Set St",
+        "temporary_address": "6 Values Ave",
+        "phone": "5553334444",
+        "email": "bulk@example.com",
+        "pan": pan
+    })
+    return response.json()["application"]["id"]
+
+# Test 27: Bulk status update applies (id, status) pairs and reports missing ids
+def test_bulk_status_update_pairs():
+    first = _create_application("bulkpairs")
+    second = _create_application("bulkpairs")
+    response = client.post("/api/applications/bulk-status", json={
+        "updates": [
+            {"id": first, "status": "accepted"},
+            {"id": second, "status": "rejected"},
+            {"id": 99999999, "status": "accepted"}
+        ]
+    })
+    assert response.status_code == 200
+    data = response.json()
+    assert data["count"] == 2
+    assert {"id": first, "status": "accepted"} in data["updated"]
+    assert {"id": second, "status": "rejected"} in data["updated"]
+    assert data["not_found"] == [99999999]
+
+# Test 28: Bulk status update by filter
+def test_bulk_status_update_filter():
+    ids = [_create_application("bulkfilter") for _ in range(3)]
+    response = client.post("/api/applications/bulk-status", json={
+        "filter": {"username": "bulkfilter", "status": "pending"},
+        "status": "accepted"
+    })
+    assert response.status_code == 200
+    assert set(ids) <= {a["id"] for a in response.json()["updated"]}
+    remaining = client.get("/api/applications?username=bulkfilter&status=pending")
+    assert remaining.json() == []
+
+# Test 29: Bulk status update rejects ambiguous or empty requests
+def test_bulk_status_update_validation():
+    assert client.post("/api/applications/bulk-status", json={"updates": []}).status_code == 422
+    assert client.post("/api/applications/bulk-status", json={"status": "accepted"}).status_code == 422
+    assert client.post("/api/applications/bulk-status", json={"filter": {}, "status": "accepted"}).status_code == 422
+
+# Test 30: Bulk CSV import loads valid rows and reports rejected ones
+def test_import_applications_csv():
+    csv_data = (
+        "username,name,father_name,date_of_birth,permanent_address,temporary_address,phone,email,pan\n"
+        "csvimport,Row One,Father One,1990-01-01,\"1 Comma, Street\",Temp 1,5551110000,one@example.com,CSVIM1234A\n"
+        "csvimport,Row Two,Father Two,not-a-date,Perm 2,Temp 2,5552220000,two@example.com,CSVIM1234B\n"
+        "csvimport,Row Three,Father Three,1991-02-02,Perm 3,Temp 3,5553330000,bad-email,CSVIM1234C\n"
+        "csvimport,Row Four,Father Four,1992-03-03,Perm 4,Temp 4,5554440000,four@example.com,CSVIM1234D\n"
+    )
+    response = client.post(
+        "/api/applications/import?batch_size=1",
+        files={"file": ("applications.csv", csv_data, "text/csv")}
+    )
+    assert response.status_code == 200
+    data = response.json()
+    assert data["imported"] == 2
+    assert data["rejected"] == 2
+    assert [e["line"] for e in data["errors"]] == [3, 4]
+    imported = client.get("/api/applications?username=csvimport").json()
+    assert {"1 Comma, Street"} <= {a["permanent_address"] for a in imported}
+
+# Test 31: Bulk NDJSON import
+def test_import_applications_ndjson():
+    record = {
+        "username": "ndjsonimport", "name": "Json Doe", "father_name": "Json Sr",
+        "date_of_birth": "1990-01-01", "permanent_address": "1 Line St",
+        "temporary_address": "2 Line St", "phone": "5550009999",
+        "email": "json@example.com", "pan": "NDJSO1234N"
+    }
+    body = json.dumps(record) + "\n{not json}\n" + json.dumps({**record, "pan": "TOOLONGPAN123"}) + "\n"
+    response = client.post(
+        "/api/applications/import",
+        files={"file": ("applications.ndjson", body, "application/x-ndjson")}
+    )
+    assert response.status_code == 200
+    assert response.json()["imported"] == 1
+    assert response.json()["rejected"] == 2
+    assert client.post(
+        "/api/applications/import",
+        files={"file": ("applications.txt", body, "text/plain")}
+    ).status_code == 400
+
+# Test 32: CSV export streams filtered applications
+def test_export_applications_csv():
+    username = f"exportcsv-{uuid.uuid4().hex[:8]}"
+    ids = [_create_application(username) for _ in range(3)]
+    response = client.get(f"/api/applications/export?format=csv&username={username}")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/csv")
+    lines = response.text.strip().splitlines()
+    assert lines[0].startswith("id,username,name")
+    assert len(lines) == 4
+    assert {int(line.split(",")[0]) for line in lines[1:]} == set(ids)
+
+# Test 33: NDJSON export with gzip and date filters
+def test_export_applications_ndjson_gzip():
+    username = f"exportjson-{uuid.uuid4().hex[:8]}"
+    app_id = _create_application(username)
+    response = client.get(f"/api/applications/export?format=ndjson&gzip=true&username={username}&created_from=2000-01-01T00:00:00")
+    assert response.status_code == 200
+    assert response.headers["content-encoding"] == "gzip"
+    rows = [json.loads(line) for line in response.text.strip().splitlines()]
+    assert [r["id"] for r in rows] == [app_id]
+    assert rows[0]["date_of_birth"] == "1993-04-05"
+    empty = client.get(f"/api/applications/export?format=ndjson&username={username}&created_to=2000-01-01T00:00:00")
+    assert empty.text == ""
+
+# Test 34: Application reads send validators and answer 304 when unchanged
+def test_get_applications_etag():
+    username = f"etag-{uuid.uuid4().hex[:8]}"
+    app_id = _create_application(username)
+    first = client.get(f"/api/applications?username={username}")
+    assert first.status_code == 200
+    etag = first.headers["ETag"]
+    assert "Last-Modified" in first.headers
+
+    cached = client.get(f"/api/applications?username={username}", headers={"If-None-Match": etag})
+    assert cached.status_code == 304
+
+    item = client.get(f"/api/applications/{app_id}?fields=id,status")
+    assert item.json() == {"id": app_id, "status": "pending"}
+    assert client.get(f"/api/applications/{app_id}", headers={"If-None-Match": item.headers["ETag"]}).status_code == 200
+    assert client.get("/api/applications/99999999").status_code == 404
+
+# Test 35: Writes invalidate cached application reads
+def test_cache_invalidated_on_update():
+    username = f"cacheinv-{uuid.uuid4().hex[:8]}"
+    app_id = _create_application(username)
+    before = client.get(f"/api/applications?username={username}")
+    assert before.json()[0]["status"] == "pending"
+    client.get(f"/api/applications/{app_id}")
+
+    client.put(f"/api/applications/{app_id}?status=accepted")
+    after = client.get(f"/api/applications?username={username}", headers={"If-None-Match": before.headers["ETag"]})
+    assert after.status_code == 200
+    assert after.json()[0]["status"] == "accepted"
+    assert client.get(f"/api/applications/{app_id}").json()["status"] == "accepted"
+
+    _create_application(username)
+    assert len(client.get(f"/api/applications?username={username}").json()) == 2
+
+# Test 36: In-memory cache evicts least recently used entries and expires by TTL
+def test_memory_cache_backend():
+    from cache import MemoryBackend
+    backend = MemoryBackend(max_entries=2)
+    backend.set("a", b"1")
+    backend.set("b", b"2")
+    backend.get("a")
+    backend.set("c", b"3")
+    assert backend.get("b") is None
+    assert backend.get("a") == b"1"
+    backend.set("d", b"4", ttl=0.01)
+    time.sleep(0.02)
+    assert backend.get("d") is None
+
+# Test 37: Inserts and status changes are recorded for the change feed
+def test_change_log_records_inserts_and_updates():
+    with pool.connection() as conn, conn.cursor() as cur:
+        cur.execute("SELECT COALESCE(max(id), 0) AS id FROM application_changes")
+        after_id = cur.fetchone()["id"]
+    username = f"changelog-{uuid.uuid4().hex[:8]}"
+    app_id = _create_application(username)
+    client.put(f"/api/applications/{app_id}?status=accepted")
+    client.put(f"/api/applications/{app_id}?status=rejected")
+    client.put(f"/api/applications/{app_id}?status=rejected")
+    # Each delta keeps the values of its change, even once the row is gone (e.g. archived)
+    with pool.connection() as conn, conn.cursor() as cur:
+        cur.execute("DELETE FROM applications WHERE id = %s", (app_id,))
+        conn.commit()
+
+    events = [e for e in changes.replay(after_id) if json.loads(e[2])["id"] == app_id]
+    assert [e[1] for e in events] == ["insert", "update", "update"]
+    assert [json.loads(e[2])["status"] for e in events] == ["pending", "accepted", "rejected"]
+    assert json.loads(events[0][2])["username"] == username
+    assert "permanent_address" not in json.loads(events[0][2])
+
+# Test 38: One listener fans changes out to every subscriber
+def test_change_feed_fanout():
+    username = f"feed-{uuid.uuid4().hex[:8]}"
+
+    async def scenario():
+        loop = asyncio.get_running_loop()
+        subscribers = [await loop.run_in_executor(None, changes.feed.subscribe, loop) for _ in range(3)]
+        try:
+            app_id = await loop.run_in_executor(None, _create_application, username)
+            for subscription in subscribers:
+                while True:
+                    event_id, op, data = await asyncio.wait_for(subscription.queue.get(), 5)
+                    if json.loads(data)["id"] == app_id:
+                        break
+                assert op == "insert"
+                assert changes.format_event(event_id, op, data).startswith(f"id: {event_id}\nevent: change\n")
+        finally:
+            for subscription in subscribers:
+                changes.feed.unsubscribe(subscription)
+
+    asyncio.run(scenario())
+
+# Test 39: Dashboard stats follow inserts, status changes and deletes through the sharded trigger-maintained counters
+def test_application_stats():
+    before = client.get("/api/applications/stats").json()
+    app_id = _create_application(f"stats-{uuid.uuid4().hex[:8]}")
+    client.put(f"/api/applications/{app_id}?status=accepted")
+    # Separate statements land on random slots; deleting them must net out
+    marker = uuid.uuid4().hex[:8]
+    ids = [_create_application(f"stats-{marker}") for _ in range(8)]
+    with pool.connection() as conn, conn.cursor() as cur:
+        cur.execute("DELETE FROM applications WHERE id = ANY(%s)", (ids,))
+        conn.commit()
+        cur.execute("SELECT count(DISTINCT slot) AS slots FROM application_status_counts WHERE status = 'pending'")
+        assert cur.fetchone()["slots"] > 1
+
+    response = client.get("/api/applications/stats?days=7&hours=24")
+    assert response.status_code == 200
+    stats = response.json()
+    assert stats["totals"].get("accepted", 0) == before["totals"].get("accepted", 0) + 1
+    assert stats["total"] == before["total"] + 1
+    assert stats["hourly"][-1]["count"] >= 1
+    assert len(stats["daily"]) <= 7 and len(stats["hourly"]) <= 24
+
+    with pool.connection() as conn, conn.cursor() as cur:
+        # Archived applications still count
+        cur.execute(
+            "SELECT status, count(*) AS total FROM (SELECT status FROM applications UNION ALL SELECT status FROM applications_archive) a "
+            "WHERE status IS NOT NULL GROUP BY status"
+        )
+        assert stats["totals"] == {r["status"]: r["total"] for r in cur.fetchall()}
+
+# Test 40: /metrics reports requests per route template, SQL timings and pool stats
+def test_metrics_endpoint():
+    app_id = _create_application(f"metrics-{uuid.uuid4().hex[:8]}")
+    client.get(f"/api/applications/{app_id}")
+    client.get("/no/such/path")
+
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    text = response.text
+    assert 'http_requests_total{method="GET",route="/api/applications/{app_id}",status="200"}' in text
+    assert 'http_requests_total{method="GET",route="unmatched",status="404"}' in text
+    assert 'http_request_duration_seconds_bucket{method="POST",route="/api/applications",le="+Inf"}' in text
+    assert 'db_query_duration_seconds_count{route="/api/applications",operation="INSERT"}' in text
+    assert 'db_pool_acquire_duration_seconds_count{engine="sync"}' in text
+    assert 'db_pool_max_size{engine="sync"}' in text
+
+def _capture_logs(name):
+    """Records logged to ``name`` (before they reach the log queue), and a function to stop capturing."""
+    import logging
+    records = []
+    handler = logging.Handler()
+    handler.emit = records.append
+    logger = logging.getLogger(name)
+    logger.addHandler(handler)
+    return records, lambda: logger.removeHandler(handler)
+
+# Test 41: Requests over SLOW_REQUEST_MS are logged with their SQL timings
+def test_slow_request_log(monkeypatch):
+    import metrics
+    monkeypatch.setattr(metrics, "SLOW_REQUEST_MS", 0.001)
+    records, stop = _capture_logs("passport.metrics")
+    try:
+        client.get(f"/api/applications?username=slow-{uuid.uuid4().hex[:8]}")
+    finally:
+        stop()
+    slow = [r for r in records if r.getMessage().startswith("Slow request: GET /api/applications ")]
+    assert len(slow) == 1
+    assert len(slow[0].fields["sql"]) == 1
+    assert slow[0].fields["sql"][0]["statement"].startswith("SELECT COALESCE(json_agg(row_to_json(f)")
+
+    # Query parameters are logged as fields, so the session token and search terms are masked
+    import logs
+    records, stop = _capture_logs("passport.metrics")
+    try:
+        client.get("/api/applications/search?q=ABCDE1234F&token=secret-session-token")
+    finally:
+        stop()
+    entry = logs.JsonFormatter().format(records[-1])
+    assert "secret-session-token" not in entry and "ABCDE1234F" not in entry
+    assert json.loads(entry)["query"] == {"q": "[redacted]", "token": "[redacted]"}
+
+# Test 42: Migrations build the full schema in an empty database and are only applied once
+def test_migrations_apply_to_empty_schema():
+    import migrate
+    schema = f"migrate_test_{uuid.uuid4().hex[:8]}"
+    admin = migrate.connect()
+    with admin.cursor() as cur:
+        cur.execute(f"CREATE SCHEMA {schema}")
+    try:
+        conn = migrate.connect()
+        with conn.cursor() as cur:
+            cur.execute(f"SET search_path TO {schema}")
+        try:
+            assert migrate.current_version(conn) == 0
+            applied = migrate.migrate(conn)
+            assert [m.version for m in applied] == [m.version for m in migrate.discover()]
+            assert migrate.current_version(conn) == migrate.latest_version()
+            assert migrate.migrate(conn) == []
+
+            with conn.cursor() as cur:
+                cur.execute(
+                    "SELECT indexname FROM pg_indexes WHERE schemaname = %s AND tablename IN ('users', 'applications')",
+                    (schema,),
+                )
+                indexes = {row[0] for row in cur.fetchall()}
+            assert {"idx_users_email", "idx_applications_username_created_id", "idx_applications_status_created_id"} <= indexes
+            assert "idx_applications_status" not in indexes
+        finally:
+            conn.close()
+    finally:
+        with admin.cursor() as cur:
+            cur.execute(f"DROP SCHEMA {schema} CASCADE")
+        admin.close()
+
+# Test 43: Startup refuses to run against a schema older than the code unless AUTO_MIGRATE is set
+def test_startup_schema_check(monkeypatch):
+    import main
+    import migrate
+    with pool.connection() as conn:
+        current = migrate.current_version(conn)
+    main.check_schema()
+    monkeypatch.setattr(migrate, "latest_version", lambda: current + 1)
+    with pytest.raises(RuntimeError, match="migrate.py"):
+        main.check_schema()
+
+# Test 44: Liveness never touches the database; readiness waits for startup to finish
+def test_liveness_and_readiness():
+    assert client.get("/api/health/live").json() == {"status": "alive"}
+    assert client.get("/api/health/ready").status_code == 503
+    with TestClient(app) as started:
+        response = started.get("/api/health/ready")
+        assert response.status_code == 200
+        assert response.json()["status"] == "ready"
+    assert client.get("/api/health/ready").status_code == 503
+
+# Test 45: Health snapshots are cached between probes, go stale, and report an exhausted pool as degraded
+def test_health_monitor_snapshot():
+    import health
+    monitor = health.HealthMonitor(pool, interval=60, max_staleness=0.05)
+    first = monitor.current()
+    assert first["status"] == "healthy"
+    assert first["schema_version"] == first["expected_schema_version"]
+    assert monitor.current()["checked_at"] == first["checked_at"]
+
+    monitor.start()
+    try:
+        time.sleep(0.2)
+        stale = monitor.current()
+        assert stale["status"] == "unhealthy" and "stale" in stale["message"]
+    finally:
+        monitor.stop()
+
+    small = ConnectionPool(os.getenv("DATABASE_URL"), min_size=0, max_size=1, timeout=0.1)
+    try:
+        with small.connection():
+            snapshot = health.HealthMonitor(small, timeout=0.05).probe()
+        assert snapshot["status"] == "degraded"
+        assert snapshot["pools"]["sync"]["in_use"] == 1
+    finally:
+        small.close()
+
+# Test 46: Signup stores an argon2 hash, never the password, and login verifies against it
+def test_signup_stores_password_hash():
+    username = f"hash-{uuid.uuid4().hex[:8]}"
+    email = f"{username}@example.com"
+    response = client.post("/api/signup", json={"username": username, "email": email, "password": "s3cret", "category": "Applicant"})
+    assert response.status_code == 200
+    with pool.connection() as conn, conn.cursor() as cur:
+        cur.execute("SELECT password FROM users WHERE username = %s", (username,))
+        stored = cur.fetchone()["password"]
+    assert stored.startswith("$argon2") and "s3cret" not in stored
+    assert client.post("/api/login", json={"email": email, "password": "s3cret"}).json()["username"] == username
+    assert client.post("/api/login", json={"email": email, "password": "wrong"}).status_code == 401
+
+# Test 47: Plaintext and outdated hashes are replaced on the next successful login
+def test_login_upgrades_stored_passwords():
+    from argon2 import PasswordHasher
+    weak_hash = PasswordHasher(time_cost=1, memory_cost=1024, parallelism=1).hash("legacy-pass")
+    for stored in ("legacy-pass", weak_hash):
+        username = f"legacy-{uuid.uuid4().hex[:8]}"
+        email = f"{username}@example.com"
+        with pool.connection() as conn, conn.cursor() as cur:
+            cur.execute(
+                "INSERT INTO users (username, email, password, category) VALUES (%s, %s, %s, 'Applicant')",
+                (username, email, stored),
+            )
+            conn.commit()
+        assert client.post("/api/login", json={"email": email, "password": "nope"}).status_code == 401
+        assert client.post("/api/login", json={"email": email, "password": "legacy-pass"}).status_code == 200
+        with pool.connection() as conn, conn.cursor() as cur:
+            cur.execute("SELECT password FROM users WHERE username = %s", (username,))
+            upgraded = cur.fetchone()["password"]
+        assert upgraded != stored and upgraded.startswith("$argon2id$v=19$m=65536")
+        assert client.post("/api/login", json={"email": email, "password": "legacy-pass"}).status_code == 200
+
+# Test 48: The credential pool sheds work beyond its queue instead of growing without bound
+def test_credential_service_is_bounded():
+    from argon2 import PasswordHasher
+    from credentials import CredentialService, CredentialServiceBusy
+    service = CredentialService(PasswordHasher(time_cost=1, memory_cost=1024, parallelism=1), workers=1, queue_size=1, timeout=0.2)
+
+    async def scenario():
+        running = asyncio.ensure_future(service._run(time.sleep, 0.5))
+        queued = asyncio.ensure_future(service.hash_password("queued"))
+        await asyncio.sleep(0.01)
+        with pytest.raises(CredentialServiceBusy, match="Too many"):
+            await service.hash_password("rejected")
+        for task in (running, queued):
+            with pytest.raises(CredentialServiceBusy, match="timed out"):
+                await task
+
+    asyncio.run(scenario())
+
+# Test 49: Login issues a signed token; admin routes reject missing, forged, non-admin and expired tokens
+def test_session_tokens_protect_admin_routes():
+    anonymous = TestClient(app)
+    username = f"tok_{uuid.uuid4().hex[:10]}"
+    anonymous.post("/api/signup", json={
+        "username": username, "email": f"{username}@example.com", "password": "tokpass", "category": "Applicant",
+    })
+    login = anonymous.post("/api/login", json={"email": f"{username}@example.com", "password": "tokpass"}).json()
+    payload = tokens.verify(login["token"])
+    assert payload["sub"] == username and payload["cat"] == "Applicant"
+
+    assert anonymous.get("/api/applications").status_code == 401
+    assert anonymous.put("/api/applications/1?status=accepted").status_code == 401
+    applicant = {"Authorization": f"Bearer {login['token']}"}
+    assert anonymous.get("/api/applications/stats", headers=applicant).status_code == 403
+    assert anonymous.put("/api/applications/1?status=accepted", headers=applicant).status_code == 403
+
+    kid, body, signature = login["token"].split(".")
+    forged = f"{kid}.{body}.{'B' if signature[0] == 'A' else 'A'}{signature[1:]}"
+    assert anonymous.get("/api/applications", headers={"Authorization": f"Bearer {forged}"}).status_code == 401
+    expired = tokens.issue("test-admin", ADMIN_CATEGORY, ttl=-1)
+    response = anonymous.get("/api/applications", headers={"Authorization": f"Bearer {expired}"})
+    assert response.status_code == 401 and response.json()["detail"] == "Token expired"
+    assert anonymous.get("/api/applications", headers=ADMIN_HEADERS).status_code == 200
+    # EventSource cannot send headers, so the change stream also takes ?token=
+    assert anonymous.get("/api/applications/changes?token=not-a-token").status_code == 401
+
+# Test 50: Logged-out tokens are revoked; rotated-out keys still verify until they are dropped
+def test_session_token_revocation_and_rotation():
+    from tokens import TokenService, InvalidToken
+    token = tokens.issue("test-admin", ADMIN_CATEGORY)
+    headers = {"Authorization": f"Bearer {token}"}
+    anonymous = TestClient(app)
+    assert anonymous.get("/api/applications/stats", headers=headers).status_code == 200
+    assert anonymous.post("/api/logout", headers=headers).status_code == 200
+    response = anonymous.get("/api/applications/stats", headers=headers)
+    assert response.status_code == 401 and response.json()["detail"] == "Token revoked"
+
+    old = TokenService({"k1": b"first-secret"})
+    old_token = old.issue("someone", ADMIN_CATEGORY)
+    rotated = TokenService({"k2": b"second-secret", "k1": b"first-secret"})
+    assert rotated.verify(old_token)["sub"] == "someone"
+    assert rotated.issue("someone", ADMIN_CATEGORY).startswith("k2.")
+    with pytest.raises(InvalidToken, match="Unknown signing key"):
+        TokenService({"k2": b"second-secret"}).verify(old_token)
+
+# Test 51: Per-client and per-route token buckets shed bursts with 429 and Retry-After
+def test_rate_limits_shed_bursts(monkeypatch):
+    limiter = admission.RateLimiter(
+        admission.MemoryBackend(), admission.Rule(100, 100),
+        admission.parse_route_rules("GET /api/applications/{app_id}=0.5/2,100/100;PUT /api/applications/{app_id}=100/100,0.5/1"),
+    )
+    monkeypatch.setattr(admission, "rate_limiter", limiter)
+    assert client.get("/api/applications/99999").status_code == 404
+    assert client.get("/api/applications/99998").status_code == 404
+    response = client.get("/api/applications/99997")
+    assert response.status_code == 429 and int(response.headers["retry-after"]) >= 1
+    # Other routes have their own allowance for this client
+    assert client.get("/api/applications?limit=1").status_code == 200
+    # The shared route bucket limits every client together
+    assert client.put("/api/applications/99999?status=accepted").status_code == 404
+    assert client.put("/api/applications/99999?status=accepted").status_code == 429
+    assert 'http_requests_shed_total{route="/api/applications/{app_id}",reason="rate_limited"}' in client.get("/metrics").text
+
+    backend = admission.MemoryBackend()
+    rule = admission.Rule(2, 1)
+    assert backend.take("k", rule, now=10.0) == 0
+    assert backend.take("k", rule, now=10.0) == pytest.approx(0.5)
+    assert backend.take("k", rule, now=10.5) == 0
+
+# Test 52: The concurrency cap queues a bounded number of requests and answers 503 beyond it
+def test_concurrency_limiter_queue(monkeypatch):
+    limiter = admission.ConcurrencyLimiter(limit=1, queue_size=1, timeout=0.2)
+
+    async def scenario():
+        await limiter.acquire()
+        queued = asyncio.ensure_future(limiter.acquire())
+        await asyncio.sleep(0.01)
+        assert limiter.stats()["waiting"] == 1
+        with pytest.raises(admission.Overloaded, match="capacity"):
+            await limiter.acquire()
+        # The released slot goes to the queued request, not to a newcomer
+        limiter.release()
+        await queued
+        assert limiter.stats() == {"active": 1, "waiting": 0, "limit": 1, "queue_size": 1}
+        with pytest.raises(admission.Overloaded, match="Timed out"):
+            await limiter.acquire()
+        limiter.release()
+        assert limiter.stats()["active"] == 0
+
+    asyncio.run(scenario())
+
+    full = admission.ConcurrencyLimiter(limit=0, queue_size=0)
+    monkeypatch.setattr(admission, "concurrency", full)
+    response = client.get("/api/applications?limit=1")
+    assert response.status_code == 503 and response.headers["retry-after"] == "1"
+    # Probes are never shed
+    assert client.get("/api/health/live").status_code == 200
+
+# Test 53: Search ranks name matches, pages through results and looks up PAN and phone exactly
+def test_search_applications():
+    marker = f"zq{uuid.uuid4().hex[:8]}"
+    pan = "".join(chr(ord("A") + int(c, 16) % 26) for c in uuid.uuid4().hex[:5]) + "4321Z"
+    phone = "7" + str(uuid.uuid4().int)[:9]
+    ids = []
+    for i, (name, father) in enumerate([(f"{marker} Kumar", "Ravi Rao"), ("Sita Devi", f"{marker} Rao"), (f"{marker} Reddy", "Anil Rao")]):
+        response = client.post("/api/applications", json={
+            "username": f"search_{marker}", "name": name, "father_name": father, "date_of_birth": "1990-01-01",
+            "permanent_address": "1 Search Street", "temporary_address": "1 Search Street",
+            "phone": phone if i == 0 else "1234567890", "email": "search@example.com",
+            # Stored as submitted, in lower case
+            "pan": pan.lower() if i == 0 else "ABCDE1234F",
+        })
+        assert response.status_code == 200
+        ids.append(response.json()["application"]["id"])
+
+    results = client.get("/api/applications/search", params={"q": marker[:6]}).json()
+    assert results["mode"] == "text" and results["next_offset"] is None
+    # Name matches outrank father's-name matches, newest first among equals
+    assert [r["id"] for r in results["results"]] == [ids[2], ids[0], ids[1]]
+    assert results["results"][0]["rank"] > results["results"][2]["rank"]
+
+    first = client.get("/api/applications/search", params={"q": f"{marker} rao", "limit": 1, "fields": "id,name"}).json()
+    assert [r["id"] for r in first["results"]] == [ids[1]] and first["next_offset"] == 1
+    assert set(first["results"][0]) == {"id", "name", "rank"}
+    second = client.get("/api/applications/search", params={"q": f"{marker} rao", "limit": 1, "offset": 1}).json()
+    assert [r["id"] for r in second["results"]] == [ids[2]]
+
+    for q in (pan, pan.lower(), f"{pan[:5]} {pan[5:]}"):
+        by_pan = client.get("/api/applications/search", params={"q": q}).json()
+        assert by_pan["mode"] == "pan" and [r["id"] for r in by_pan["results"]] == [ids[0]]
+    by_phone = client.get("/api/applications/search", params={"q": f"{phone[:5]} {phone[5:]}"}).json()
+    assert by_phone["mode"] == "phone" and [r["id"] for r in by_phone["results"]] == [ids[0]]
+
+    assert client.get("/api/applications/search", params={"q": "!!"}).status_code == 400
+    # Paging stops at MAX_SEARCH_RESULTS rather than returning silently empty pages
+    last = client.get("/api/applications/search", params={"q": marker, "offset": 980, "limit": 20}).json()
+    assert last["results"] == [] and last["next_offset"] is None
+    assert client.get("/api/applications/search", params={"q": marker, "offset": 1000}).status_code == 400
+    assert TestClient(app).get("/api/applications/search", params={"q": marker}).status_code == 401
+
+# Test 54: Submissions sharing a normalized PAN or identity are flagged (or rejected) and queued for review
+def test_duplicate_applications_flagged_at_insert(monkeypatch):
+    import main
+    marker = uuid.uuid4().hex[:8]
+    pan = "".join(chr(ord("A") + int(c, 16) % 26) for c in marker[:5]) + "1234Q"
+    first = client.post("/api/applications", json={
+        "username": f"dup_{marker}", "name": f"Asha {marker}", "father_name": "Mohan Rao", "date_of_birth": "1991-02-03",
+        "permanent_address": "7 Copy Lane", "temporary_address": "7 Copy Lane", "phone": "5550001111",
+        "email": "dup@example.com", "pan": pan,
+    })
+    assert first.status_code == 200 and first.json()["duplicates"] == []
+    first_id = first.json()["application"]["id"]
+
+    # Same PAN in lower case
+    second = client.post("/api/applications", json=_application_payload(marker, pan=pan.lower()))
+    assert second.status_code == 200
+    assert second.json()["duplicates"] == [{"id": first_id, "pan": True, "identity": False}]
+    second_id = second.json()["application"]["id"]
+
+    # Same person under another PAN: case, spacing and punctuation are ignored
+    third = client.post("/api/applications", json=_application_payload(marker, name=f"  ASHA   {marker}.", father_name="mohan rao"))
+    assert third.json()["duplicates"] == [{"id": first_id, "pan": False, "identity": True}]
+
+    with pool.connection() as conn, conn.cursor() as cur:
+        cur.execute("SELECT match_type, application_ids FROM duplicate_clusters WHERE %s = ANY(application_ids) ORDER BY match_type", (first_id,))
+        clusters = {row["match_type"]: row["application_ids"] for row in cur.fetchall()}
+    assert clusters == {"identity": [first_id, third.json()["application"]["id"]], "pan": [first_id, second_id]}
+
+    monkeypatch.setattr(main, "DUPLICATE_POLICY", "reject")
+    rejected = client.post("/api/applications", json=_application_payload(marker, pan=pan))
+    assert rejected.status_code == 409
+    assert [d["id"] for d in rejected.json()["detail"]["duplicates"]] == [first_id, second_id]
+
+    # Two identical submissions at once: the second waits for the first's key lock, then sees its row
+    from concurrent.futures import ThreadPoolExecutor
+    from queries import build_duplicate_lock_query, build_submit_query
+    from schemas import ApplicationRequest
+    racer = _application_payload(marker)
+    data = ApplicationRequest(**racer)
+    with pool.connection() as conn, conn.cursor() as cur, ThreadPoolExecutor(1) as executor:
+        cur.execute(*build_duplicate_lock_query(data))
+        cur.execute(*build_submit_query(data, True))
+        held_id = cur.fetchone()["id"]
+        waiting = executor.submit(client.post, "/api/applications", json=racer)
+        time.sleep(0.3)
+        assert not waiting.done()
+        conn.commit()
+        response = waiting.result(timeout=5)
+    assert response.status_code == 409
+    assert [d["id"] for d in response.json()["detail"]["duplicates"]] == [held_id]
+
+    # PANs without letters or digits are not shared by each other
+    for blank in ("", "--"):
+        response = client.post("/api/applications", json={**_application_payload(marker), "pan": blank})
+        assert response.status_code == 200 and response.json()["duplicates"] == []
+
+def _application_payload(marker, name=None, father_name="Another Parent", pan=None):
+    return {
+        "username": f"dup_{marker}", "name": name or f"Someone {uuid.uuid4().hex[:8]}", "father_name": father_name, "date_of_birth": "1991-02-03",
+        "permanent_address": "8 Copy Lane", "temporary_address": "8 Copy Lane", "phone": "5550002222",
+        "email": "dup2@example.com", "pan": pan or "".join(chr(ord("A") + int(c, 16) % 26) for c in uuid.uuid4().hex[:5]) + "0000Z",
+    }
+
+# Test 55: The batch dedupe pass groups the whole table into clusters and keeps reviews across runs
+def test_dedupe_job_clusters_existing_rows():
+    import dedupe
+    marker = uuid.uuid4().hex[:8]
+    pan = "".join(chr(ord("A") + int(c, 16) % 26) for c in marker[:5]) + "5678Q"
+    with pool.connection() as conn:
+        with conn.cursor() as cur:
+            # Loaded behind the API's back, as an import would
+            cur.execute(
+                "INSERT INTO applications (username, name, father_name, date_of_birth, permanent_address, temporary_address, phone, email, pan) "
+                "SELECT 'dedupe', 'Batch ' || i, 'Parent', DATE '1980-01-01', 'x', 'x', '1', 'd@example.com', %s "
+                "FROM generate_series(1, 3) i RETURNING id",
+                (pan,),
+            )
+            ids = sorted(row["id"] for row in cur.fetchall())
+            conn.commit()
+            cur.execute(
+                "INSERT INTO applications (username, name, father_name, date_of_birth, permanent_address, temporary_address, phone, email, pan) "
+                "SELECT 'dedupe', 'Blank ' || i || %s, 'Parent', DATE '1980-01-01', 'x', 'x', '1', 'd@example.com', p "
+                "FROM unnest(ARRAY['', '-', ' ']) WITH ORDINALITY AS t(p, i)",
+                (marker,),
+            )
+            conn.commit()
+        report = dedupe.find_duplicates(conn)
+        assert report["clusters"] >= 1 and report["created"] >= 1
+        with conn.cursor() as cur:
+            cur.execute("SELECT id, application_ids, status FROM duplicate_clusters WHERE match_type = 'pan' AND match_key = %s", (pan,))
+            cluster = cur.fetchone()
+            cur.execute("SELECT count(*) AS n FROM duplicate_clusters WHERE match_type = 'pan' AND match_key = ''")
+            assert cur.fetchone()["n"] == 0
+        assert cluster["application_ids"] == ids and cluster["status"] == "open"
+
+    assert client.put(f"/api/applications/duplicates/{cluster['id']}?status=dismissed").json()["cluster"]["status"] == "dismissed"
+    assert cluster["id"] in [c["id"] for c in client.get("/api/applications/duplicates?status=dismissed&limit=500").json()]
+    with pool.connection() as conn:
+        # Nothing changed: the review stands
+        dedupe.find_duplicates(conn)
+        with conn.cursor() as cur:
+            cur.execute("SELECT status FROM duplicate_clusters WHERE id = %s", (cluster["id"],))
+            assert cur.fetchone()["status"] == "dismissed"
+            cur.execute("DELETE FROM applications WHERE id = ANY(%s)", (ids[1:],))
+            conn.commit()
+        # Only one application left with that PAN
+        dedupe.find_duplicates(conn)
+        with conn.cursor() as cur:
+            cur.execute("SELECT status FROM duplicate_clusters WHERE id = %s", (cluster["id"],))
+            assert cur.fetchone()["status"] == "dismissed"
+
+# Test 56: A retried submission with the same Idempotency-Key replays the first response to the same caller without inserting again
+def test_idempotent_submission_replays():
+    marker = uuid.uuid4().hex[:8]
+    payload = _application_payload(marker)
+    headers = {"Idempotency-Key": f"submit-{marker}"}
+    first = client.post("/api/applications", json=payload, headers=headers)
+    assert first.status_code == 200 and "idempotent-replayed" not in first.headers
+    retry = client.post("/api/applications", json=payload, headers=headers)
+    assert retry.status_code == 200 and retry.headers["idempotent-replayed"] == "true"
+    assert retry.json() == first.json()
+    with pool.connection() as conn, conn.cursor() as cur:
+        cur.execute("SELECT count(*) AS n FROM applications WHERE username = %s", (f"dup_{marker}",))
+        assert cur.fetchone()["n"] == 1
+
+    changed = client.post("/api/applications", json={**payload, "name": "Changed"}, headers=headers)
+    assert changed.status_code == 422
+    # Without a key every request runs
+    assert "idempotent-replayed" not in client.post("/api/applications", json=payload).headers
+    # Keys belong to the caller: another user, or an anonymous client, with the same key runs afresh
+    other = {"Authorization": f"Bearer {tokens.issue(f'other_{marker}', 'Applicant')}", **headers}
+    anonymous = {"Authorization": "", **headers}
+    assert "idempotent-replayed" not in client.post("/api/applications", json=payload, headers=other).headers
+    assert "idempotent-replayed" not in client.post("/api/applications", json=payload, headers=anonymous).headers
+    assert client.post("/api/applications", json=payload, headers=anonymous).headers["idempotent-replayed"] == "true"
+
+    # Signup: a repeat gets the original success instead of "Username already exists"
+    signup = {"username": f"idem_{marker}", "email": f"idem_{marker}@example.com", "password": "idempass", "category": "Applicant"}
+    assert client.post("/api/signup", json=signup, headers=headers).status_code == 200
+    again = client.post("/api/signup", json=signup, headers=headers)
+    assert again.status_code == 200 and again.json()["message"] == "User created successfully"
+
+# Test 57: A duplicate arriving while the first request runs waits for its result; failures are not recorded
+def test_idempotency_concurrent_duplicates_wait(monkeypatch):
+    import idempotency
+    calls = []
+
+    async def slow_app(scope, receive, send):
+        calls.append((await receive())["body"])
+        await asyncio.sleep(0.1)
+        status = 500 if len(calls) == 1 and scope["path"] == "/api/signup" else 200
+        await send({"type": "http.response.start", "status": status, "headers": [(b"content-type", b"text/plain")]})
+        await send({"type": "http.response.body", "body": f"call {len(calls)}".encode()})
+
+    async def request(middleware, path, key="k", body=b"{}"):
+        messages = []
+        received = iter([{"type": "http.request", "body": body, "more_body": False}])
+
+        async def receive():
+            return next(received, {"type": "http.disconnect"})
+
+        async def send(message):
+            messages.append(message)
+
+        scope = {"type": "http", "method": "POST", "path": path, "headers": [(b"idempotency-key", key.encode())]}
+        await middleware(scope, receive, send)
+        headers = dict(messages[0]["headers"])
+        return messages[0]["status"], messages[1]["body"], headers.get(b"idempotent-replayed")
+
+    async def scenario():
+        middleware = idempotency.IdempotencyMiddleware(slow_app)
+        first, second = await asyncio.gather(request(middleware, "/api/applications"), request(middleware, "/api/applications"))
+        assert len(calls) == 1
+        assert first == (200, b"call 1", None) and second == (200, b"call 1", b"true")
+        # A 5xx releases the key, so the retry runs the handler again
+        calls.clear()
+        assert await request(middleware, "/api/signup") == (500, b"call 1", None)
+        assert await request(middleware, "/api/signup") == (200, b"call 2", None)
+
+    monkeypatch.setattr(idempotency, "store", idempotency.MemoryStore())
+    asyncio.run(scenario())
+
+# Test 58: Old decided applications move to the archive; totals stay, API caches are invalidated and include_archived still reads them
+def test_archive_moves_old_decided_applications():
+    import archive
+    import cache
+    username = f"archive-{uuid.uuid4().hex[:8]}"
+    with pool.connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                "INSERT INTO applications (username, name, father_name, date_of_birth, permanent_address, temporary_address, phone, email, pan, status, created_at) "
+                "SELECT %s, 'Archive ' || s, 'Parent', DATE '1970-01-01', 'x', 'x', '1', 'a@example.com', 'ARCHV1234Z', s, NOW() - d * INTERVAL '1 day' "
+                "FROM (VALUES ('accepted', 400), ('pending', 390), ('rejected', 10)) v(s, d) RETURNING id, status",
+                (username,),
+            )
+            ids = {row["status"]: row["id"] for row in cur.fetchall()}
+            conn.commit()
+            cur.execute("SELECT status, sum(total) AS total FROM application_status_counts GROUP BY status")
+            totals = {row["status"]: row["total"] for row in cur.fetchall()}
+        # An API worker's cache, in another process in production, hears about the run
+        worker_cache = cache.ResponseCache(cache.MemoryBackend())
+        listener = cache.InvalidationListener(worker_cache, os.getenv("DATABASE_URL"))
+        listener.start()
+        try:
+            deadline = time.monotonic() + 5
+            while worker_cache.backend.get(worker_cache.GENERATION_KEY) is None and time.monotonic() < deadline:
+                time.sleep(0.01)
+            generation = worker_cache.backend.get(worker_cache.GENERATION_KEY)
+            assert generation is not None
+            assert archive.archive_decided(conn, older_than_days=365, pause=0) >= 1
+            while worker_cache.backend.get(worker_cache.GENERATION_KEY) == generation and time.monotonic() < deadline:
+                time.sleep(0.01)
+            assert worker_cache.backend.get(worker_cache.GENERATION_KEY) != generation
+        finally:
+            listener.stop()
+        with conn.cursor() as cur:
+            cur.execute("SELECT status, sum(total) AS total FROM application_status_counts GROUP BY status")
+            assert {row["status"]: row["total"] for row in cur.fetchall()} == totals
+            cur.execute("SELECT id FROM applications_archive WHERE username = %s", (username,))
+            assert [row["id"] for row in cur.fetchall()] == [ids["accepted"]]
+
+    # Pending and recent rows stay live; the archived one is only read on request
+    live = client.get(f"/api/applications?username={username}").json()
+    assert sorted(a["id"] for a in live) == sorted([ids["pending"], ids["rejected"]])
+    history = client.get(f"/api/applications?username={username}&include_archived=true&limit=2")
+    assert [a["id"] for a in history.json()] == [ids["rejected"], ids["pending"]]
+    rest = client.get(f"/api/applications?username={username}&include_archived=true&cursor={history.headers['X-Next-Cursor']}")
+    assert [a["id"] for a in rest.json()] == [ids["accepted"]]
+    assert client.get(f"/api/applications/{ids['accepted']}").status_code == 404
+    archived = client.get(f"/api/applications/{ids['accepted']}?include_archived=true")
+    assert archived.status_code == 200 and archived.json()["status"] == "accepted"
+    export_rows = client.get(f"/api/applications/export?format=ndjson&username={username}&include_archived=true").text.splitlines()
+    assert len(export_rows) == 3
+    # Archived applications are final
+    assert client.put(f"/api/applications/{ids['accepted']}?status=pending").status_code == 404
+
+# Test 59: Reads go to healthy, caught-up replicas; a writer reads the primary until a replica has their write
+def test_replica_read_routing(monkeypatch):
+    import replicas
+    # The local database stands in for a replica; nothing listens on port 1
+    live = replicas.Replica("replica0", os.getenv("DATABASE_URL"))
+    dead = replicas.Replica("replica1", "postgresql://postgres@localhost:1/passport")
+    router = replicas.ReplicaRouter(pool, async_db.pool, [live, dead])
+    monkeypatch.setattr(replicas, "router", router)
+    try:
+        status = router.probe()
+        assert status["replica0"]["healthy"] and status["replica0"]["lag_seconds"] == 0
+        assert not status["replica1"]["healthy"] and status["replica1"]["error"]
+        assert router.choose() is live and router.choose("someone") is live
+
+        assert client.get("/api/applications?limit=1").status_code == 200
+        assert live.pool.stats()["connections_created"] >= 1
+        # Its waits are reported under its own name, not as the primary's
+        import metrics
+        assert 'db_pool_acquire_duration_seconds_count{engine="replica0"}' in metrics.registry.render()
+
+        app_id = _create_application(f"replica-{uuid.uuid4().hex[:8]}")
+        assert client.put(f"/api/applications/{app_id}?status=accepted").status_code == 200
+        # The writer stays on the primary (and off the cache) until a probe sees the write replayed
+        assert router.pinned("test-admin") and router.choose("test-admin") is None
+        assert router.choose("someone-else") is live
+        assert client.get(f"/api/applications/{app_id}").json()["status"] == "accepted"
+        router.probe()
+        assert not router.pinned("test-admin") and router.choose("test-admin") is live
+
+        # Too far behind: reads fall back to the primary
+        live.lag = router.max_lag + 1
+        assert router.choose() is None
+        # A replica that fails at connect time is ejected and the read still succeeds on the primary
+        live.healthy = False
+        dead.healthy, dead.lag = True, 0.0
+        with router.connection() as conn, conn.cursor() as cur:
+            cur.execute("SELECT pg_backend_pid() AS pid")
+            assert cur.fetchone()["pid"]
+        assert not dead.healthy and dead.error
+        # A replica that drops the connection mid-read is ejected too; that read fails, the next goes to the primary
+        import psycopg2
+        live.healthy, live.lag = True, 0.0
+        with pytest.raises(psycopg2.OperationalError):
+            with router.connection() as conn, conn.cursor() as cur:
+                cur.execute("SELECT pg_terminate_backend(pg_backend_pid())")
+        assert not live.healthy and router.choose() is None
+    finally:
+        router.close()
+
+# Test 60: Decisions queue outbox events in the same transaction; workers deliver, retry with backoff and dead-letter
+def test_outbox_delivery_retries_and_dead_letters():
+    import outbox
+    app_id = _create_application(f"outbox-{uuid.uuid4().hex[:8]}")
+    client.put(f"/api/applications/{app_id}?status=pending")
+    assert client.put(f"/api/applications/{app_id}?status=rejected").status_code == 200
+    with pool.connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT id, payload, status FROM outbox WHERE application_id = %s", (app_id,))
+            events = cur.fetchall()
+        # Only the move to a decided status is an event
+        assert len(events) == 1 and events[0]["status"] == "pending"
+        assert events[0]["payload"]["status"] == "rejected" and events[0]["payload"]["previous_status"] == "pending"
+        event_id = events[0]["id"]
+
+        # Two workers never claim the same row
+        with pool.connection() as other:
+            with conn.cursor() as cur, other.cursor() as other_cur:
+                cur.execute(outbox.CLAIM_SQL, (60, 10000))
+                claimed = {r["id"] for r in cur.fetchall()}
+                other_cur.execute(outbox.CLAIM_SQL, (60, 10000))
+                assert event_id in claimed and not claimed & {r["id"] for r in other_cur.fetchall()}
+            conn.rollback()
+            other.rollback()
+
+        seen, during = [], []
+
+        def flaky(event):
+            if event["application_id"] == app_id:
+                seen.append(event["id"])
+                # Delivery runs after the claim committed: the row is leased, not locked
+                with pool.connection() as other, other.cursor() as cur:
+                    cur.execute("SELECT available_at > NOW() AS leased FROM outbox WHERE id = %s FOR UPDATE NOWAIT", (event["id"],))
+                    leased = cur.fetchone()["leased"]
+                    cur.execute(outbox.CLAIM_SQL, (60, 10000))
+                    during.append((leased, event["id"] in {r["id"] for r in cur.fetchall()}))
+                    other.rollback()
+                raise ConnectionError("mail server down")
+
+        handlers = {"application.decided": [flaky]}
+
+        def run_until(status):
+            for _ in range(outbox.MAX_ATTEMPTS + 5):
+                with conn.cursor() as cur:
+                    # Skip the backoff wait
+                    cur.execute("UPDATE outbox SET available_at = NOW() WHERE id = %s", (event_id,))
+                    conn.commit()
+                while outbox.process_batch(conn, handlers, batch_size=500, max_attempts=3)["claimed"]:
+                    pass
+                with conn.cursor() as cur:
+                    cur.execute("SELECT status, attempts, last_error, available_at > NOW() AS delayed FROM outbox WHERE id = %s", (event_id,))
+                    row = cur.fetchone()
+                if row["status"] == status:
+                    return row
+            raise AssertionError(f"event never became {status}")
+
+        dead = run_until("dead")
+        assert dead["attempts"] == 3 and len(seen) == 3 and "mail server down" in dead["last_error"]
+        assert during == [(True, False)] * 3
+        assert outbox.requeue(conn, [event_id]) == 1
+        handlers["application.decided"] = [lambda event: seen.append(event["id"])]
+        delivered = run_until("delivered")
+        assert delivered["attempts"] == 1 and delivered["last_error"] is None and seen[-1] == event_id
+
+# Test 61: Logs carry the request's correlation id, mask PII, sample successes and drop instead of blocking
+def test_structured_logging(monkeypatch):
+    import io
+    import logging
+    import logs
+    records, stop = _capture_logs("passport.access")
+    try:
+        response = client.get("/api/applications?limit=1", headers={"X-Request-ID": "trace-123"})
+        assert response.headers["X-Request-ID"] == "trace-123"
+        generated = client.get("/api/applications?limit=1", headers={"X-Request-ID": "not valid!"})
+        assert len(generated.headers["X-Request-ID"]) == 32
+        assert records[0].request_id == "trace-123"
+        assert records[0].fields == {**records[0].fields, "route": "/api/applications", "status": 200}
+
+        # Successes are sampled away at rate 0; errors are always logged
+        records.clear()
+        sampled = FastAPI()
+        sampled.get("/ok")(lambda: {})
+        sampled.add_middleware(logs.RequestLogMiddleware, sample_rate=0, slow_ms=0)
+        sampled_client = TestClient(sampled)
+        sampled_client.get("/ok")
+        sampled_client.get("/missing")
+        assert [r.fields["status"] for r in records] == [404]
+    finally:
+        stop()
+
+    # The submit handler no longer prints the application
+    printed = []
+    monkeypatch.setattr("builtins.print", lambda *args, **kwargs: printed.append(args))
+    assert client.post("/api/applications", json=_application_payload("logs")).status_code == 200
+    monkeypatch.undo()
+    assert printed == []
+
+    # Sensitive fields, and PANs in free text, are masked by the formatter
+    record = logging.LogRecord("passport.api", logging.ERROR, __file__, 1, "Key (pan)=(ABCDE1234F) exists", None, None)
+    record.request_id = "r1"
+    record.fields = {"pan": "ABCDE1234F", "phone": "123", "nested": {"permanent_address": "x"}, "username": "u"}
+    entry = json.loads(logs.JsonFormatter().format(record))
+    assert entry["message"] == "Key (pan)=([redacted]) exists" and entry["request_id"] == "r1"
+    assert entry["pan"] == entry["phone"] == entry["nested"]["permanent_address"] == "[redacted]"
+    assert entry["username"] == "u"
+    # So are the rest of an application's personal details, wherever they appear
+    application = _application_payload("logs")
+    record.fields = {"application": application}
+    logged = json.loads(logs.JsonFormatter().format(record))["application"]
+    assert {k for k, v in logged.items() if v != "[redacted]"} == {"username"}
+    text = logs.TextFormatter().format(record)
+    assert not any(application[k] in text for k in ("name", "father_name", "date_of_birth", "email"))
+
+    # A full queue drops records instead of blocking the caller
+    target = logging.StreamHandler(io.StringIO())
+    handler = logs.DroppingQueueHandler(target, size=2)
+    handler._pid = os.getpid()  # no listener: nothing drains the queue
+    dropped_before = logs.dropped_total._values.get((), 0)
+    for i in range(5):
+        handler.handle(logging.LogRecord("passport", logging.INFO, __file__, 1, "message %d", (i,), None))
+    assert handler.dropped == 3 and handler.queue.qsize() == 2
+    assert logs.dropped_total._values.get((), 0) == dropped_before + 3
+
+# Test 62: Export errors are reported with an error status, not as a truncated file
+def test_export_errors_before_streaming(monkeypatch):
+    import main
+    raw = TestClient(app, headers=ADMIN_HEADERS, raise_server_exceptions=False)
+    in_use = pool.stats()["in_use"]
+    # Fails while the query runs, not when it is declared
+    monkeypatch.setattr(main, "build_export_query", lambda *args: ("SELECT 1 / (i - 1) FROM generate_series(1, 3) i", ()))
+    response = raw.get("/api/applications/export?format=csv")
+    assert response.status_code == 500 and "id,username" not in response.text
+
+    def exhausted(timeout=None):
+        raise PoolTimeout("No database connection available")
+    monkeypatch.setattr(pool, "getconn", exhausted)
+    assert raw.get("/api/applications/export?format=ndjson").status_code == 503
+    monkeypatch.undo()
+    assert pool.stats()["in_use"] == in_use
+    assert client.get("/api/applications/export?format=csv&username=nobody").text.startswith("id,username")
+
+# Test 63: The async engine ejects an unreachable or disconnected replica and reads from the primary
+def test_async_replica_ejection():
+    import psycopg
+    import replicas
+    live = replicas.Replica("replica0", os.getenv("DATABASE_URL"))
+    dead = replicas.Replica("replica1", "postgresql://postgres@localhost:1/passport")
+    primary = async_db.AsyncConnectionPool(os.getenv("DATABASE_URL"), min_size=0, max_size=2)
+    router = replicas.ReplicaRouter(pool, primary, [live, dead])
+
+    async def scenario():
+        try:
+            dead.healthy, dead.lag = True, 0.0
+            async with router.async_connection() as conn:
+                cur = await conn.execute("SELECT 1 AS one")
+                assert (await cur.fetchone())["one"] == 1
+            assert not dead.healthy and "could not connect" in dead.error
+
+            live.healthy, live.lag = True, 0.0
+            with pytest.raises(psycopg.OperationalError):
+                async with router.async_connection() as conn:
+                    await conn.execute("SELECT pg_terminate_backend(pg_backend_pid())")
+            assert not live.healthy and router.choose() is None
+        finally:
+            await router.close_async()
+            await primary.close()
+
+    asyncio.run(scenario())
+
+# Test 64: Signup cannot create administrators; create_admin.py can
+def test_signup_cannot_create_administrators():
+    import psycopg2
+    import create_admin
+    from credentials import hasher_from_env
+    anonymous = TestClient(app)
+    username = f"admin_{uuid.uuid4().hex[:10]}"
+    account = {"username": username, "email": f"{username}@example.com", "password": "adminpass"}
+
+    response = anonymous.post("/api/signup", json={**account, "category": ADMIN_CATEGORY})
+    assert response.status_code == 422
+    assert anonymous.post("/api/login", json={"email": account["email"], "password": "adminpass"}).status_code == 401
+
+    conn = psycopg2.connect(os.getenv("DATABASE_URL"))
+    try:
+        assert create_admin.create_admin(conn, username, account["email"], hasher_from_env().hash("adminpass"))
+        assert not create_admin.create_admin(conn, username, account["email"], "unused")
+    finally:
+        conn.close()
+    login = anonymous.post("/api/login", json={"email": account["email"], "password": "adminpass"}).json()
+    assert login["category"] == ADMIN_CATEGORY and tokens.verify(login["token"])["cat"] == ADMIN_CATEGORY
+    # Signup without a category still creates an applicant
+    applicant = f"appl_{uuid.uuid4().hex[:10]}"
+    response = anonymous.post("/api/signup", json={"username": applicant, "email": f"{applicant}@example.com", "password": "x"})
+    assert response.status_code == 200 and response.json()["category"] == "Applicant"
+
+# Test 65: Applicants list and read only their own applications; administrators read any
+def test_applicants_read_only_their_own_applications():
+    anonymous = TestClient(app)
+    sessions, ids = {}, {}
+    for who in ("mine", "theirs"):
+        username = f"own_{who}_{uuid.uuid4().hex[:8]}"
+        anonymous.post("/api/signup", json={"username": username, "email": f"{username}@example.com", "password": "ownpass"})
+        login = anonymous.post("/api/login", json={"email": f"{username}@example.com", "password": "ownpass"}).json()
+        sessions[who] = (username, {"Authorization": f"Bearer {login['token']}"})
+        response = client.post("/api/applications", json={**_application_payload(who), "username": username})
+        ids[who] = response.json()["application"]["id"]
+    mine, headers = sessions["mine"]
+    theirs, _ = sessions["theirs"]
+
+    for params in ({}, {"username": theirs}):
+        listed = anonymous.get("/api/applications", params=params, headers=headers).json()
+        assert [a["id"] for a in listed] == [ids["mine"]]
+    assert anonymous.get(f"/api/applications/{ids['mine']}", headers=headers).json()["username"] == mine
+    # Cached for the administrator first, still not found for another applicant
+    assert client.get(f"/api/applications/{ids['theirs']}").json()["username"] == theirs
+    assert anonymous.get(f"/api/applications/{ids['theirs']}", headers=headers).status_code == 404
+    assert anonymous.get(f"/api/applications/{ids['theirs']}", params={"include_archived": "true"}, headers=headers).status_code == 404
+    assert [a["id"] for a in client.get("/api/applications", params={"username": theirs}).json()] == [ids["theirs"]]
+    assert anonymous.get("/api/applications").status_code == 401
+
+# Test 66: Imported rows bypass the submit check but are clustered with the applications they duplicate
+def test_import_clusters_duplicates():
+    marker = uuid.uuid4().hex[:8]
+    pan = "".join(chr(ord("A") + int(c, 16) % 26) for c in marker[:5]) + "9876Q"
+    first = client.post("/api/applications", json=_application_payload(marker, name=f"Imported {marker}", pan=pan)).json()
+    first_id = first["application"]["id"]
+    with pool.connection() as conn, conn.cursor() as cur:
+        # An open cluster the import does not touch stays open
+        cur.execute("INSERT INTO duplicate_clusters (match_type, match_key, application_ids, size) "
+                    "VALUES ('pan', %s, '{1,2}', 2) RETURNING id", (f"UNTOUCHED{marker}",))
+        untouched = cur.fetchone()["id"]
+        conn.commit()
+
+    csv_data = (
+        "username,name,father_name,date_of_birth,permanent_address,temporary_address,phone,email,pan\n"
+        f"imp_{marker},Someone {marker},Other Parent,1980-01-01,P,T,5550000001,a@example.com,{pan.lower()}\n"
+        f"imp_{marker},imported {marker},another parent,1991-02-03,P,T,5550000002,b@example.com,{pan[:5]}0002Y\n"
+        f"imp_{marker},Unrelated {marker},Nobody,1970-01-01,P,T,5550000003,c@example.com,{pan[:5]}0001Y\n"
+    )
+    response = client.post("/api/applications/import", files={"file": ("applications.csv", csv_data, "text/csv")})
+    assert response.status_code == 200
+    assert response.json()["imported"] == 3 and response.json()["duplicate_clusters"] == 2
+
+    with pool.connection() as conn, conn.cursor() as cur:
+        cur.execute("SELECT match_type, cardinality(application_ids) AS size, status FROM duplicate_clusters "
+                    "WHERE %s = ANY(application_ids) ORDER BY match_type", (first_id,))
+        assert [tuple(r.values()) for r in cur.fetchall()] == [("identity", 2, "open"), ("pan", 2, "open")]
+        cur.execute("SELECT status FROM duplicate_clusters WHERE id = %s", (untouched,))
+        assert cur.fetchone()["status"] == "open"
+        cur.execute("DELETE FROM duplicate_clusters WHERE id = %s", (untouched,))
+        conn.commit()
+
 if __name__ == "__main__":
     pytest.main([__file__, "-v"])
@@ -24,7 +24,7 @@ try:
         for table in tables:
             print(f"  - {table[0]}")
     else:
-        print("\n⚠ No tables found. Please run setup_database.sql in Supabase SQL Editor")
+        print("\n⚠ No tables found. Please run `python migrate.py`")
     
     cur.close()
     conn.close()
@@ -0,0 +1,169 @@
+"""HMAC-signed session tokens, verified in memory on every request.
+
+A token is ``<kid>.<payload>.<signature>``: the payload is base64url JSON
+with the username (``sub``), category (``cat``), issue and expiry times and a
+random id (``jti``), and the signature is HMAC-SHA256 over ``<kid>.<payload>``
+with the key named ``kid``. Checking one costs a hash and a JSON parse, so
+authorization never touches the users table.
+
+Keys come from SESSION_KEYS as ``kid:secret`` pairs separated by commas. The
+first key signs new tokens; the rest are still accepted, so a key can be
+rotated by prepending a new one and dropping the old one after SESSION_TTL.
+"""
+import base64
+import hashlib
+import hmac
+import json
+import logging
+import os
+import secrets
+import threading
+import time
+from typing import Optional
+
+from fastapi import Header, HTTPException, Query
+
+ADMIN_CATEGORY = "Passport Administrator"
+# Seconds a token stays valid
+SESSION_TTL = int(os.getenv("SESSION_TTL", "3600"))
+
+
+class InvalidToken(Exception):
+    """Raised for malformed, forged, expired or revoked tokens."""
+
+
+def _b64encode(data):
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode()
+
+
+def _b64decode(text):
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+
+def parse_keys(value):
+    """Parse ``kid:secret,kid:secret`` into an ordered {kid: secret bytes}."""
+    keys = {}
+    for item in filter(None, (part.strip() for part in value.split(","))):
+        kid, sep, secret = item.partition(":")
+        if not sep or not kid or not secret or "." in kid:
+            raise ValueError(f"SESSION_KEYS entries must look like kid:secret, got {item!r}")
+        keys[kid] = secret.encode()
+    if not keys:
+        raise ValueError("SESSION_KEYS is empty")
+    return keys
+
+
+def keys_from_env():
+    value = os.getenv("SESSION_KEYS")
+    if value:
+        return parse_keys(value)
+    # Tokens signed with a per-process key stop verifying on restart and are
+    # not accepted by other workers, which is only acceptable in development
+    logging.getLogger("passport.tokens").warning("SESSION_KEYS is not set; using a random key for this process only")
+    return {"dev": secrets.token_bytes(32)}
+
+
+class TokenService:
+    """Issues and verifies session tokens and holds the revocation list.
+
+    Revocations live in memory until the revoked token would have expired
+    anyway, so the list stays small. They are per process: with several
+    workers, revoke through every worker or rotate the key instead.
+    """
+
+    def __init__(self, keys=None, ttl=SESSION_TTL):
+        self.keys = keys or keys_from_env()
+        self.ttl = ttl
+        self._revoked = {}
+        self._lock = threading.Lock()
+
+    @property
+    def signing_kid(self):
+        return next(iter(self.keys))
+
+    def _sign(self, kid, signing_input):
+        return hmac.new(self.keys[kid], signing_input.encode(), hashlib.sha256).digest()
+
+    def issue(self, username, category, ttl=None, now=None):
+        now = int(time.time() if now is None else now)
+        payload = {
+            "sub": username,
+            "cat": category,
+            "iat": now,
+            "exp": now + (self.ttl if ttl is None else ttl),
+            "jti": secrets.token_urlsafe(12),
+        }
+        kid = self.signing_kid
+        signing_input = f"{kid}.{_b64encode(json.dumps(payload, separators=(',', ':')).encode())}"
+        return f"{signing_input}.{_b64encode(self._sign(kid, signing_input))}"
+
+    def verify(self, token, now=None):
+        """Return the payload of a valid token or raise InvalidToken."""
+        try:
+            kid, body, signature = token.split(".")
+        except ValueError:
+            raise InvalidToken("Malformed token")
+        if kid not in self.keys:
+            raise InvalidToken("Unknown signing key")
+        try:
+            valid = hmac.compare_digest(self._sign(kid, f"{kid}.{body}"), _b64decode(signature))
+            payload = json.loads(_b64decode(body)) if valid else None
+        except ValueError:
+            raise InvalidToken("Malformed token")
+        if not valid:
+            raise InvalidToken("Invalid signature")
+        if payload["exp"] <= (time.time() if now is None else now):
+            raise InvalidToken("Token expired")
+        if payload["jti"] in self._revoked:
+            raise InvalidToken("Token revoked")
+        return payload
+
+    def revoke(self, payload):
+        """Reject this token from now on (until it would have expired)."""
+        now = time.time()
+        with self._lock:
+            # Prune on write so reads stay a plain dict lookup
+            self._revoked = {jti: exp for jti, exp in self._revoked.items() if exp > now}
+            self._revoked[payload["jti"]] = payload["exp"]
+
+
+tokens = TokenService()
+
+
+def _session(token):
+    if not token:
+        raise HTTPException(status_code=401, detail="Not authenticated", headers={"WWW-Authenticate": "Bearer"})
+    try:
+        return tokens.verify(token)
+    except InvalidToken as e:
+        raise HTTPException(status_code=401, detail=str(e), headers={"WWW-Authenticate": "Bearer"})
+
+
+def _bearer(authorization):
+    scheme, _, token = (authorization or "").partition(" ")
+    return token.strip() if scheme.lower() == "bearer" else None
+
+
+def is_admin(session):
+    return session["cat"] == ADMIN_CATEGORY
+
+
+def _admin(session):
+    if not is_admin(session):
+        raise HTTPException(status_code=403, detail="Administrator access required")
+    return session
+
+
+def require_user(authorization: Optional[str] = Header(None)):
+    """Dependency: the verified session from ``Authorization: Bearer <token>``."""
+    return _session(_bearer(authorization))
+
+
+def require_admin(authorization: Optional[str] = Header(None)):
+    """Dependency: like require_user, and the session must be an administrator's."""
+    return _admin(_session(_bearer(authorization)))
+
+
+def require_admin_stream(authorization: Optional[str] = Header(None), token: Optional[str] = Query(None)):
+    """require_admin that also reads ``?token=``, since EventSource cannot set headers."""
+    return _admin(_session(_bearer(authorization) or token))
@@ -0,0 +1,6 @@
+#!/bin/bash
+# Runs once, when the db volume is first initialised: lets the replica
+# service stream WAL from this server. Existing volumes need the same
+# pg_hba.conf line added by hand (then SELECT pg_reload_conf()).
+set -e
+echo "host replication all all scram-sha-256" >> "$PGDATA/pg_hba.conf"
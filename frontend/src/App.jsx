@@ -21,7 +21,7 @@ function App() {
         />
         <Route 
           path="/admin" 
-          element={user?.category === 'Passport Administrator' ? <AdminDashboard /> : <Navigate to="/" />} 
+          element={user?.category === 'Passport Administrator' ? <AdminDashboard user={user} /> : <Navigate to="/" />} 
         />
       </Routes>
     </BrowserRouter>
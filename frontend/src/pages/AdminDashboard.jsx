@@ -1,43 +1,152 @@
 import { useState, useEffect } from 'react'
 
-export default function AdminDashboard() {
+const API_URL = 'https://passport-backend-1mhm.onrender.com/api/applications'
+const PAGE_SIZE = 50
+// The address columns are large; they are loaded per application on demand
+const LIST_FIELDS = 'id,name,father_name,date_of_birth,email,phone,pan,status,created_at'
+
+export default function AdminDashboard({ user }) {
+  const auth = { Authorization: `Bearer ${user.token}` }
   const [applications, setApplications] = useState([])
+  const [nextCursor, setNextCursor] = useState(null)
+  const [selected, setSelected] = useState([])
   const [error, setError] = useState('')
+  const [query, setQuery] = useState('')
 
   useEffect(() => {
     fetchApplications()
+
+    // Live deltas; EventSource reconnects and resumes from the last event id on its own.
+    // It cannot send headers, so the token goes in the query string.
+    const source = new EventSource(`${API_URL}/changes?token=${encodeURIComponent(user.token)}`)
+    source.addEventListener('change', (e) => {
+      const { op, application } = JSON.parse(e.data)
+      setApplications(prev => {
+        const existing = prev.find(app => app.id === application.id)
+        if (existing) {
+          return prev.map(app => app.id === application.id ? { ...app, status: application.status } : app)
+        }
+        return op === 'insert' ? [application, ...prev] : prev
+      })
+    })
+    source.addEventListener('reset', () => fetchApplications())
+    return () => source.close()
   }, [])
 
-  const fetchApplications = async () => {
+  const fetchApplications = async (cursor = null) => {
     try {
-      const res = await fetch('https://passport-backend-1mhm.onrender.com/api/applications')
+      const params = new URLSearchParams({ limit: PAGE_SIZE, fields: LIST_FIELDS })
+      if (cursor) params.set('cursor', cursor)
+      const res = await fetch(`${API_URL}?${params}`, { headers: auth })
       const data = await res.json()
-      setApplications(data)
+      setApplications(prev => cursor ? [...prev, ...data] : data)
+      setNextCursor(res.headers.get('X-Next-Cursor'))
     } catch (err) {
       setError('Failed to load applications')
     }
   }
 
+  const handleSearch = async (e) => {
+    e.preventDefault()
+    if (!query.trim()) {
+      fetchApplications()
+      return
+    }
+    try {
+      // Name, father's name or address words; a PAN or phone number is matched exactly
+      const params = new URLSearchParams({ q: query, limit: PAGE_SIZE, fields: LIST_FIELDS })
+      const res = await fetch(`${API_URL}/search?${params}`, { headers: auth })
+      const data = await res.json()
+      if (!res.ok) {
+        setError(data.detail || 'Search failed')
+        return
+      }
+      setApplications(data.results)
+      setNextCursor(null)
+    } catch (err) {
+      setError('Search failed')
+    }
+  }
+
   const handleStatusUpdate = async (appId, status) => {
     try {
-      const res = await fetch(`https://passport-backend-1mhm.onrender.com/api/applications/${appId}?status=${status}`, {
-        method: 'PUT'
+      const res = await fetch(`${API_URL}/${appId}?status=${status}`, {
+        method: 'PUT',
+        headers: auth
       })
 
       if (res.ok) {
-        fetchApplications()
+        const data = await res.json()
+        setApplications(prev => prev.map(app => app.id === appId ? { ...app, status: data.application.status } : app))
       }
     } catch (err) {
       setError('Failed to update application')
     }
   }
 
+  const loadAddresses = async (appId) => {
+    try {
+      const res = await fetch(`${API_URL}/${appId}?fields=permanent_address,temporary_address`, { headers: auth })
+      if (res.ok) {
+        const data = await res.json()
+        setApplications(prev => prev.map(app => app.id === appId ? { ...app, ...data } : app))
+      }
+    } catch (err) {
+      setError('Failed to load addresses')
+    }
+  }
+
+  const toggleSelected = (appId) => {
+    setSelected(prev => prev.includes(appId) ? prev.filter(id => id !== appId) : [...prev, appId])
+  }
+
+  const handleBulkUpdate = async (status) => {
+    try {
+      const res = await fetch(`${API_URL}/bulk-status`, {
+        method: 'POST',
+        headers: { ...auth, 'Content-Type': 'application/json' },
+        body: JSON.stringify({ updates: selected.map(id => ({ id, status })) })
+      })
+
+      if (res.ok) {
+        const data = await res.json()
+        const changed = Object.fromEntries(data.updated.map(u => [u.id, u.status]))
+        setApplications(prev => prev.map(app => app.id in changed ? { ...app, status: changed[app.id] } : app))
+        setSelected([])
+      }
+    } catch (err) {
+      setError('Failed to update applications')
+    }
+  }
+
   return (
     <div style={styles.container}>
       <div style={styles.card}>
         <h2>Passport Administrator Dashboard</h2>
         
         {error && <p style={styles.error}>{error}</p>}
+
+        <form onSubmit={handleSearch} style={styles.search}>
+          <input
+            type="search"
+            placeholder="Search by name, address, PAN or phone"
+            value={query}
+            onChange={(e) => setQuery(e.target.value)}
+            style={styles.searchInput}
+          />
+          <button type="submit" style={{...styles.button, backgroundColor: '#1877f2'}}>Search</button>
+        </form>
+
+        {selected.length > 0 && (
+          <div style={styles.actions}>
+            <button onClick={() => handleBulkUpdate('accepted')} style={{...styles.button, backgroundColor: '#28a745'}}>
+              Accept {selected.length} selected
+            </button>
+            <button onClick={() => handleBulkUpdate('rejected')} style={{...styles.button, backgroundColor: '#dc3545'}}>
+              Reject {selected.length} selected
+            </button>
+          </div>
+        )}
         
         {applications.length === 0 ? (
           <p style={styles.noData}>No applications yet</p>
@@ -45,7 +154,15 @@ export default function AdminDashboard() {
           <div style={styles.applicationsList}>
             {applications.map((app, index) => (
               <div key={app.id} style={styles.applicationCard}>
-                <h3>Applicant {index + 1}</h3>
+                <h3>
+                  <input
+                    type="checkbox"
+                    checked={selected.includes(app.id)}
+                    onChange={() => toggleSelected(app.id)}
+                    disabled={app.status !== 'pending'}
+                  />{' '}
+                  Applicant {index + 1}
+                </h3>
                 <div style={styles.details}>
                   <p><strong>Name:</strong> {app.name}</p>
                   <p><strong>Father Name:</strong> {app.father_name}</p>
@@ -53,8 +170,14 @@ export default function AdminDashboard() {
                   <p><strong>Email:</strong> {app.email}</p>
                   <p><strong>Phone:</strong> {app.phone}</p>
                   <p><strong>PAN:</strong> {app.pan}</p>
-                  <p><strong>Permanent Address:</strong> {app.permanent_address}</p>
-                  <p><strong>Temporary Address:</strong> {app.temporary_address}</p>
+                  {app.permanent_address === undefined ? (
+                    <button onClick={() => loadAddresses(app.id)} style={styles.linkButton}>Show addresses</button>
+                  ) : (
+                    <>
+                      <p><strong>Permanent Address:</strong> {app.permanent_address}</p>
+                      <p><strong>Temporary Address:</strong> {app.temporary_address}</p>
+                    </>
+                  )}
                   <p><strong>Status:</strong> <span style={getStatusStyle(app.status)}>{app.status}</span></p>
                 </div>
                 <div style={styles.actions}>
@@ -75,6 +198,11 @@ export default function AdminDashboard() {
                 </div>
               </div>
             ))}
+            {nextCursor && (
+              <button onClick={() => fetchApplications(nextCursor)} style={styles.loadMore}>
+                Load more
+              </button>
+            )}
           </div>
         )}
       </div>
@@ -100,5 +228,9 @@ const styles = {
   applicationCard: { border: '1px solid #ddd', borderRadius: '8px', padding: '20px', backgroundColor: '#f9f9f9' },
   details: { marginBottom: '15px' },
   actions: { display: 'flex', gap: '10px' },
-  button: { padding: '10px 20px', color: 'white', border: 'none', borderRadius: '4px', cursor: 'pointer', fontSize: '14px' }
+  search: { display: 'flex', gap: '10px', marginBottom: '20px' },
+  searchInput: { flex: 1, padding: '10px', border: '1px solid #ddd', borderRadius: '4px', fontSize: '14px' },
+  button: { padding: '10px 20px', color: 'white', border: 'none', borderRadius: '4px', cursor: 'pointer', fontSize: '14px' },
+  linkButton: { background: 'none', border: 'none', color: '#1877f2', cursor: 'pointer', padding: 0, fontSize: '14px' },
+  loadMore: { padding: '10px 20px', backgroundColor: '#1877f2', color: 'white', border: 'none', borderRadius: '4px', cursor: 'pointer', fontSize: '14px', alignSelf: 'center' }
 }
@@ -1,4 +1,4 @@
-import { useState } from 'react'
+import { useMemo, useState } from 'react'
 
 export default function Application({ user }) {
   const [formData, setFormData] = useState({
@@ -14,6 +14,9 @@ export default function Application({ user }) {
   })
   const [success, setSuccess] = useState(false)
   const [error, setError] = useState('')
+  // One key per distinct form content: double submits and retries of the same
+  // data are recorded once by the backend, while an edited form is a new request
+  const idempotencyKey = useMemo(() => crypto.randomUUID(), [formData])
 
   const handleSubmit = async (e) => {
     e.preventDefault()
@@ -23,7 +26,7 @@ export default function Application({ user }) {
     try {
       const res = await fetch('https://passport-backend-1mhm.onrender.com/api/applications', {
         method: 'POST',
-        headers: { 'Content-Type': 'application/json' },
+        headers: { 'Content-Type': 'application/json', 'Idempotency-Key': idempotencyKey },
         body: JSON.stringify(formData)
       })
 
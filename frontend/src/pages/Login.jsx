@@ -24,7 +24,7 @@ export default function Login({ setUser }) {
         return
       }
 
-      setUser({ username: data.username, category: data.category })
+      setUser({ username: data.username, category: data.category, token: data.token })
       
       if (data.category === 'Applicant') {
         navigate('/application')
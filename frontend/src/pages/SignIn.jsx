@@ -1,4 +1,4 @@
-import { useState } from 'react'
+import { useMemo, useState } from 'react'
 import { useNavigate } from 'react-router-dom'
 
 export default function SignIn({ setUser }) {
@@ -9,6 +9,8 @@ export default function SignIn({ setUser }) {
     category: 'Applicant' 
   })
   const [error, setError] = useState('')
+  // Regenerated whenever the form changes, so a double-clicked signup runs once
+  const idempotencyKey = useMemo(() => crypto.randomUUID(), [formData])
   const [success, setSuccess] = useState(false)
   const navigate = useNavigate()
 
@@ -20,7 +22,7 @@ export default function SignIn({ setUser }) {
     try {
       const res = await fetch('https://passport-backend-1mhm.onrender.com/api/signup', {
         method: 'POST',
-        headers: { 'Content-Type': 'application/json' },
+        headers: { 'Content-Type': 'application/json', 'Idempotency-Key': idempotencyKey },
         body: JSON.stringify(formData)
       })
 
@@ -70,27 +72,6 @@ export default function SignIn({ setUser }) {
             style={styles.input}
             required
           />
-          
-          <div style={styles.radioGroup}>
-            <label style={styles.radioLabel}>
-              <input
-                type="radio"
-                value="Applicant"
-                checked={formData.category === 'Applicant'}
-                onChange={(e) => setFormData({...formData, category: e.target.value})}
-              />
-              Applicant
-            </label>
-            <label style={styles.radioLabel}>
-              <input
-                type="radio"
-                value="Passport Administrator"
-                checked={formData.category === 'Passport Administrator'}
-                onChange={(e) => setFormData({...formData, category: e.target.value})}
-              />
-              Passport Administrator
-            </label>
-          </div>
 
           {success && <p style={styles.success}>Account created! Redirecting to login...</p>}
           {error && <p style={styles.error}>{error}</p>}
@@ -112,7 +93,5 @@ const styles = {
   button: { padding: '12px', backgroundColor: '#1877f2', color: 'white', border: 'none', borderRadius: '4px', cursor: 'pointer', fontSize: '16px' },
   success: { color: 'green', fontSize: '14px', margin: 0 },
   error: { color: 'red', fontSize: '14px', margin: 0 },
-  link: { marginTop: '20px', textAlign: 'center', fontSize: '14px' },
-  radioGroup: { display: 'flex', flexDirection: 'column', gap: '10px' },
-  radioLabel: { display: 'flex', alignItems: 'center', gap: '8px', fontSize: '14px' }
+  link: { marginTop: '20px', textAlign: 'center', fontSize: '14px' }
 }